@@ -1,71 +1,184 @@
 import json
+import os
 import boto3
+import aws_clients
 import ssm_functions
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+#label an insight has to carry for each transition and the label it is moved to
+transitions = {
+    'approve': {'from': 'Initialize', 'to': 'Approved'},
+    'close': {'from': 'Executed', 'to': 'Closed'}
+}
 
 def lambda_handler(event, context):
     # TODO implement
-    
+
     print(event)
-    
+
     if event['resource'] == "/approve":
         approve_insight(event)
     elif event['resource'] == "/close":
         close_insight(event)
-    
+    elif event['resource'] == "/approve-bulk":
+        return bulkTransition('approve', event)
+    elif event['resource'] == "/close-bulk":
+        return bulkTransition('close', event)
+
     return {
         'statusCode': 200,
         'body': json.dumps('Sucessfully Executed!')
     }
 
+def getParameterKey(resource):
+
+    if resource['serviceType'] == "EC2":
+        return "/densify/iaas/ec2/" + resource['resourceId'] + "/instanceType"
+    elif resource['serviceType'] == "RDS":
+        return "/densify/iaas/rds/" + resource['name'] + "/dbInstanceClass"
+
+    return None
+
 def approve_insight(event):
-    
+
     try:
-        
+
         input = json.loads(event['body'])
         print("Approval request received for " + input['serviceType'] + " instance with name " + input['name'] + " and resource id " + input['resourceId'] + ".")
-        
-        parameterKey = ""
-        if input['serviceType'] == "EC2":
-            parameterKey = "/densify/iaas/ec2/" + input['resourceId'] + "/instanceType"
-        elif input['serviceType'] == "RDS":
-            parameterKey = "/densify/iaas/rds/" + input['name'] + "/dbInstanceClass"        
-        
-        parameter = ssm_functions.getParameter(parameterKey, region=input['region'])
-        tags = ssm_functions.list_tags('Parameter', parameterKey, region=input['region'])
-        label = ssm_functions.getParameterCurrentLabels(parameterKey, region=input['region'])
-        
-        if label[0] == 'Initialize':
-            version = ssm_functions.putParameter(parameterKey, tags['recommendedType'], description=tags['name'], region=input['region'])
-            ssm_functions.addTagsToResource('Parameter', parameterKey, [{'Key': 'approvalType', 'Value': 'Approved'}], region=input['region'])
-            ssm_functions.labelParameterVersion(parameterKey, version, ["Approved"], region=input['region'])
-            ssm_functions.putParameter('/densify/config/lastUpdatedTimestamp', datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"), description='Last time densify pushed an update', region=input['region'])
-        
+
+        parameterKey = getParameterKey(input)
+        parameter = ssm_functions.getParameter(parameterKey, region=input['region'])['Parameter']
+
+        if transitionInsight('approve', parameterKey, parameter, input['region'])['status'] == 'updated':
+            updateLastUpdatedTimestamp(input['region'])
+
     except Exception as error:
         print("Exception caught while approving request. " + str(error))
         return False
-        
+
 def close_insight(event):
-    
+
     try:
-        
+
         input = json.loads(event['body'])
         print("Close request received for " + input['serviceType'] + " instance with name " + input['name'] + " and resource id " + input['resourceId'] + ".")
-        
-        parameterKey = ""
-        if input['serviceType'] == "EC2":
-            parameterKey = "/densify/iaas/ec2/" + input['resourceId'] + "/instanceType"
-        elif input['serviceType'] == "RDS":
-            parameterKey = "/densify/iaas/rds/" + input['name'] + "/dbInstanceClass"        
-        
-        parameter = ssm_functions.getParameter(parameterKey, region=input['region'])
-        tags = ssm_functions.list_tags('Parameter', parameterKey, region=input['region'])
-        label = ssm_functions.getParameterCurrentLabels(parameterKey, region=input['region'])
-        
-        if label[0] == 'Executed':
-            version = ssm_functions.putParameter(parameterKey, tags['recommendedType'], description=tags['name'], region=input['region'])
-            ssm_functions.labelParameterVersion(parameterKey, version, ["Closed"], region=input['region'])
+
+        parameterKey = getParameterKey(input)
+        parameter = ssm_functions.getParameter(parameterKey, region=input['region'])['Parameter']
+
+        transitionInsight('close', parameterKey, parameter, input['region'])
 
     except Exception as error:
         print("Exception caught while approving request. " + str(error))
-        return False
\ No newline at end of file
+        return False
+
+#Moves one insight to the transition's label if it currently carries the expected one.  parameter is the
+#parameter as returned by GetParameter(s), so its version does not have to be read again.
+def transitionInsight(transition, parameterKey, parameter, region):
+
+    tags = ssm_functions.list_tags('Parameter', parameterKey, region=region)
+    labels = ssm_functions.getParameterCurrentLabels(parameterKey, version=parameter['Version'], region=region)
+
+    if tags == False or labels == False:
+        raise Exception ("Unable to read the tags and labels of parameter [" + parameterKey + "].")
+
+    if len(labels) == 0 or labels[0] != transitions[transition]['from']:
+        return {'parameterKey': parameterKey, 'status': 'skipped', 'label': labels[0] if len(labels) > 0 else None}
+
+    version = ssm_functions.putParameter(parameterKey, tags['recommendedType'], description=tags['name'], region=region)
+
+    if version == False:
+        raise Exception ("Unable to update parameter [" + parameterKey + "].")
+
+    if transition == 'approve':
+        ssm_functions.addTagsToResource('Parameter', parameterKey, [{'Key': 'approvalType', 'Value': 'Approved'}], region=region)
+
+    if ssm_functions.labelParameterVersion(parameterKey, version, [transitions[transition]['to']], region=region) == False:
+        raise Exception ("Unable to label version " + str(version) + " of parameter [" + parameterKey + "].")
+
+    return {'parameterKey': parameterKey, 'status': 'updated', 'label': transitions[transition]['to']}
+
+def updateLastUpdatedTimestamp(region):
+
+    return ssm_functions.putParameter('/densify/config/lastUpdatedTimestamp', datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S"), description='Last time densify pushed an update', region=region)
+
+#Number of items a bulk request moves.  Every item takes two ssm:write calls (put and label), so the default is
+#what the write rate allows in 20 seconds, leaving room for the reads under API Gateway's 29 second timeout.
+def getMaxBulkItems():
+
+    if 'MaxBulkItems' in os.environ:
+        return int(os.environ['MaxBulkItems'])
+
+    return max(1, int(aws_clients.getRate('ssm:write') * 20 / 2))
+
+#Applies a transition to a list of resources ({"resources": [{"serviceType", "name", "resourceId"}, ...]}) or to
+#every insight of a stack ({"stackName": ...}).  Parameters are read in batches of 10, the insights are moved
+#concurrently and lastUpdatedTimestamp is written once.  The body holds the result of every item.
+#
+#A request moves at most getMaxBulkItems() items.  When more remain, the body holds a nextToken, and the same
+#request is sent again with that nextToken until no nextToken is returned.
+def bulkTransition(transition, event):
+
+    try:
+
+        input = json.loads(event['body'])
+        region = input['region']
+
+        if 'stackName' in input:
+            print("Bulk " + transition + " request received for stack [" + input['stackName'] + "].")
+            parameterKeys = ssm_functions.findParameterKeysByTag('/densify/iaas', 'cloudformation:stack-name', input['stackName'], region=region)
+            if parameterKeys == False:
+                raise Exception ("Unable to list the insights of stack [" + input['stackName'] + "].")
+            #sorted, so that the nextToken offset points at the same insight on the following request
+            parameterKeys = sorted(parameterKeys)
+        else:
+            print("Bulk " + transition + " request received for " + str(len(input['resources'])) + " resource(s).")
+            parameterKeys = [getParameterKey(resource) for resource in input['resources']]
+
+        parameterKeys = list(dict.fromkeys(parameterKeys))
+        start = int(input['nextToken']) if 'nextToken' in input else 0
+        end = start + getMaxBulkItems()
+        nextToken = str(end) if end < len(parameterKeys) else None
+        parameterKeys = parameterKeys[start:end]
+
+        parameters = ssm_functions.getParameters([parameterKey for parameterKey in parameterKeys if parameterKey != None], region=region)
+
+        if parameters == False:
+            raise Exception ("Unable to read the insight parameters.")
+
+        def process(parameterKey):
+            if parameterKey == None:
+                return {'parameterKey': None, 'status': 'failed', 'error': 'Only EC2 and RDS resources are supported.'}
+            if parameterKey not in parameters:
+                return {'parameterKey': parameterKey, 'status': 'notFound'}
+            try:
+                return transitionInsight(transition, parameterKey, parameters[parameterKey], region)
+            except Exception as error:
+                return {'parameterKey': parameterKey, 'status': 'failed', 'error': str(error)}
+
+        results = []
+        if len(parameterKeys) > 0:
+            with ThreadPoolExecutor(max_workers=min(aws_clients.getPoolSize(), len(parameterKeys))) as executor:
+                results = list(executor.map(process, parameterKeys))
+
+        if transition == 'approve' and any(result['status'] == 'updated' for result in results):
+            updateLastUpdatedTimestamp(region)
+
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        print("Bulk " + transition + " results: " + str(summary))
+
+        body = {'summary': summary, 'results': results}
+        if nextToken != None:
+            body['nextToken'] = nextToken
+
+        return {
+            'statusCode': 207 if 'failed' in summary else 200,
+            'body': json.dumps(body)
+        }
+
+    except Exception as error:
+        print("Exception caught while processing bulk " + transition + " request. " + str(error))
+        return {'statusCode': 500, 'body': json.dumps({'message': str(error)})}
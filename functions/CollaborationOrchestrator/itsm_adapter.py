@@ -9,11 +9,36 @@ Created on Tue Aug 11 14:34:54 2020
 import requests
 import json
 import os
-import ssm_functions
+import base64
+import tempfile
+import threading
+import connection_settings
+import report_cache
+from urllib.parse import quote
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 serviceNowURL, serviceNowUser, serviceNowPass, densifyURL, densifyUser, densifyPass = "","","","","",""
 
+#One pooled session per base URL, kept for the lifetime of the container so that warm invocations reuse the
+#open keep-alive connections instead of doing a new TCP and TLS handshake for every call.
+sessions = {}
+sessionsLock = threading.Lock()
+retryStatusCodes = frozenset([429, 500, 502, 503, 504])
+#POST is not retried on a status, the ticket may already have been created
+retryMethods = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+#reports are moved in chunks of this size; a report without a usable Content-Length is spooled, in memory
+#up to reportSpoolSize and on disk beyond it
+reportChunkSize = 65536
+reportSpoolSize = 8 * 1024 * 1024
+
+#ServiceNow instances without the batch API are remembered so later cancellations go straight to individual updates
+batchApiUnavailable = set()
+batchSize = 50
+
 def executeFunction(function, **kwargs):
     
     try:
@@ -22,15 +47,18 @@ def executeFunction(function, **kwargs):
         
         global serviceNowURL, serviceNowUser, serviceNowPass, densifyURL, densifyUser, densifyPass
         
-        serviceNowURL = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/url')['Parameter']['Value']
-        serviceNowUser = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/username')['Parameter']['Value']
-        serviceNowPass = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/password')['Parameter']['Value']
-        densifyURL = ssm_functions.getParameter('/densify/config/connectionSettings/url')['Parameter']['Value']
-        densifyUser = ssm_functions.getParameter('/densify/config/connectionSettings/username')['Parameter']['Value']
-        densifyPass = ssm_functions.getParameter('/densify/config/connectionSettings/password')['Parameter']['Value']
+        settings = connection_settings.getConnectionSettings()
+        serviceNowURL = settings['serviceNowURL']
+        serviceNowUser = settings['serviceNowUser']
+        serviceNowPass = settings['serviceNowPass']
+        densifyURL = settings['densifyURL']
+        densifyUser = settings['densifyUser']
+        densifyPass = settings['densifyPass']
         
         if function == 'open':
-            resp = createTicket(kwargs['recommendation'])
+            resp = createTicket(kwargs['recommendation'], kwargs['correlationId'])
+        elif function == 'attach':
+            resp = attachReport(kwargs['ticketId'], kwargs['recommendation'])
         elif function == 'update':
             resp = updateTicket(kwargs['ticketId'], kwargs['input'])
         elif function == 'schedule':
@@ -39,6 +67,8 @@ def executeFunction(function, **kwargs):
             resp = updateTicket(kwargs['ticketId'], kwargs['input'])
         elif function == 'cancel':
             resp = updateTicket(kwargs['ticketId'], kwargs['input'])
+        elif function == 'cancelBatch' or function == 'scheduleBatch':
+            resp = updateTickets(kwargs['ticketIds'], kwargs['input'])
         else:
             print("This function [" + function + "] isn't recognized.")
             return False
@@ -49,18 +79,114 @@ def executeFunction(function, **kwargs):
         print("Exception encountered while execution " + function + ".  " + str(error))
         return False
 
+    finally:
+        reportPoolMetrics()
+
+def getTimeouts():
+
+    connectTimeout = 5
+    readTimeout = 60
+
+    if 'ConnectTimeout' in os.environ:
+        connectTimeout = float(os.environ['ConnectTimeout'])
+
+    if 'ReadTimeout' in os.environ:
+        readTimeout = float(os.environ['ReadTimeout'])
+
+    return (connectTimeout, readTimeout)
+
+#Waits between attempts, including a server's Retry-After, are capped so a retried request cannot outlive the
+#function.
+class BoundedRetry(Retry):
+
+    maxBackoff = 10
+
+    def get_backoff_time(self):
+        return min(self.maxBackoff, super().get_backoff_time())
+
+    def get_retry_after(self, response):
+        retryAfter = super().get_retry_after(response)
+        if retryAfter is None:
+            return None
+        return min(self.maxBackoff, retryAfter)
+
+#Retries for one ServiceNow/Densify request.  ITSMRetryAttempts (or the function wide retryAttempts) is capped so
+#that every attempt timing out plus the longest backoff after each still fits in ITSMRetryBudgetSeconds, which
+#stays below the 300s function timeout.
+def getRetryAttempts():
+
+    attempts = 3
+
+    if 'ITSMRetryAttempts' in os.environ:
+        attempts = int(os.environ['ITSMRetryAttempts'])
+    elif 'retryAttempts' in os.environ:
+        attempts = int(os.environ['retryAttempts'])
+
+    budget = 240.0
+
+    if 'ITSMRetryBudgetSeconds' in os.environ:
+        budget = float(os.environ['ITSMRetryBudgetSeconds'])
+
+    connectTimeout, readTimeout = getTimeouts()
+    requestsInBudget = int(budget // (connectTimeout + readTimeout + BoundedRetry.maxBackoff))
+
+    return max(0, min(attempts, requestsInBudget - 1))
+
+def buildRetry():
+
+    arguments = {
+        'total': getRetryAttempts(),
+        'backoff_factor': 0.5,
+        'status_forcelist': retryStatusCodes,
+        'respect_retry_after_header': True,
+        'raise_on_status': False
+    }
+
+    #urllib3 1.26 renamed method_whitelist to allowed_methods, 2.0 dropped the old name
+    try:
+        return BoundedRetry(allowed_methods=retryMethods, **arguments)
+    except TypeError:
+        return BoundedRetry(method_whitelist=retryMethods, **arguments)
+
+def getSession(apiEndPoint):
+
+    url = urlsplit(apiEndPoint)
+    baseURL = url.scheme + "://" + url.netloc
+
+    session = sessions.get(baseURL)
+
+    if session is None:
+        with sessionsLock:
+            session = sessions.get(baseURL)
+            if session is None:
+                poolSize = int(os.environ['HTTPPoolSize']) if 'HTTPPoolSize' in os.environ else 10
+                session = requests.Session()
+                session.mount(baseURL, HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, max_retries=buildRetry()))
+                sessions[baseURL] = session
+
+    return session
+
+def reportPoolMetrics():
+
+    for baseURL in list(sessions):
+        adapter = sessions[baseURL].get_adapter(baseURL)
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            print("HTTP pool [" + baseURL + "]: requests[" + str(pool.num_requests) + "] connections opened[" + str(pool.num_connections) + "] reused[" + str(pool.num_requests - pool.num_connections) + "].")
+
 def invokeRestAPI(type, apiEndPoint, username, password, headers, data):
 
     try:
     
-        s = requests.Session()
-        s.mount(apiEndPoint, HTTPAdapter(max_retries=int(os.environ['retryAttempts'])))
+        s = getSession(apiEndPoint)
         cookies = {'laravel_session': 'oRrEZq0oadEJMaTpx7aXEPBDXdJOFyQGjySZVjE0'}
         
         if type == 'post':
-            response = s.post(apiEndPoint, auth=(username, password), headers=headers, data=data, timeout=None, cookies=cookies)
+            response = s.post(apiEndPoint, auth=(username, password), headers=headers, data=data, timeout=getTimeouts(), cookies=cookies)
         elif type == 'put':
-            response = s.put(apiEndPoint, auth=(username, password), headers=headers, data=data, timeout=None, cookies=cookies)     
+            response = s.put(apiEndPoint, auth=(username, password), headers=headers, data=data, timeout=getTimeouts(), cookies=cookies)
+        elif type == 'get':
+            response = s.get(apiEndPoint, auth=(username, password), headers=headers, timeout=getTimeouts(), stream=True)
 
         return response
     
@@ -95,10 +221,111 @@ def updateTicket(ticketId, nameValuePairs):
         print(error)
         return False
 
-def createTicket(recommendation):
+def updateTickets(ticketIds, nameValuePairs):
+
+    try:
+
+        print("Updating " + str(len(ticketIds)) + " ticket(s) with the following name-pairs.")
+        print(nameValuePairs)
+
+        updated = []
+        pending = list(dict.fromkeys(ticketIds))
+
+        if serviceNowURL not in batchApiUnavailable:
+            for index in range(0, len(pending), batchSize):
+                result = batchUpdateTickets(pending[index:index + batchSize], nameValuePairs)
+                if result == False:
+                    break
+                updated.extend(result)
+
+        #whatever the batch API did not service is updated with individual, concurrent requests
+        pending = [ticketId for ticketId in pending if ticketId not in updated]
+        if len(pending) > 0:
+            with ThreadPoolExecutor(max_workers=min(10, len(pending))) as executor:
+                results = list(executor.map(lambda ticketId: updateTicket(ticketId, nameValuePairs), pending))
+            updated.extend([ticketId for ticketId, result in zip(pending, results) if result != False])
+
+        failed = [ticketId for ticketId in ticketIds if ticketId not in updated]
+        if len(failed) > 0:
+            print("Failed to update ticket(s) " + str(failed) + ".")
+
+        return {'status': 'success' if len(failed) == 0 else 'partial', 'updated': updated, 'failed': failed}
+
+    except Exception as error:
+        print("Exception encountered while updating tickets.")
+        print(error)
+        return False
+
+#Sends the updates through the ServiceNow batch API, one rest request per ticket.  Returns the ids that were
+#updated, or False when the instance does not offer the batch API.
+def batchUpdateTickets(ticketIds, nameValuePairs):
+
+    body = base64.b64encode(json.dumps(nameValuePairs).encode('utf-8')).decode('utf-8')
+    restRequests = []
+    for ticketId in ticketIds:
+        restRequests.append({
+            'id': ticketId,
+            'method': 'PUT',
+            'url': '/api/now/table/change_request/' + ticketId,
+            'headers': [{'name': 'Content-Type', 'value': 'application/json'}, {'name': 'Accept', 'value': 'application/json'}],
+            'body': body
+        })
+
+    apiEndPoint = serviceNowURL + '/api/now/v1/batch'
+    headers = {"Content-Type":"application/json","Accept":"application/json"}
+
+    response = invokeRestAPI("post", apiEndPoint, serviceNowUser, serviceNowPass, headers, json.dumps({'batch_request_id': ticketIds[0], 'rest_requests': restRequests}))
+
+    if response == False:
+        return False
+
+    if response.status_code in (400, 404, 405):
+        print("ServiceNow batch API is not available (status " + str(response.status_code) + "), updating tickets individually.")
+        batchApiUnavailable.add(serviceNowURL)
+        return False
+
+    if response.status_code != 200:
+        print('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+        return False
+
+    updated = []
+    for servicedRequest in json.loads(response.text)['serviced_requests']:
+        if servicedRequest['status_code'] == 200:
+            updated.append(servicedRequest['id'])
+        else:
+            print("Batch update of ticket [" + servicedRequest['id'] + "] returned status " + str(servicedRequest['status_code']) + ".")
+
+    return updated
+
+#Returns the sys_id of the change request carrying the correlation id, or None.
+def findTicket(correlationId):
+
+    apiEndPoint = serviceNowURL + '/api/now/table/change_request?sysparm_fields=sys_id&sysparm_limit=1&sysparm_query=correlation_id=' + quote(correlationId, safe='')
+    headers = {"Accept":"application/json"}
+
+    response = invokeRestAPI("get", apiEndPoint, serviceNowUser, serviceNowPass, headers, None)
+
+    if response == False:
+        raise Exception ("API Invocation failure.")
+
+    if response.status_code != 200:
+        raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+
+    result = json.loads(response.text)['result']
+
+    return result[0]['sys_id'] if len(result) > 0 else None
+
+#The correlation id (parameterKey:version) makes creation idempotent: a retried event finds the ticket its
+#earlier attempt created instead of opening a second one.  The report is attached separately (attachReport).
+def createTicket(recommendation, correlationId):
     
     try:
 
+        ticketId = findTicket(correlationId)
+        if ticketId is not None:
+            print("Ticket [" + ticketId + "] already exists for [" + correlationId + "].")
+            return {'status': 'success', 'ticketId': ticketId, 'created': False}
+
         print("Creating ticket with the following recommendation.")
         print(recommendation)
 
@@ -109,12 +336,13 @@ def createTicket(recommendation):
                  "category": "None",
                  "assignment_group": "None",
                  "short_description": "Densify Optimization Insight for " + recommendation['name'],
-                 "description": json.dumps(recommendation)}
+                 "description": json.dumps(recommendation),
+                 "correlation_id": correlationId,
+                 "correlation_display": "Densify"}
         
         headers = {"Content-Type":"application/json","Accept":"application/json"}
         
         response = invokeRestAPI("post", apiEndPoint, serviceNowUser, serviceNowPass, headers, json.dumps(data))
-        #response = requests.post(apiEndPoint, auth=(serviceNowUser, serviceNowPass), headers=headers ,data=json.dumps(data))
 
         if response == False:
             raise Exception ("API Invocation failure.")
@@ -127,19 +355,112 @@ def createTicket(recommendation):
 
         jsonresp = json.loads(response.text)
         ticketId = jsonresp['result']['sys_id']
-        
-        print("Attach IA Report: " + str(os.environ['attachImpactAnalysisReport']))
-        if str(os.environ['attachImpactAnalysisReport']) == "False" or (downloadImpactAnalysisReport(recommendation) and attachFileToTicket(ticketId, '/tmp/ImpactAnalysisReport.pdf')):
-            return {'status': 'success', 'ticketId': ticketId}
-        else:
-            raise Exception("Failed to download or attach impact analysis report.")
+
+        return {'status': 'success', 'ticketId': ticketId, 'created': True}
             
     except Exception as error:
         print("Error encountered during ticket creation.")
         print(error)
         return False
 
-def attachFileToTicket(ticketId, filename):
+def hasAttachment(ticketId, filename):
+
+    apiEndPoint = serviceNowURL + '/api/now/attachment?sysparm_limit=1&sysparm_query=table_sys_id=' + ticketId + '^file_name=' + quote(filename, safe='')
+    headers = {"Accept":"application/json"}
+
+    response = invokeRestAPI("get", apiEndPoint, serviceNowUser, serviceNowPass, headers, None)
+
+    if response == False:
+        raise Exception ("API Invocation failure.")
+
+    if response.status_code != 200:
+        raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+
+    return len(json.loads(response.text)['result']) > 0
+
+def attachReport(ticketId, recommendation):
+
+    try:
+
+        print("Attach IA Report: " + str(os.environ['attachImpactAnalysisReport']))
+        if str(os.environ['attachImpactAnalysisReport']) == "False":
+            return {'status': 'success', 'attached': False}
+
+        #a retried event must not attach the report a second time
+        if hasAttachment(ticketId, 'ImpactAnalysisReport.pdf'):
+            print("Ticket [" + ticketId + "] already has the impact analysis report.")
+            return {'status': 'success', 'attached': False}
+
+        if attachImpactAnalysisReport(ticketId, recommendation) != True:
+            raise Exception("Failed to download or attach impact analysis report.")
+
+        return {'status': 'success', 'attached': True}
+
+    except Exception as error:
+        print("Error encountered while attaching the report to ticket [" + ticketId + "].")
+        print(error)
+        return False
+
+#File-like view of a streamed response body whose length is known, so the upload is sent with a Content-Length
+#while the body is read from the Densify connection as ServiceNow consumes it.
+class StreamedBody:
+
+    def __init__(self, response, length):
+        self.response = response
+        self.len = length
+
+    def read(self, size=-1):
+        return self.response.raw.read(size if size is not None and size >= 0 else None)
+
+    def __iter__(self):
+        return self.response.iter_content(chunk_size=reportChunkSize)
+
+    def close(self):
+        self.response.close()
+
+def openReportBody(response):
+
+    #a compressed body's Content-Length is not the length of the decoded report
+    if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+        return StreamedBody(response, int(response.headers['Content-Length']))
+
+    spool = tempfile.SpooledTemporaryFile(max_size=reportSpoolSize)
+    for chunk in response.iter_content(chunk_size=reportChunkSize):
+        spool.write(chunk)
+    spool.seek(0)
+    response.close()
+
+    return spool
+
+def attachImpactAnalysisReport(ticketId, recommendation):
+
+    body = None
+    response = None
+
+    try:
+
+        #the cache keeps reports in /tmp (and optionally an object store) and revalidates them with a conditional GET
+        if 'ReportCacheEnabled' not in os.environ or str(os.environ['ReportCacheEnabled']) != "False":
+            body = report_cache.getReport(recommendation['entityId'], lambda headers: downloadImpactAnalysisReport(recommendation, headers))
+            report_cache.reportMetrics()
+        else:
+            response = downloadImpactAnalysisReport(recommendation, {})
+            body = openReportBody(response)
+
+        return attachFileToTicket(ticketId, 'ImpactAnalysisReport.pdf', body)
+
+    except Exception as error:
+        print("Exception encountered while streaming the impact analysis report.")
+        print(error)
+        return False
+
+    finally:
+        if body is not None:
+            body.close()
+        if response is not None:
+            response.close()
+
+def attachFileToTicket(ticketId, filename, data):
 
     try:
     
@@ -147,15 +468,13 @@ def attachFileToTicket(ticketId, filename):
         
         contentType = {'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'doc': 'application/msword', 'jpg': 'image/jpeg', 'png': 'image/png', 'xlsx': 'application/xlsx', 'xls': 'application/vnd.ms-excel', 'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation', 'pdf': 'application/pdf'}
 
-        if len(filename.split('.')) != 2 and filename.split('.')[1] not in contentType:
+        if len(filename.split('.')) != 2 or filename.split('.')[1] not in contentType:
             raise Exception("This file type cannot be attached to the ticket.")
             
         headers = {"Content-Type": contentType[filename.split('.')[1]], "Accept":"application/json"}
-        apiEndPoint = serviceNowURL + "/api/now/attachment/file?table_name=change_request&table_sys_id=" + ticketId + "&file_name=" + filename.split("/")[2]
-        data = open(filename, 'rb').read()
+        apiEndPoint = serviceNowURL + "/api/now/attachment/file?table_name=change_request&table_sys_id=" + ticketId + "&file_name=" + filename
         
         response = invokeRestAPI("post", apiEndPoint, serviceNowUser, serviceNowPass, headers, data)
-        #response = requests.post(apiEndPoint, auth=(serviceNowUser, serviceNowPass), headers=headers, data=data)
         
         if response == False:
             raise Exception ("API Invocation failure.")
@@ -163,7 +482,6 @@ def attachFileToTicket(ticketId, filename):
         if response.status_code != 201:
             raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
             
-        #print(json.loads(response.text))
         return True
         
     except Exception as error:
@@ -171,24 +489,19 @@ def attachFileToTicket(ticketId, filename):
         print(error)
         return False
 
-def downloadImpactAnalysisReport(recommendation):
+#Returns the streamed response (or the 304 answering a conditional request); the caller reads the report
+#from it and closes it.
+def downloadImpactAnalysisReport(recommendation, headers):
 
-    try:
-    
-        print("Downloading impact analysis report from Densify.")
+    print("Downloading impact analysis report from Densify.")
 
-        apiEndPoint = densifyURL + "/CIRBA/api/v2" + recommendation['rptHref']
-        response = requests.get(apiEndPoint, auth=(densifyUser, densifyPass))
-        
-        if response.status_code != 200:
-            raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+    apiEndPoint = densifyURL + "/CIRBA/api/v2" + recommendation['rptHref']
+    response = invokeRestAPI("get", apiEndPoint, densifyUser, densifyPass, headers, None)
 
-        #print(json.loads(response.text))
-        open('/tmp/ImpactAnalysisReport.pdf', 'wb').write(response.content)
-                
-        return True
+    if response == False:
+        raise Exception ("API Invocation failure.")
 
-    except Exception as error:
-        print("Exception encountered while downloading the impact analysis report.")
-        print(error)
-        return False
\ No newline at end of file
+    if response.status_code != 200 and response.status_code != 304:
+        raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+
+    return response
@@ -7,19 +7,50 @@ Created on Wed Aug  5 16:33:55 2020
 
 
 import json
-import boto3
+import aws_clients
 import re
 import datetime
 import ssm_functions
+import opsitem_index
+import relation_hub
 import itsm_adapter
+import connection_settings
+from concurrent.futures import ThreadPoolExecutor
 
 def lambda_handler(event, context):
     # TODO implement
     
     print(event)
 
+    opsitem_index.reset()
+
+    #bulk ticket requests (e.g. cancellations from ProcessNewRecommendations) are invoked directly rather than through EventBridge
+    if 'function' in event:
+        resp = itsm_adapter.executeFunction(event['function'], ticketIds=event['ticketIds'], input=event['input'])
+        return {
+            'statusCode': 200 if resp != False else 500,
+            'body': json.dumps(resp)
+        }
+
+    #label events delivered in batches through a queue
+    if 'Records' in event:
+        return processBatch(event['Records'])
+
+    parameter = readParameter(event)
+
+    #a failed event is raised so lambda retries the asynchronous invoke
+    if parameter != None and len(processGroup(event['detail']['label'], [parameter])) > 0:
+        raise Exception ("Failed to process " + event['detail']['label'] + " event for parameter [" + parameter['Parameter']['Name'] + "].")
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Execution Completed Sucessfully!')
+    }
+
+#Returns the parameter and its tags, or None if the event is not for a cloudformation managed EC2 or RDS insight.
+def readParameter(event):
+
     parameterKey = event['detail']['name']
-    state = event['detail']['label']
 
     #validate the request ########################################
     pattern = re.compile(r'^/densify/iaas/(.*)/(.*)/(.*)$')
@@ -27,7 +58,7 @@ def lambda_handler(event, context):
     
     if (mo == None or mo != None and ((mo.group(1) != 'ec2' and mo.group(1) != 'rds') and (mo.group(3) != 'instanceType' and mo.group(3) != 'dbInstanceClass'))):
         print("Request is not for an EC2 or RDS recommendation.  Not proceeding.")
-        return
+        return None
     
     parameter = {}
     parameter['Parameter'] = ssm_functions.getParameter(parameterKey)['Parameter']
@@ -35,32 +66,120 @@ def lambda_handler(event, context):
     
     if 'cloudformation:stack-name' not in parameter['Tags']:
         print("This resource does not belong to a CFT.  Not proceeding.")
-        return
+        return None
+
+    return parameter
+
+#Events are coalesced by stack and state so the ITSM and OpsItem work that is common to a stack (the maintenance
+#window lookup, the ticket updates, the window deletion) is done once per group.  Records whose work failed are
+#reported as batchItemFailures so only they are delivered again.
+def processBatch(records):
+
+    failures = []
+    groups = {}
+    messageIds = {}
+
+    def read(record):
+        try:
+            event = json.loads(record['body'])
+            return (record, event, readParameter(event), None)
+        except Exception as error:
+            return (record, None, None, error)
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        reads = list(executor.map(read, records))
+
+    for record, event, parameter, error in reads:
+        if error is not None:
+            print("Exception caught while reading message [" + record['messageId'] + "]: " + str(error))
+            failures.append(record['messageId'])
+        elif parameter != None:
+            state = event['detail']['label']
+            groupKey = (parameter['Tags']['cloudformation:stack-name'], state)
+            groups.setdefault(groupKey, {})[parameter['Parameter']['Name']] = parameter
+            messageIds.setdefault((parameter['Parameter']['Name'], state), []).append(record['messageId'])
+
+    print("Coalesced " + str(len(records)) + " event(s) into " + str(len(groups)) + " group(s).")
+
+    for stackName, state in groups:
+        parameters = list(groups[(stackName, state)].values())
+        try:
+            failed = processGroup(state, parameters)
+        except Exception as error:
+            print("Exception caught while processing " + state + " events for stack [" + stackName + "]: " + str(error))
+            failed = [parameter['Parameter']['Name'] for parameter in parameters]
+        for parameterKey in failed:
+            failures.extend(messageIds[(parameterKey, state)])
+
+    return {'batchItemFailures': [{'itemIdentifier': messageId} for messageId in failures]}
+
+#Tags a parameter must carry for the work of each state.  They are checked per parameter, so an incomplete one
+#fails only its own event rather than the whole group.
+requiredTags = {
+    'Scheduled': ['itsmTicketId'],
+    'Executed': ['itsmTicketId', 'opsItemId'],
+    'Closed': ['opsItemId']
+}
+
+#Processes parameters of one stack that carry the same label and returns the keys of those that failed.
+def processGroup(state, parameters):
+
+    failed = []
+
+    if state in requiredTags:
+        complete = []
+        for parameter in parameters:
+            missing = [tag for tag in requiredTags[state] if tag not in parameter['Tags']]
+            if len(missing) > 0:
+                print("Parameter [" + parameter['Parameter']['Name'] + "] is missing tag(s) " + str(missing) + " needed for the " + state + " state.")
+                failed.append(parameter['Parameter']['Name'])
+            else:
+                complete.append(parameter)
+        parameters = complete
+        if len(parameters) == 0:
+            return failed
 
     #Execute request #############################################
     if state == 'Initialize':
         
         print("Request is intialized, proceed to open an ITSM ticket.")
-        
-        resp = itsm_adapter.executeFunction("open", recommendation=parameter['Tags'])
-        if resp != False:
-            ssm_functions.addTagsToResource('Parameter', parameterKey, [{'Key': 'itsmTicketId', 'Value': resp['ticketId']}])
-        else:
-            print("Failed to create ticket.")
+
+        #reports are attached on their own pool as soon as each ticket exists, so a slow report download does not
+        #hold up opening and tagging the other tickets.  A ticket whose report was not attached fails its event; the
+        #retry finds the ticket by its correlation id and only attaches the report.
+        with ThreadPoolExecutor(max_workers=min(10, len(parameters))) as attachExecutor:
+            with ThreadPoolExecutor(max_workers=min(10, len(parameters))) as executor:
+                attachments = list(executor.map(lambda parameter: openTicket(parameter, attachExecutor), parameters))
+            for parameter, attachment in zip(parameters, attachments):
+                if attachment == False or attachment.result() == False:
+                    failed.append(parameter['Parameter']['Name'])
             
     elif state == 'Approved':
 
         print("Request is approved, creating new ops ticket.")
-        
-        opsItemId = createOpsItem(parameter)
-        if opsItemId != False:
-            ssm_functions.addTagsToResource('Parameter', parameterKey, [{'Key': 'opsItemId', 'Value': opsItemId}])
+
+        #ops items are created concurrently, each related to the stack's hub, and the hub is updated once all of them exist
+        stackName = parameters[0]['Tags']['cloudformation:stack-name']
+        resolveHub = relation_hub.hubResolver(stackName)
+        with ThreadPoolExecutor(max_workers=min(10, len(parameters))) as executor:
+            opsItemIds = list(executor.map(lambda parameter: createOpsItem(parameter, resolveHub), parameters))
+
+        created = []
+        for parameter, opsItemId in zip(parameters, opsItemIds):
+            if opsItemId == False:
+                failed.append(parameter['Parameter']['Name'])
+            elif opsItemId != None:
+                created.append(opsItemId)
+                ssm_functions.addTagsToResource('Parameter', parameter['Parameter']['Name'], [{'Key': 'opsItemId', 'Value': opsItemId}])
+
+        if len(created) > 0 and resolveHub() != False:
+            relation_hub.syncHub(stackName, resolveHub())
             
     elif state == 'Scheduled':
         
-        print("Request is scheduled for execution.  Updating ITSM Ticket.")
+        print("Request is scheduled for execution.  Updating ITSM Ticket(s).")
         
-        maintenanceWindow = ssm_functions.findActiveMaintenanceWindow("mw-" + parameter['Tags']['cloudformation:stack-name'])
+        maintenanceWindow = ssm_functions.findActiveMaintenanceWindow("mw-" + parameters[0]['Tags']['cloudformation:stack-name'])
         start_date = datetime.datetime.strptime(str(maintenanceWindow['Schedule'])[3:-1], '%Y-%m-%dT%H:%M:%S')
         end_date = start_date + datetime.timedelta(hours=int(maintenanceWindow['Duration']))
         
@@ -68,57 +187,101 @@ def lambda_handler(event, context):
         input['start_date'] = str(start_date)
         input['end_date'] = str(end_date)
         input['state'] = "-1"
-        
-        resp = itsm_adapter.executeFunction("schedule", ticketId=parameter['Tags']['itsmTicketId'], input=input)
+
+        #every ticket of the stack gets the same window, so they are updated in one request
+        ticketIds = [parameter['Tags']['itsmTicketId'] for parameter in parameters]
+        resp = itsm_adapter.executeFunction("scheduleBatch", ticketIds=ticketIds, input=input)
                 
         if resp == False:
-            print("Error while updating ticket with ID[" + str(parameter['Tags']['itsmTicketId']) + "].")
+            print("Error while updating tickets with IDs" + str(ticketIds) + ".")
+            failed.extend([parameter['Parameter']['Name'] for parameter in parameters])
+        else:
+            failed.extend([parameter['Parameter']['Name'] for parameter in parameters if parameter['Tags']['itsmTicketId'] in resp['failed']])
             
     elif state == 'Executed':
         
         print("Insight has been executed.  Updating ITSM Ticket.")
+
+        for parameter in parameters:
+            if closeTicket(parameter) == False:
+                failed.append(parameter['Parameter']['Name'])
+            
+    elif state == 'Closed':
         
+        print("Insight has been closed.  Closing Ops Item.")
+        
+        opsItemIds = [parameter['Tags']['opsItemId'] for parameter in parameters]
+        ssm_functions.updateOpsItems(opsItemIds, 'Resolved')
+        relation_hub.syncHub(parameters[0]['Tags']['cloudformation:stack-name'], removed=opsItemIds)
+        maintenanceWindow = ssm_functions.findActiveMaintenanceWindow("mw-" + parameters[0]['Tags']['cloudformation:stack-name'])
+        if maintenanceWindow != False:
+            ssm_functions.deleteMaintenanceWindow(maintenanceWindow['WindowId'])
+        for parameter in parameters:
+            ssm_functions.removeTagsFromResource('Parameter', parameter['Parameter']['Name'], ['opsItemId', 'ITSMTicketId'])
+
+    return failed
+
+#Opens (or finds) the parameter's ticket and tags the parameter with it while the report is attached on executor.
+#Returns the attachment's future, or False if the ticket could not be opened or tagged.
+def openTicket(parameter, executor):
+
+    parameterKey = parameter['Parameter']['Name']
+
+    resp = itsm_adapter.executeFunction("open", recommendation=parameter['Tags'], correlationId=parameterKey + ":" + str(parameter['Parameter']['Version']))
+    if resp == False:
+        print("Failed to create ticket.")
+        return False
+
+    attachment = executor.submit(attachReport, parameter, resp['ticketId'])
+
+    if ssm_functions.addTagsToResource('Parameter', parameterKey, [{'Key': 'itsmTicketId', 'Value': resp['ticketId']}]) == False:
+        print("Failed to tag parameter [" + parameterKey + "] with ticket [" + resp['ticketId'] + "].")
+        return False
+
+    return attachment
+
+def attachReport(parameter, ticketId):
+
+    resp = itsm_adapter.executeFunction("attach", ticketId=ticketId, recommendation=parameter['Tags'])
+    if resp == False:
+        print("Failed to attach the impact analysis report to ticket [" + ticketId + "].")
+
+    return resp
+
+def closeTicket(parameter):
+
+    try:
+
         opsItem = ssm_functions.getOpsItem(parameter['Tags']['opsItemId'])
         work_notes = json.loads(opsItem['OpsItem']['OperationalData']['executionStatus']['Value'])
-        
+
         input = {}
         input['work_start'] = work_notes['work_start']
         input['work_end'] = work_notes['work_end']
         input['state'] = "0"
-        
+
         resp = itsm_adapter.executeFunction("close", ticketId=parameter['Tags']['itsmTicketId'], input=input)
-                
+
         if resp == False:
-            print("Error while updating ticket with ID[" + lambdaEvent['ticketId'] + "].")   
-            
-    elif state == 'Closed':
-        
-        print("Insight has been closed.  Closing Ops Item.")
-        
-        ssm_functions.updateOpsItems([parameter['Tags']['opsItemId']], 'Resolved')
-        ssm_functions.deleteMaintenanceWindow(ssm_functions.findActiveMaintenanceWindow("mw-" + parameter['Tags']['cloudformation:stack-name'])['WindowId'])
-        ssm_functions.removeTagsFromResource('Parameter', parameterKey, ['opsItemId', 'ITSMTicketId'])
+            print("Error while updating ticket with ID[" + parameter['Tags']['itsmTicketId'] + "].")
 
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Execution Completed Sucessfully!')
-    }
+        return resp
+
+    except Exception as error:
+        print("Exception caught while closing ticket [" + parameter['Tags']['itsmTicketId'] + "]: " + str(error))
+        return False
 
 def lambda_execute(functionName, eventObj):
     
     try:
                 
-        eventObj['serviceNowURL'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/url')['Parameter']['Value']
-        eventObj['serviceNowUser'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/username')['Parameter']['Value']
-        eventObj['serviceNowPass'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/password')['Parameter']['Value']
-        eventObj['densifyURL'] = ssm_functions.getParameter('/densify/config/connectionSettings/url')['Parameter']['Value']
-        eventObj['densifyUser'] = ssm_functions.getParameter('/densify/config/connectionSettings/username')['Parameter']['Value']
-        eventObj['densifyPass'] = ssm_functions.getParameter('/densify/config/connectionSettings/password')['Parameter']['Value']        
+        settings = connection_settings.getConnectionSettings()
+        for name in settings:
+            eventObj[name] = settings[name]
         
         jsonStr = json.dumps(eventObj)
 
-        client = boto3.client('lambda')
-        response = client.invoke(
+        response = aws_clients.call('lambda', 'invoke',
 			FunctionName=functionName,
 			InvocationType='RequestResponse',
 			Payload=jsonStr.encode('utf-8')
@@ -139,11 +302,15 @@ def lambda_execute(functionName, eventObj):
         print(error)
         return False
 
-def createOpsItem(parameter):
+#Creates the parameter's ops item related to the hub returned by resolveHub (not related to anything if the hub
+#could not be found).
+def createOpsItem(parameter, resolveHub):
 
     try:
 
-        if ssm_functions.findActiveOpsItem(parameter['Parameter']['Name']) != False:
+        stackName = parameter['Tags']['cloudformation:stack-name']
+
+        if len(opsitem_index.findByParameterKey(parameter['Parameter']['Name'], stackName=stackName)) != 0:
             print("Ops ticket already exists.  Not proceeding.")
             return
 
@@ -153,7 +320,7 @@ def createOpsItem(parameter):
         elif parameter['Tags']['serviceType'] == 'RDS':
             serviceArn = 'arn:aws:rds:' + parameter['Tags']['regionId'] + ':' + parameter['Tags']['accountIdRef'] + ':db:' + parameter['Tags']['name']  
             
-        densifyUrl = ssm_functions.getParameter('/densify/config/connectionSettings/url')['Parameter']['Value']
+        densifyUrl = connection_settings.getConnectionSettings()['densifyURL']
 
         opsData = {}
         opsData['serviceType'] = {}
@@ -163,7 +330,7 @@ def createOpsItem(parameter):
         opsData['resourceId']['Value'] = parameter['Tags']['resourceId']
         opsData['resourceId']['Type'] = 'SearchableString'
         opsData['cloudformation:stack-name'] = {}
-        opsData['cloudformation:stack-name']['Value'] = parameter['Tags']['cloudformation:stack-name']
+        opsData['cloudformation:stack-name']['Value'] = stackName
         opsData['cloudformation:stack-name']['Type'] = 'SearchableString'
         opsData['cloudformation:logical-id'] = {}
         opsData['cloudformation:logical-id']['Value'] = parameter['Tags']['cloudformation:logical-id']
@@ -195,29 +362,9 @@ def createOpsItem(parameter):
         opsData['/aws/automations']['Value'] = "[{\"automationId\": \"ScheduleMaintenanceWindow\", \"automationType\": \"AWS::SSM::Automation\"}]"
         opsData['/aws/automations']['Type'] = 'SearchableString'
 
-        OpsItemFilters=[
-            {
-                'Key': 'OperationalData',
-                'Values': [
-                    "{\"key\":\"cloudformation:stack-name\",\"value\":\"" + parameter['Tags']['cloudformation:stack-name'] + "\"}",
-                ],
-                'Operator': 'Equal'
-            },
-            {
-                'Key': 'Status',
-                'Values': [
-                    "Open",
-                    "InProgress"
-                ],
-                'Operator': 'Equal'
-            }
-        ]
-
-        relatedOpsItems = []
-        for opsItemId in ssm_functions.listAllOpsItemIds(OpsItemFilters):
-            relatedOpsItems.append({'OpsItemId': opsItemId})
-
-        print("Successfully identified all related ops items: " + str(relatedOpsItems))
+        stackOpsItemIds = opsitem_index.getStackOpsItemIds(stackName)
+        hubId = resolveHub()
+        relatedOpsItems = [{'OpsItemId': hubId}] if hubId != False else []
         
         category = 'Cost' if float(parameter['Tags']['savingsEstimate']) >= float(0) else 'Performance'
         severity = '2' if float(parameter['Tags']['savingsEstimate']) >= float(0) else '1'
@@ -228,8 +375,8 @@ def createOpsItem(parameter):
         
         print('Successfully created ops ticket: ' + opsItemID)
         
-        if len(relatedOpsItems) > 0:
-            existingOpsItem = ssm_functions.getOpsItem(relatedOpsItems[0]['OpsItemId'])
+        if len(stackOpsItemIds) > 0:
+            existingOpsItem = ssm_functions.getOpsItem(stackOpsItemIds[0])
             if existingOpsItem['OpsItem']['Status'] == 'InProgress' and 'scheduledMaintenanceWindowDetails' in existingOpsItem['OpsItem']['OperationalData']:
                 print("A maintenance window has already been scheduled for this CF stack.  Updating the opsItem with existing window ID.")
                 opsData = {}
@@ -237,14 +384,6 @@ def createOpsItem(parameter):
                 opsData['scheduledMaintenanceWindowDetails']['Value'] = existingOpsItem['OpsItem']['OperationalData']['scheduledMaintenanceWindowDetails']['Value']
                 opsData['scheduledMaintenanceWindowDetails']['Type'] = 'String'
                 ssm_functions.updateOpsItems([opsItemID], 'InProgress', opsData=opsData)
-
-            print("Updating all related opsItems.")
-            for opsItem in relatedOpsItems:
-                relOpsItem = []
-                relOpsItem = relatedOpsItems.copy()
-                relOpsItem.append({'OpsItemId': opsItemID})
-                relOpsItem.remove({'OpsItemId': opsItem['OpsItemId']})
-                ssm_functions.setRelatedOpsItem(opsItem['OpsItemId'], relOpsItem)
         
         return opsItemID
         
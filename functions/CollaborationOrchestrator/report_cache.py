@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import aws_clients
+
+#Cache of Densify impact analysis reports.  Reports are stored by the sha256 of their content and an index maps
+#each entityId to the digest of its last report along with the ETag/Last-Modified validators Densify sent, so a
+#cached report is revalidated with a conditional GET.  The /tmp tier is an LRU capped at ReportCacheMaxBytes;
+#an optional object store tier (ReportStoreURI, s3://bucket/prefix or a local directory) shares reports and
+#validators between containers.
+indexVersion = 1
+index = None
+indexLock = threading.Lock()
+metrics = {'hits': 0, 'storeHits': 0, 'misses': 0, 'evictions': 0}
+chunkSize = 65536
+
+def getCachePath():
+
+    if 'ReportCachePath' in os.environ:
+        return os.environ['ReportCachePath']
+
+    return '/tmp/densify_reports'
+
+def getMaxBytes():
+
+    maxBytes = 200 * 1024 * 1024
+
+    if 'ReportCacheMaxBytes' in os.environ:
+        maxBytes = int(os.environ['ReportCacheMaxBytes'])
+
+    return maxBytes
+
+def getReportPath(digest):
+
+    return os.path.join(getCachePath(), digest + '.report')
+
+class LocalDirectoryStore:
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def getReport(self, digest, targetPath):
+        source = os.path.join(self.path, digest + '.report')
+        if not os.path.exists(source):
+            return False
+        shutil.copyfile(source, targetPath)
+        return True
+
+    def putReport(self, digest, sourcePath):
+        target = os.path.join(self.path, digest + '.report')
+        if not os.path.exists(target):
+            shutil.copyfile(sourcePath, target + '.tmp')
+            os.replace(target + '.tmp', target)
+
+    def getEntry(self, entityId):
+        try:
+            with open(os.path.join(self.path, entityId + '.json'), 'r') as entryFile:
+                return json.load(entryFile)
+        except FileNotFoundError:
+            return None
+
+    def putEntry(self, entityId, entry):
+        with open(os.path.join(self.path, entityId + '.json.tmp'), 'w') as entryFile:
+            json.dump(entry, entryFile)
+        os.replace(os.path.join(self.path, entityId + '.json.tmp'), os.path.join(self.path, entityId + '.json'))
+
+class S3Store:
+
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') != '' else ''
+
+    def getReport(self, digest, targetPath):
+        try:
+            response = aws_clients.call('s3', 'get_object', None, Bucket=self.bucket, Key=self.prefix + 'reports/' + digest)
+        except aws_clients.AWSCallError as error:
+            if error.code in ('NoSuchKey', 'NotFound'):
+                return False
+            raise
+        with open(targetPath, 'wb') as reportFile:
+            for chunk in response['Body'].iter_chunks(chunkSize):
+                reportFile.write(chunk)
+        return True
+
+    def putReport(self, digest, sourcePath):
+        with open(sourcePath, 'rb') as reportFile:
+            aws_clients.call('s3', 'put_object', None, Bucket=self.bucket, Key=self.prefix + 'reports/' + digest, Body=reportFile)
+
+    def getEntry(self, entityId):
+        try:
+            response = aws_clients.call('s3', 'get_object', None, Bucket=self.bucket, Key=self.prefix + 'index/' + entityId + '.json')
+        except aws_clients.AWSCallError as error:
+            if error.code in ('NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def putEntry(self, entityId, entry):
+        aws_clients.call('s3', 'put_object', None, Bucket=self.bucket, Key=self.prefix + 'index/' + entityId + '.json', Body=json.dumps(entry).encode('utf-8'))
+
+def getStore():
+
+    if 'ReportStoreURI' not in os.environ or os.environ['ReportStoreURI'] == '':
+        return None
+
+    uri = os.environ['ReportStoreURI']
+
+    if uri.startswith('s3://'):
+        location = uri[len('s3://'):].split('/', 1)
+        return S3Store(location[0], location[1] if len(location) > 1 else '')
+
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+
+    return LocalDirectoryStore(uri)
+
+def load():
+
+    global index
+
+    if index is not None:
+        return index
+
+    os.makedirs(getCachePath(), exist_ok=True)
+    index = {'version': indexVersion, 'entries': {}}
+
+    try:
+
+        with open(os.path.join(getCachePath(), 'index.json'), 'r') as indexFile:
+            persisted = json.load(indexFile)
+
+        if persisted['version'] == indexVersion:
+            index = persisted
+
+    except FileNotFoundError:
+        pass
+    except Exception as error:
+        print("Exception caught while loading the report cache index, starting with an empty index. " + str(error))
+
+    return index
+
+def save():
+
+    fd, tmpPath = tempfile.mkstemp(dir=getCachePath(), prefix='.index')
+    with os.fdopen(fd, 'w') as indexFile:
+        json.dump(index, indexFile, separators=(',', ':'))
+    os.replace(tmpPath, os.path.join(getCachePath(), 'index.json'))
+
+def evict(keep):
+
+    entries = index['entries']
+    digests = {}
+    for entityId in entries:
+        digest = entries[entityId]['digest']
+        digests[digest] = max(digests.get(digest, 0), entries[entityId]['used'])
+
+    sizes = {}
+    for digest in digests:
+        if os.path.exists(getReportPath(digest)):
+            sizes[digest] = os.path.getsize(getReportPath(digest))
+
+    #least recently used first, never the report that is about to be returned
+    total = sum(sizes.values())
+    for digest in sorted(sizes, key=lambda digest: digests[digest]):
+        if total <= getMaxBytes():
+            break
+        if digest == keep:
+            continue
+        os.remove(getReportPath(digest))
+        total -= sizes[digest]
+        metrics['evictions'] += 1
+        for entityId in [entityId for entityId in entries if entries[entityId]['digest'] == digest]:
+            del entries[entityId]
+
+def conditionalHeaders(entry):
+
+    headers = {}
+
+    if entry is not None and 'etag' in entry and entry['etag'] is not None:
+        headers['If-None-Match'] = entry['etag']
+
+    if entry is not None and 'lastModified' in entry and entry['lastModified'] is not None:
+        headers['If-Modified-Since'] = entry['lastModified']
+
+    return headers
+
+#Returns an open file holding the entity's current report.  get(headers) performs the (streamed) GET and
+#returns the response.
+def getReport(entityId, get):
+
+    store = getStore()
+
+    with indexLock:
+        entry = load()['entries'].get(entityId)
+
+    if entry is not None and not os.path.exists(getReportPath(entry['digest'])):
+        entry = None
+
+    #a cold container can still revalidate a report another container has put into the object store
+    fromStore = False
+    if entry is None and store is not None:
+        entry = store.getEntry(entityId)
+        fromStore = entry is not None
+
+    response = get(conditionalHeaders(entry))
+
+    if response.status_code == 304:
+        response.close()
+        if fromStore and not os.path.exists(getReportPath(entry['digest'])):
+            tmpPath = getReportPath(entry['digest']) + '.' + str(threading.get_ident())
+            if not store.getReport(entry['digest'], tmpPath):
+                #the validators were stored without their report, fetch it again unconditionally
+                return getReport(entityId, lambda headers: get({}))
+            os.replace(tmpPath, getReportPath(entry['digest']))
+        metrics['storeHits' if fromStore else 'hits'] += 1
+        entry['used'] = time.time()
+    else:
+        if response.status_code != 200:
+            raise Exception ('Status:', response.status_code, 'Headers:', response.headers, 'Error Response:', response.content)
+        metrics['misses'] += 1
+        entry = storeResponse(response)
+        if store is not None:
+            store.putReport(entry['digest'], getReportPath(entry['digest']))
+            store.putEntry(entityId, entry)
+
+    with indexLock:
+        load()['entries'][entityId] = entry
+        evict(entry['digest'])
+        save()
+
+    return open(getReportPath(entry['digest']), 'rb')
+
+def storeResponse(response):
+
+    digest = hashlib.sha256()
+    fd, tmpPath = tempfile.mkstemp(dir=getCachePath(), prefix='.report')
+
+    try:
+        with os.fdopen(fd, 'wb') as reportFile:
+            for chunk in response.iter_content(chunk_size=chunkSize):
+                digest.update(chunk)
+                reportFile.write(chunk)
+        #identical reports share one file, so replacing an existing one is harmless
+        os.replace(tmpPath, getReportPath(digest.hexdigest()))
+    except Exception:
+        os.remove(tmpPath)
+        raise
+    finally:
+        response.close()
+
+    return {'digest': digest.hexdigest(), 'etag': response.headers.get('ETag'), 'lastModified': response.headers.get('Last-Modified'), 'used': time.time()}
+
+def reportMetrics():
+
+    print("Report cache: hits[" + str(metrics['hits']) + "] store hits[" + str(metrics['storeHits']) + "] misses[" + str(metrics['misses']) + "] evictions[" + str(metrics['evictions']) + "].")
+
+    for name in metrics:
+        metrics[name] = 0
@@ -10,31 +10,26 @@ def get_asg_recommendation(id, region):
 	parameter_key_minSize = '/densify/iaas/asg/' + id + '/minSize'
 	parameter_key_maxSize = '/densify/iaas/asg/' + id + '/maxSize'
 	
-	try:
-		
-		response = ssm_client.get_parameter(
-			Name=parameter_key_instanceType,
-			WithDecryption=True
-		)
-		
-		asg_recommendation['InstanceType'] = response['Parameter']['Value']
-		
-		response = ssm_client.get_parameter(
-			Name=parameter_key_minSize,
-			WithDecryption=True
-		)
-		
-		asg_recommendation['MinSize'] = response['Parameter']['Value']
-		
-		response = ssm_client.get_parameter(
-			Name=parameter_key_maxSize,
-			WithDecryption=True
-		)
-		
-		asg_recommendation['MaxSize'] = response['Parameter']['Value']
-
-	except ssm_client.exceptions.ParameterNotFound as error:
+	#read all three parameters in a single call
+	response = ssm_client.get_parameters(
+		Names=[
+			parameter_key_instanceType,
+			parameter_key_minSize,
+			parameter_key_maxSize
+		],
+		WithDecryption=True
+	)
+	
+	if len(response['InvalidParameters']) != 0:
 		raise Exception("ASG recommendation does not exist in parameter store.")
+	
+	values = {}
+	for parameter in response['Parameters']:
+		values[parameter['Name']] = parameter['Value']
+	
+	asg_recommendation['InstanceType'] = values[parameter_key_instanceType]
+	asg_recommendation['MinSize'] = values[parameter_key_minSize]
+	asg_recommendation['MaxSize'] = values[parameter_key_maxSize]
 
 	return asg_recommendation  
     
@@ -7,15 +7,18 @@ Created on Tue Aug 11 10:37:24 2020
 
 
 import json
-import boto3
+import aws_clients
 import time
 import datetime
 import ssm_functions
+import opsitem_index
 
 def lambda_handler(event, context):
     # TODO implement
     
     print("Executor triggered with event [" + str(event) + "].")
+
+    opsitem_index.reset()
     
     if 'stage' in event and event['stage'] == '1':
         print("Request to execute cloudformation stack-update on " + str(event['stackId']) + " received.")
@@ -60,14 +63,12 @@ def createErrorOpsItem(stackId, message):
         
         print("Creating OpsItem to track error: " + message)
         
-        client = boto3.client('ssm')
-        
         opsData = {}
         opsData['/aws/resources'] = {}
         opsData['/aws/resources']['Value'] = "[{\"arn\": \"" + stackId + "\"}]"
         opsData['/aws/resources']['Type'] = 'SearchableString'
 
-        response = client.create_ops_item(
+        response = aws_clients.call('ssm', 'create_ops_item',
             Description=message,
             OperationalData=opsData,
             Source='Densify',
@@ -78,24 +79,7 @@ def createErrorOpsItem(stackId, message):
 
         print(response)
         
-        filter=[
-            {
-                'Key': 'OperationalData',
-                'Values': [
-                    "{\"key\":\"cloudformation:stack-name\",\"value\":\"" + stackId.split("/")[1] + "\"}",
-                ],
-                'Operator': 'Equal'
-            },
-            {
-                'Key': 'Status',
-                'Values': [
-                    "Open",
-                    "InProgress"
-                ],
-                'Operator': 'Equal'
-            }
-        ]
-        opsItemIds = ssm_functions.listAllOpsItemIds(filter)
+        opsItemIds = opsitem_index.getStackOpsItemIds(stackId.split("/")[1])
         notes = {"work_notes": "Failed to execute update - " + str(datetime.datetime.utcnow())}
         data = {'executionStatus': {'Value': json.dumps(notes), 'Type': 'String'}}
         ssm_functions.updateOpsItems(opsItemIds, 'InProgress', opsData=data)
@@ -110,9 +94,7 @@ def updateStack(stackId, context):
 
     try:
 
-        client = boto3.client('cloudformation')
-
-        response = client.update_stack(
+        response = aws_clients.call('cloudformation', 'update_stack',
             StackName=stackId,
             UsePreviousTemplate=True,
             Capabilities=[
@@ -135,9 +117,7 @@ def isStackInSync(stackId):
 
     try:
 
-        client = boto3.client('cloudformation')
-        
-        response = client.describe_stacks(
+        response = aws_clients.call('cloudformation', 'describe_stacks',
             StackName=stackId,
         )
 
@@ -149,7 +129,7 @@ def isStackInSync(stackId):
         waitTimeForDriftDetection = 300
         driftDetectionCheckInterval = 10
 
-        response = client.detect_stack_drift(
+        response = aws_clients.call('cloudformation', 'detect_stack_drift',
             StackName=stackId,
         )
         StackDriftDetectionId = response['StackDriftDetectionId']
@@ -157,7 +137,7 @@ def isStackInSync(stackId):
         while waitTimeForDriftDetection > 0:
             time.sleep(driftDetectionCheckInterval)
             waitTimeForDriftDetection-=driftDetectionCheckInterval
-            response = client.describe_stack_drift_detection_status(
+            response = aws_clients.call('cloudformation', 'describe_stack_drift_detection_status',
                 StackDriftDetectionId=StackDriftDetectionId
             )
             if response['Timestamp'] != driftLastChecked:
@@ -183,34 +163,15 @@ def process_main_stackEvent(message):
 
         #Validate that stack is in a valid state
         
-        client = boto3.client('cloudformation')
-        
-        response = client.describe_stacks(
+        response = aws_clients.call('cloudformation', 'describe_stacks',
             StackName=message['StackId']
         )
         
         if response['Stacks'][0]['StackStatus'] != message['ResourceStatus']:
             raise Exception ("Stack is in an invalid state. " + response['Stacks'][0]['StackStatus'])
         
-        filter=[
-			{
-				'Key': 'OperationalData',
-				'Values': [
-					"{\"key\":\"cloudformation:stack-name\",\"value\":\"" + message['StackName'] + "\"}",
-				],
-				'Operator': 'Equal'
-			},
-			{
-				'Key': 'Status',
-				'Values': [
-					"Open",
-					"InProgress"
-				],
-				'Operator': 'Equal'
-			}
-		]
-        
-        opsItemIds = ssm_functions.listAllOpsItemIds(filter)        
+        opsItems = opsitem_index.getStackOpsItems(message['StackName'])
+        opsItemIds = [opsItem['OpsItemId'] for opsItem in opsItems]
         windowId = ssm_functions.findActiveMaintenanceWindow("mw-" + message['StackName'])
 
         response = ssm_functions.describeMaintenanceWindowExecutions(windowId)
@@ -222,9 +183,8 @@ def process_main_stackEvent(message):
 
         if message['ResourceStatus'] == 'UPDATE_COMPLETE':
 
-            for opsItemId in opsItemIds:
-                opsItem = ssm_functions.getOpsItem(opsItemId)
-                parameterKey = opsItem['OpsItem']['OperationalData']['parameterKey']['Value']
+            for opsItem in opsItems:
+                parameterKey = opsitem_index.getOperationalValue(opsItem, 'parameterKey')
                 parameter = ssm_functions.getParameter(parameterKey)
                 version = ssm_functions.putParameter(parameterKey, parameter['Parameter']['Value'])
                 ssm_functions.labelParameterVersion(parameterKey, version, ['Executed'])
@@ -243,31 +203,11 @@ def process_resource_stackEvent(message):
     
     try:
         
-        filter=[
-			{
-				'Key': 'OperationalData',
-				'Values': [
-					"{\"key\":\"cloudformation:stack-name\",\"value\": \"" + message['StackName'] + "\"}"
-				],
-				'Operator': 'Equal'
-			},
-			{
-				'Key': 'Status',
-				'Values': [
-					"Open",
-					"InProgress"
-				],
-				'Operator': 'Equal'
-			}
-		]
-        
-        opsItemSummaries = ssm_functions.describeOpsItems(filter)
+        opsItemSummaries = opsitem_index.findByLogicalId(message['StackName'], message['LogicalResourceId'])
         
         opsItem = False
-        for opsItemTmp in opsItemSummaries['OpsItemSummaries']:
-            if opsItemTmp['OperationalData']['cloudformation:logical-id']['Value'] == message['LogicalResourceId']:
-                opsItem = ssm_functions.getOpsItem(opsItemTmp['OpsItemId'])
-                break
+        if len(opsItemSummaries) > 0:
+            opsItem = ssm_functions.getOpsItem(opsItemSummaries[0]['OpsItemId'])
         
         if opsItem == False:
             raise Exception ("A single opsItem was not located.")
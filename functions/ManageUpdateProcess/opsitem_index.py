@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import aws_clients
+
+#Index of the active (Open/InProgress) ops items, built from every page of describe_ops_items.  Each listing is
+#fetched once per (region, OperationalData key, value) and kept until reset(), which handlers call at the start
+#of an invocation so a warm container never serves a previous invocation's listing.  Ops items created or
+#updated through ssm_functions are recorded into every listing they belong to, so readers see local writes
+#without another describe.
+activeStatuses = ['Open', 'InProgress']
+listings = {}
+listingsLock = threading.Lock()
+
+def reset():
+
+    with listingsLock:
+        listings.clear()
+
+def buildFilter(key, value):
+
+    return [
+        {
+            'Key': 'OperationalData',
+            'Values': [
+                json.dumps({'key': key, 'value': value}, separators=(',', ':'))
+            ],
+            'Operator': 'Equal'
+        },
+        {
+            'Key': 'Status',
+            'Values': activeStatuses,
+            'Operator': 'Equal'
+        }
+    ]
+
+def describeAll(filter, region):
+
+    summaries = []
+    request = {'OpsItemFilters': filter}
+    while True:
+        response = aws_clients.call('ssm', 'describe_ops_items', region, **request)
+        summaries.extend(response['OpsItemSummaries'])
+        if 'NextToken' not in response:
+            break
+        request['NextToken'] = response['NextToken']
+
+    return summaries
+
+#Returns the listing (OpsItemId -> summary) for ops items whose OperationalData key equals value.  Concurrent
+#callers asking for the same listing wait for a single describe.
+def getListing(key, value, region=None):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    listingKey = (region, key, value)
+
+    with listingsLock:
+        listing = listings.get(listingKey)
+        if listing is None:
+            listing = {'ready': threading.Event(), 'items': None, 'error': None}
+            listings[listingKey] = listing
+            owner = True
+        else:
+            owner = False
+
+    if owner:
+        try:
+            items = {}
+            for summary in describeAll(buildFilter(key, value), region):
+                items[summary['OpsItemId']] = summary
+            listing['items'] = items
+        except Exception as error:
+            listing['error'] = error
+            with listingsLock:
+                del listings[listingKey]
+        finally:
+            listing['ready'].set()
+    else:
+        listing['ready'].wait()
+
+    if listing['error'] is not None:
+        raise listing['error']
+
+    with listingsLock:
+        return dict(listing['items'])
+
+def getOperationalValue(summary, key):
+
+    if 'OperationalData' in summary and key in summary['OperationalData']:
+        return summary['OperationalData'][key]['Value']
+
+    return None
+
+def getStackOpsItems(stackName, region=None):
+
+    return list(getListing('cloudformation:stack-name', stackName, region).values())
+
+def getStackOpsItemIds(stackName, region=None):
+
+    return list(getListing('cloudformation:stack-name', stackName, region).keys())
+
+def findByLogicalId(stackName, logicalId, region=None):
+
+    return [summary for summary in getStackOpsItems(stackName, region) if getOperationalValue(summary, 'cloudformation:logical-id') == logicalId]
+
+#With a stack name the stack's listing answers the lookup, otherwise the parameter key is listed on its own.
+def findByParameterKey(parameterKey, region=None, stackName=None):
+
+    if stackName is not None:
+        return [summary for summary in getStackOpsItems(stackName, region) if getOperationalValue(summary, 'parameterKey') == parameterKey]
+
+    return list(getListing('parameterKey', parameterKey, region).values())
+
+def recordCreate(opsItemId, opsData, region=None, **kwargs):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    summary = {'OpsItemId': opsItemId, 'Status': 'Open', 'OperationalData': dict(opsData)}
+    for name in ('title', 'source', 'category', 'severity'):
+        if name in kwargs:
+            summary[name[0].upper() + name[1:]] = kwargs[name]
+
+    with listingsLock:
+        for (listingRegion, key, value), listing in listings.items():
+            if listingRegion == region and listing['items'] is not None and getOperationalValue(summary, key) == value:
+                listing['items'][opsItemId] = dict(summary)
+
+def recordUpdate(opsItemIds, status, opsData=None, region=None):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    with listingsLock:
+        for (listingRegion, key, value), listing in listings.items():
+            if listingRegion != region or listing['items'] is None:
+                continue
+            for opsItemId in opsItemIds:
+                if opsItemId not in listing['items']:
+                    continue
+                if status not in activeStatuses:
+                    del listing['items'][opsItemId]
+                    continue
+                summary = dict(listing['items'][opsItemId])
+                summary['Status'] = status
+                summary['OperationalData'] = dict(summary.get('OperationalData', {}))
+                if opsData is not None:
+                    summary['OperationalData'].update(opsData)
+                listing['items'][opsItemId] = summary
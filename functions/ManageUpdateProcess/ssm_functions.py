@@ -6,9 +6,11 @@ Created on Thu Aug  6 09:57:56 2020
 """
 
 
-import boto3
+import aws_clients
+import opsitem_index
 import os
 
+@aws_clients.returnFalseOnError
 def list_tags(resourceType, resourceId, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -16,49 +18,54 @@ def list_tags(resourceType, resourceId, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
+    response = aws_clients.call('ssm', 'list_tags_for_resource', region,
+        ResourceType=resourceType,
+        ResourceId=resourceId
+    )
 
-    try:
+    returnJson = {}
+    for tag in response['TagList']:
+        returnJson[tag['Key']] = tag['Value']
 
-        response = ssm_client.list_tags_for_resource(
-            ResourceType=resourceType,
-            ResourceId=resourceId
-        )
+    return returnJson
 
-        returnJson = {}
-        for tag in response['TagList']:
-            returnJson[tag['Key']] = tag['Value']
+@aws_clients.returnFalseOnError
+def getParameter(key, **kwargs):
 
-        return returnJson
+    region = os.environ['AWS_REGION']
 
-    except Exception as error:
-        print("Exception caught during parameter retreival for parameter[" + resourceId + "] in region[" + region + "]: " + str(error))
-        return False
+    if 'region' in kwargs:
+        region = kwargs['region']
 
-def getParameter(key, **kwargs):
+    response = aws_clients.call('ssm', 'get_parameter', region,
+        Name=key,
+        WithDecryption=True
+    )
+
+    return response
+
+@aws_clients.returnFalseOnError
+def getParameters(keys, **kwargs):
 
     region = os.environ['AWS_REGION']
 
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.get_parameter(
-            Name=key,
+    #GetParameters accepts at most 10 names per call
+    names = list(dict.fromkeys(keys))
+    parameters = {}
+    for index in range(0, len(names), 10):
+        response = aws_clients.call('ssm', 'get_parameters', region,
+            Names=names[index:index + 10],
             WithDecryption=True
         )
+        for parameter in response['Parameters']:
+            parameters[parameter['Name']] = parameter
 
-        return response
-
-    except Exception as error:
-        print("Exception caught during parameter retreival for parameter[" + key + "] in region[" + region + "]: " + str(error))
-        return False
+    return parameters
 
+@aws_clients.returnFalseOnError
 def getParameterCurrentLabels(key, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -66,28 +73,25 @@ def getParameterCurrentLabels(key, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
+    #callers that already hold the parameter pass its version to save a GetParameter
+    if 'version' in kwargs:
+        currentVersion = kwargs['version']
+    else:
         currentVersion = getParameter(key, region=region)['Parameter']['Version']
 
-        response = ssm_client.get_parameter_history(
-            Name=key,
-            WithDecryption=True
-        )
-
+    request = {'Name': key, 'WithDecryption': True}
+    while True:
+        response = aws_clients.call('ssm', 'get_parameter_history', region, **request)
         for parameter in response['Parameters']:
             if parameter['Version'] == currentVersion:
                 return parameter['Labels']
+        if 'NextToken' not in response:
+            break
+        request['NextToken'] = response['NextToken']
 
-        return False
-
-    except Exception as error:
-        print("Exception caught during parameter retreival for parameter[" + key + "] in region[" + region + "]: " + str(error))
-        return False
+    return False
 
+@aws_clients.returnFalseOnError
 def labelParameterVersion(parameterKey, version, labels, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -95,23 +99,15 @@ def labelParameterVersion(parameterKey, version, labels, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        ssm_client.label_parameter_version(
-            Name=parameterKey,
-            ParameterVersion=version,
-            Labels=labels
-        )
-
-        return True
+    aws_clients.call('ssm', 'label_parameter_version', region,
+        Name=parameterKey,
+        ParameterVersion=version,
+        Labels=labels
+    )
 
-    except Exception as error:
-        print("Exception caught while labeling parameter[" + parameterKey + "] in region[" + region + "]: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def putParameter(parameterKey, value, **kwargs):
    
     region = os.environ['AWS_REGION']
@@ -123,26 +119,18 @@ def putParameter(parameterKey, value, **kwargs):
     if 'description' in kwargs:
         desc = kwargs['description']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.put_parameter(
-            Name=parameterKey,
-            Description=desc,
-            Value=value,
-            Type='String',
-            Overwrite=True,
-            Tier='Standard'
-        )
-
-        return response['Version']
+    response = aws_clients.call('ssm', 'put_parameter', region,
+        Name=parameterKey,
+        Description=desc,
+        Value=value,
+        Type='String',
+        Overwrite=True,
+        Tier='Standard'
+    )
 
-    except Exception as error:
-        print("Exception caught while creating/updating parameter[" + parameterKey + "] in region[" + region + "]: " + str(error))
-        return False
+    return response['Version']
 
+@aws_clients.returnFalseOnError
 def addTagsToResource(resourceType, resourceId, tags, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -150,23 +138,15 @@ def addTagsToResource(resourceType, resourceId, tags, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        ssm_client.add_tags_to_resource(
-            ResourceType=resourceType,
-            ResourceId=resourceId,
-            Tags=tags
-        )
+    aws_clients.call('ssm', 'add_tags_to_resource', region,
+        ResourceType=resourceType,
+        ResourceId=resourceId,
+        Tags=tags
+    )
 
-        return True
-
-    except Exception as error:
-        print("Error encountered while adding tags to " + resourceType + " with ID[" + resourceId + "]: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def removeTagsFromResource(resourceType, resourceId, tags, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -174,23 +154,15 @@ def removeTagsFromResource(resourceType, resourceId, tags, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        ssm_client.remove_tags_from_resource(
-            ResourceType=resourceType,
-            ResourceId=resourceId,
-            TagKeys=tags
-        )
-
-        return True
+    aws_clients.call('ssm', 'remove_tags_from_resource', region,
+        ResourceType=resourceType,
+        ResourceId=resourceId,
+        TagKeys=tags
+    )
 
-    except Exception as error:
-        print("Error encountered while removing tags from " + resourceType + " with ID[" + resourceId + "]: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def listAllOpsItemIds(filter, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -198,25 +170,13 @@ def listAllOpsItemIds(filter, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.describe_ops_items(
-            OpsItemFilters=filter
-        )
-
-        opItemIds = []
-        for opsItem in response['OpsItemSummaries']:
-            opItemIds.append(opsItem['OpsItemId'])
-
-        return opItemIds
+    opItemIds = []
+    for opsItem in opsitem_index.describeAll(filter, region):
+        opItemIds.append(opsItem['OpsItemId'])
 
-    except Exception as error:
-        print("Exception caught while trying to list ops item ids: " + str(error))
-        return False
+    return opItemIds
 
+@aws_clients.returnFalseOnError
 def describeOpsItems(filter, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -224,21 +184,9 @@ def describeOpsItems(filter, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.describe_ops_items(
-            OpsItemFilters=filter
-        )
-
-        return response
-
-    except Exception as error:
-        print("Exception caught while trying to describe ops items: " + str(error))
-        return False
+    return {'OpsItemSummaries': opsitem_index.describeAll(filter, region)}
 
+@aws_clients.returnFalseOnError
 def getOpsItem(OpsItemId, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -246,21 +194,13 @@ def getOpsItem(OpsItemId, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.get_ops_item(
-            OpsItemId=OpsItemId
-        )
+    response = aws_clients.call('ssm', 'get_ops_item', region,
+        OpsItemId=OpsItemId
+    )
 
-        return response
-
-    except Exception as error:
-        print("Exception encountered while getting opsItem [" + OpsItemId + "]: " + str(error))
-        return False
+    return response
 
+@aws_clients.returnFalseOnError
 def findActiveOpsItem(parameterKey, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -268,37 +208,19 @@ def findActiveOpsItem(parameterKey, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    try:
-
-        filter=[
-            {
-                'Key': 'OperationalData',
-                'Values': [
-                    "{\'key\':\'parameterKey\',\'value\':\'" + parameterKey + "\'}"
-                ],
-                'Operator': 'Equal'
-            },
-            {
-                'Key': 'Status',
-                'Values': [
-                    "Open",
-                    "InProgress"
-                ],
-                'Operator': 'Equal'
-            }
-        ]
+    stackName = None
 
-        opsItemIds = listAllOpsItemIds(filter, region=region)
+    if 'stackName' in kwargs:
+        stackName = kwargs['stackName']
 
-        if len(opsItemIds) != 1:
-            raise Exception ("Total number of ops item(s) " + str(opsItemIds) + " found is " + len(opsItemIds) + ".  There should only exist 1.")
+    opsItemIds = [opsItem['OpsItemId'] for opsItem in opsitem_index.findByParameterKey(parameterKey, region, stackName)]
 
-        return getOpsItem(opsItemIds[0])
+    if len(opsItemIds) != 1:
+        raise Exception ("Total number of ops item(s) " + str(opsItemIds) + " found is " + str(len(opsItemIds)) + ".  There should only exist 1.")
 
-    except Exception as error:
-        print("Exception caught while trying to identify active ops item: " + str(error))
-        return False
+    return getOpsItem(opsItemIds[0])
 
+@aws_clients.returnFalseOnError
 def close_window(windowId, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -306,21 +228,13 @@ def close_window(windowId, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        ssm_client.delete_maintenance_window(
-            WindowId=windowId
-        )
-
-        return True
+    aws_clients.call('ssm', 'delete_maintenance_window', region,
+        WindowId=windowId
+    )
 
-    except Exception as error:
-        print("Exception caught while trying to close maintenance window [" + windowId + "]: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def createOpsItem(description, source, title, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -328,27 +242,21 @@ def createOpsItem(description, source, title, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        response = ssm_client.create_ops_item(
-            Description=description,
-            Source=source,
-            Title=title,
-            OperationalData=kwargs['opsData'],
-            RelatedOpsItems=kwargs['relatedOpsItems'],
-            Category=kwargs['category'],
-            Severity=kwargs['severity']
-        )
+    response = aws_clients.call('ssm', 'create_ops_item', region,
+        Description=description,
+        Source=source,
+        Title=title,
+        OperationalData=kwargs['opsData'],
+        RelatedOpsItems=kwargs['relatedOpsItems'],
+        Category=kwargs['category'],
+        Severity=kwargs['severity']
+    )
 
-        return True
+    opsitem_index.recordCreate(response['OpsItemId'], kwargs['opsData'], region, title=title, source=source, category=kwargs['category'], severity=kwargs['severity'])
 
-    except Exception as error:
-        print("Exception encountered while creating ops items: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def updateOpsItems(opsItemIds, status, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -356,24 +264,17 @@ def updateOpsItems(opsItemIds, status, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        for opsItemId in opsItemIds:
-            ssm_client.update_ops_item(
-                Status=status,
-                OperationalData=kwargs['opsData'] if 'opsData' in kwargs else {},
-                OpsItemId=opsItemId
-            )
-
-        return True
+    for opsItemId in opsItemIds:
+        aws_clients.call('ssm', 'update_ops_item', region,
+            Status=status,
+            OperationalData=kwargs['opsData'] if 'opsData' in kwargs else {},
+            OpsItemId=opsItemId
+        )
+        opsitem_index.recordUpdate([opsItemId], status, kwargs['opsData'] if 'opsData' in kwargs else None, region)
 
-    except Exception as error:
-        print("Exception encountered while updating ops items: " + str(error))
-        return False
+    return True
 
+@aws_clients.returnFalseOnError
 def setRelatedOpsItem(opsItemId, relatedOpsItems, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -381,53 +282,38 @@ def setRelatedOpsItem(opsItemId, relatedOpsItems, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        ssm_client.update_ops_item(
-            RelatedOpsItems=relatedOpsItems,
-            OpsItemId=opsItemId
-        )
+    aws_clients.call('ssm', 'update_ops_item', region,
+        RelatedOpsItems=relatedOpsItems,
+        OpsItemId=opsItemId
+    )
 
-        return True
+    return True
 
-    except Exception as error:
-        print("Exception encountered while setting related ops items: " + str(error))
-        return False
-    
-def removeFromRelatedOpsItem(targetOpsItemId, opsItemIdToRemove):
+@aws_clients.returnFalseOnError
+def removeFromRelatedOpsItem(targetOpsItemId, opsItemIdToRemove, **kwargs):
 
     region = os.environ['AWS_REGION']
 
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-    
-    try:
-
-        targetOpsItem = getOpsItem(targetOpsItemId)
-        newRelatedList = []
-        for opsItemId in targetOpsItem:
-            if opsItemId['OpsItemId'] != opsItemIdToRemove:
-                newRelatedList.append({'OpsItemId': opsItemId['OpsItemId']})
+    targetOpsItem = getOpsItem(targetOpsItemId)
+    newRelatedList = []
+    for opsItemId in targetOpsItem:
+        if opsItemId['OpsItemId'] != opsItemIdToRemove:
+            newRelatedList.append({'OpsItemId': opsItemId['OpsItemId']})
 
-        ssm_client.update_ops_item(
-            RelatedOpsItems=newRelatedList,
-            OpsItemId=targetOpsItemId
-        )
+    aws_clients.call('ssm', 'update_ops_item', region,
+        RelatedOpsItems=newRelatedList,
+        OpsItemId=targetOpsItemId
+    )
 
-        return True
+    return True
 
-    except Exception as error:
-        print("Exception encountered while removing from related ops item ids: " + str(error))
-        return False
     
 #Maintenance Window Functions
 
+@aws_clients.returnFalseOnError
 def findActiveMaintenanceWindow(name, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -435,39 +321,31 @@ def findActiveMaintenanceWindow(name, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-        
-    try:
-        
-        response = ssm_client.describe_maintenance_windows(
-            Filters=[
-                {
-                    'Key': 'Name',
-                    'Values': [
-                        name
-                    ]
-                },
-                {
-                    'Key': 'Enabled',
-                    'Values': [
-                        'True'
-                    ]
-                }
-            ]
-        )
-        
-        print(response)
-                
-        if len(response['WindowIdentities']) != 1:
-            raise Exception ("Total number of maintenance window(s) " + str(response['WindowIdentities']) + " found is " + str(len(response['WindowIdentities'])) + ".  There should only exist 1.")
-        
-        return response['WindowIdentities'][0]['WindowId']
-        
-    except Exception as error:
-        print("Exception caught while locating maintenance window [" + name + "]: " + str(error))
-        return False
+    response = aws_clients.call('ssm', 'describe_maintenance_windows', region,
+        Filters=[
+            {
+                'Key': 'Name',
+                'Values': [
+                    name
+                ]
+            },
+            {
+                'Key': 'Enabled',
+                'Values': [
+                    'True'
+                ]
+            }
+        ]
+    )
+    
+    print(response)
+            
+    if len(response['WindowIdentities']) != 1:
+        raise Exception ("Total number of maintenance window(s) " + str(response['WindowIdentities']) + " found is " + str(len(response['WindowIdentities'])) + ".  There should only exist 1.")
+    
+    return response['WindowIdentities'][0]['WindowId']
 
+@aws_clients.returnFalseOnError
 def describeMaintenanceWindowExecutions(windowId, **kwargs):
 
     region = os.environ['AWS_REGION']
@@ -475,17 +353,8 @@ def describeMaintenanceWindowExecutions(windowId, **kwargs):
     if 'region' in kwargs:
         region = kwargs['region']
 
-    session = boto3.session.Session()
-    ssm_client = session.client('ssm', region)
-        
-    try:
-        
-        response = ssm_client.describe_maintenance_window_executions(
-            WindowId=windowId
-        )
-        
-        return response
-        
-    except Exception as error:
-        print("Exception caught while locating maintenance window executions [" + windowId + "]: " + str(error))
-        return False
\ No newline at end of file
+    response = aws_clients.call('ssm', 'describe_maintenance_window_executions', region,
+        WindowId=windowId
+    )
+    
+    return response
\ No newline at end of file
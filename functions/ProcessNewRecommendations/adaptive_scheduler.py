@@ -0,0 +1,57 @@
+import aws_clients
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+
+#Runs a function over a list of tasks with an AIMD concurrency window: the window is halved whenever the
+#AWS clients report new throttling and grows by one after a full window of unthrottled completions.  New
+#tasks stop being started once the lambda's remaining time drops below the reserve, and are handed back.
+def run(function, tasks, context, initialWindow, maxWindow, reserveMillis):
+
+    pending = deque(tasks)
+    inflight = {}
+    results = []
+    window = max(1, min(initialWindow, maxWindow))
+    completedInWindow = 0
+    lastThrottleCount = aws_clients.getThrottleCount()
+    accepting = True
+
+    executor = ThreadPoolExecutor(max_workers=maxWindow)
+
+    try:
+
+        while len(pending) > 0 or len(inflight) > 0:
+
+            if accepting and len(pending) > 0 and context.get_remaining_time_in_millis() < reserveMillis:
+                print("Less than " + str(reserveMillis) + "ms remaining, not starting the remaining " + str(len(pending)) + " task(s).")
+                accepting = False
+
+            while accepting and len(pending) > 0 and len(inflight) < window:
+                task = pending.popleft()
+                inflight[executor.submit(function, task)] = task
+
+            if len(inflight) == 0:
+                break
+
+            done, notDone = wait(list(inflight), timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                del inflight[future]
+                results.append(future.result())
+
+            throttleCount = aws_clients.getThrottleCount()
+            if throttleCount > lastThrottleCount:
+                window = max(1, window // 2)
+                completedInWindow = 0
+                lastThrottleCount = throttleCount
+                print("Throttling detected, concurrency window reduced to " + str(window) + ".")
+            else:
+                completedInWindow += len(done)
+                if completedInWindow >= window and window < maxWindow:
+                    window += 1
+                    completedInWindow = 0
+
+    finally:
+        executor.shutdown(wait=False)
+
+    return {'results': results, 'unfinished': list(pending), 'window': window}
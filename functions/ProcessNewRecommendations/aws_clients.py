@@ -0,0 +1,229 @@
+import boto3
+import functools
+import json
+import os
+import random
+import threading
+import time
+import botocore.exceptions
+from botocore.config import Config
+
+#Clients are thread safe, so a single client per service/region is shared by every
+#worker thread and kept for the lifetime of the container to be reused by warm invocations.
+session = boto3.session.Session()
+clients = {}
+clientsLock = threading.Lock()
+
+#Retries are owned by call() below, so botocore is told to make a single attempt per call.
+clientConfig = {'retries': {'max_attempts': 1, 'mode': 'standard'}}
+
+#Throttled responses seen by call(), used to adapt concurrency.
+throttlingCodes = frozenset(['Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException', 'RequestLimitExceeded'])
+transientCodes = frozenset(['InternalServerError', 'InternalError', 'ServiceUnavailable', 'ServiceUnavailableException', 'RequestTimeout', 'RequestTimeoutException'])
+throttleCount = 0
+throttleCountLock = threading.Lock()
+
+#Operations are grouped into families that share a client side rate (per region), so that a burst of
+#tag writes does not starve parameter reads.  Unlisted operations use the service's default family.
+apiFamilies = {
+    'ssm': {
+        'get_parameter': 'read',
+        'get_parameters': 'read',
+        'get_parameters_by_path': 'read',
+        'get_parameter_history': 'read',
+        'describe_parameters': 'read',
+        'list_tags_for_resource': 'read',
+        'put_parameter': 'write',
+        'label_parameter_version': 'write',
+        'add_tags_to_resource': 'tags',
+        'remove_tags_from_resource': 'tags',
+        'create_ops_item': 'opsitems',
+        'describe_ops_items': 'opsitems',
+        'get_ops_item': 'opsitems',
+        'update_ops_item': 'opsitems'
+    }
+}
+
+#Requests per second for each family, overridable with the ApiRateLimits environment variable
+#(a JSON object such as {"ssm:tags": 5}).
+defaultRates = {
+    'ssm:read': 40,
+    'ssm:write': 10,
+    'ssm:tags': 10,
+    'ssm:opsitems': 10,
+    'ssm:default': 10,
+    'cloudformation:default': 10,
+    'lambda:default': 50,
+    'sqs:default': 100
+}
+buckets = {}
+bucketsLock = threading.Lock()
+
+class AWSCallError(Exception):
+
+    def __init__(self, service, operation, region, code, message, retryable):
+        super().__init__(service + "." + operation + " in region[" + region + "] failed with " + code + ": " + message)
+        self.service = service
+        self.operation = operation
+        self.region = region
+        self.code = code
+        self.message = message
+        self.retryable = retryable
+
+class TokenBucket:
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = float(rate)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    #Takes a token, waiting for one to accumulate if the bucket is empty.  Tokens are reserved while
+    #holding the lock (the balance may go negative) so waiting callers are served in arrival order.
+    def acquire(self):
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+#Largest number of worker threads a function runs at once: MaxThreadPoolSize, or twice ThreadPoolSize so an
+#adaptive window has room to grow.
+def getMaxConcurrency():
+
+    if 'MaxThreadPoolSize' in os.environ:
+        return int(os.environ['MaxThreadPoolSize'])
+
+    if 'ThreadPoolSize' in os.environ:
+        return int(os.environ['ThreadPoolSize']) * 2
+
+    return 10
+
+#Every worker thread may hold a connection, so the botocore pool is sized to the concurrency limit.
+def getPoolSize():
+
+    return max(10, getMaxConcurrency())
+
+def getRetryAttempts():
+
+    attempts = 6
+
+    if 'ApiRetryAttempts' in os.environ:
+        attempts = int(os.environ['ApiRetryAttempts'])
+
+    return attempts
+
+def getClient(service, region=None):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    key = service + ":" + region
+    client = clients.get(key)
+
+    if client is None:
+        with clientsLock:
+            client = clients.get(key)
+            if client is None:
+                client = session.client(service, region, config=Config(max_pool_connections=getPoolSize(), **clientConfig))
+                clients[key] = client
+
+    return client
+
+def getFamily(service, operation):
+
+    return service + ":" + apiFamilies.get(service, {}).get(operation, 'default')
+
+def getBucket(family, region):
+
+    key = family + ":" + region
+    bucket = buckets.get(key)
+
+    if bucket is None:
+        with bucketsLock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(getRate(family))
+                buckets[key] = bucket
+
+    return bucket
+
+#Requests per second allowed for a family, e.g. to size work so that it fits in a time budget.
+def getRate(family):
+
+    rates = dict(defaultRates)
+    if 'ApiRateLimits' in os.environ:
+        rates.update(json.loads(os.environ['ApiRateLimits']))
+
+    return rates.get(family, rates.get(family.split(":")[0] + ":default", 10))
+
+#Calls client.<operation>(**params) through the family's rate limiter, retrying throttled, transient and
+#connection failures with full jitter exponential backoff.  Failures are raised as AWSCallError.
+def call(service, operation, region=None, **params):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    client = getClient(service, region)
+    bucket = getBucket(getFamily(service, operation), region)
+    attempts = getRetryAttempts()
+    attempt = 0
+
+    while True:
+
+        attempt += 1
+        bucket.acquire()
+
+        try:
+            return getattr(client, operation)(**params)
+
+        except botocore.exceptions.ClientError as error:
+            code = error.response.get('Error', {}).get('Code', 'Unknown')
+            message = error.response.get('Error', {}).get('Message', str(error))
+            status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+            if code in throttlingCodes:
+                countThrottling()
+            retryable = code in throttlingCodes or code in transientCodes or status >= 500
+            if not retryable or attempt >= attempts:
+                raise AWSCallError(service, operation, region, code, message, retryable) from error
+
+        except (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError) as error:
+            if attempt >= attempts:
+                raise AWSCallError(service, operation, region, type(error).__name__, str(error), True) from error
+
+        time.sleep(random.uniform(0, min(5, 0.1 * (2 ** attempt))))
+
+#For helpers whose contract is to return False on failure.  A call that was still being throttled once
+#its retries were exhausted is re-raised instead, so it is not mistaken for a missing resource.
+def returnFalseOnError(function):
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+
+        try:
+            return function(*args, **kwargs)
+
+        except Exception as error:
+            if isinstance(error, AWSCallError) and error.retryable:
+                raise
+            print("Exception caught in " + function.__name__ + str(list(args)) + ": " + str(error))
+            return False
+
+    return wrapper
+
+def countThrottling():
+
+    global throttleCount
+
+    with throttleCountLock:
+        throttleCount += 1
+
+def getThrottleCount():
+
+    return throttleCount
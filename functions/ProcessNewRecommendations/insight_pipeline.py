@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#Runs insights as a staged pipeline: every insight of a batch is read before any is planned, and every plan of
+#the batch is made before any write.  Each stage reports its wall clock time.  The remaining time is checked
+#before every batch and handed to applyAll, which checks it again before each group of writes; work that was
+#not started once the remaining time drops below the reserve is handed back.
+def run(read, plan, applyAll, onError, tasks, context, concurrency, reserveMillis, batchSize):
+
+    results = []
+    timings = {}
+    index = 0
+
+    def hasTime():
+        return context.get_remaining_time_in_millis() >= reserveMillis
+
+    while index < len(tasks):
+
+        if not hasTime():
+            print("Less than " + str(reserveMillis) + "ms remaining, not starting the remaining " + str(len(tasks) - index) + " task(s).")
+            break
+
+        batch = tasks[index:index + batchSize]
+        outcomes = runStage('read', read, batch, concurrency, timings)
+
+        #reads have no side effects, so a batch whose reads ran into the reserve is handed back whole
+        if not hasTime():
+            print("Less than " + str(reserveMillis) + "ms remaining after reading, not writing the remaining " + str(len(tasks) - index) + " task(s).")
+            break
+
+        index += len(batch)
+
+        states = []
+        for task, state, error in outcomes:
+            if error is not None:
+                results.append(onError(task, error))
+            else:
+                states.append(state)
+
+        plans = planStage(plan, states, onError, results, timings)
+
+        results.extend(applyAll(plans, concurrency, timings, hasTime))
+
+    print("Pipeline stage timings: " + ", ".join(name + "=" + str(round(timings[name], 3)) + "s" for name in timings))
+
+    return {'results': results, 'unfinished': tasks[index:], 'window': concurrency, 'timings': timings}
+
+def planStage(plan, states, onError, results, timings):
+
+    started = time.monotonic()
+
+    plans = []
+    for state in states:
+        try:
+            plans.append(plan(state))
+        except Exception as error:
+            results.append(onError([state['parameterKey'], state['insight']], error))
+
+    timings['plan'] = timings.get('plan', 0) + time.monotonic() - started
+
+    return plans
+
+#Applies function to every item on a thread pool and returns (item, result, error) in the order of the items.
+def runStage(name, function, items, concurrency, timings):
+
+    started = time.monotonic()
+
+    def call(item):
+        try:
+            return (item, function(item), None)
+        except Exception as error:
+            return (item, None, error)
+
+    if len(items) == 0:
+        outcomes = []
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as executor:
+            outcomes = list(executor.map(call, items))
+
+    timings[name] = timings.get(name, 0) + time.monotonic() - started
+
+    return outcomes
+
+#Runs a write stage in groups of groupSize items, checking the remaining time before each group.  Returns the
+#outcomes of the groups that ran and the items of the groups that were not started.
+def runGroupedStage(name, function, items, concurrency, timings, hasTime, groupSize):
+
+    outcomes = []
+    for index in range(0, len(items), groupSize):
+        if not hasTime():
+            print("Out of time before the " + name + " stage, deferring " + str(len(items) - index) + " item(s).")
+            return outcomes, items[index:]
+        outcomes.extend(runStage(name, function, items[index:index + groupSize], concurrency, timings))
+
+    return outcomes, []
@@ -1,77 +1,128 @@
 import json
 import os
-import boto3
+import uuid
+import aws_clients
 import ssm_functions
+import opsitem_index
+import relation_hub
+import adaptive_scheduler
+import insight_pipeline
 import datetime
-import time
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import wait
 import logging
 
 logger = logging.getLogger()
 logger.setLevel(logging.WARNING)
 
+#parameter store limits on resource tags
+maxTagsPerResource = 50
+maxTagValueLength = 256
+
 def lambda_handler(event, context):
     
     print(event)
+
+    #insights dispatched through the FIFO insight queue share a message group per stack, so the queue hands a
+    #stack's chunks over one at a time and their post-passes (related ops items, window cancellation) never overlap
+    if isinstance(event, dict) and 'Records' in event:
+        for record in event['Records']:
+            processInsights(json.loads(record['body']), context, record['attributes']['MessageGroupId'])
+        return {
+            'statusCode': 200,
+            'body': json.dumps('Successfully processed insights!')
+        }
+
+    return processInsights(event, context)
+
+#Processes the insights of one stack (a list, or a continuation carrying the ops items resolved so far).  Insights
+#that could not be finished are handed to a continuation in the same message group, or invoked directly.
+def processInsights(event, context, messageGroupId=None):
+
     insights = event
+
+    opsitem_index.reset()
+
+    #continuation invokes carry the remaining insights along with the ops items resolved so far
+    resolvedOpsItemIds = set()
+    if isinstance(event, dict):
+        insights = event['insights']
+        resolvedOpsItemIds.update(event['resolvedOpsItems'])
         
     print("Processing insights for CFT " + insights[0]['cloudformation:stack-id'])
 
-    #process insights
-    executor = ThreadPoolExecutor(max_workers=int(os.environ['ThreadPoolSize']))
-    futures = []
+    #identify parameter keys
+    work = []
     for insight in insights:
 
         if insight['serviceType'] == 'EC2':
-            args = ['/densify/iaas/ec2/' + insight['resourceId'] + '/instanceType', insight]
-            futures.append(executor.submit(processInsight, args))
+            work.append(['/densify/iaas/ec2/' + insight['resourceId'] + '/instanceType', insight])
         elif insight['serviceType'] == 'RDS':
-            args = ['/densify/iaas/rds/' + insight['name'] + '/dbInstanceClass', insight]
-            futures.append(executor.submit(processInsight, args))
+            work.append(['/densify/iaas/rds/' + insight['name'] + '/dbInstanceClass', insight])
 
-    result = wait(futures, timeout=900)
-    print('Completed Tasks : '+str(result.done))
-    
-    time.sleep(5)
-    
-    #fix any remaining ops items
-    filter=[
-        {
-            'Key': 'OperationalData',
-            'Values': [
-                "{\'key\':\'cloudformation:stack-name\',\'value\':\'" + insights[0]['cloudformation:stack-name'] + "\'}"
-            ],
-            'Operator': 'Equal'
-        },
-        {
-            'Key': 'Status',
-            'Values': [
-                "Open",
-                "InProgress"
-            ],
-            'Operator': 'Equal'
+    #read all current parameters for the stack in batches rather than one call per insight
+    parameters = ssm_functions.getParameters([args[0] for args in work], region=insights[0]['regionId'])
+
+    #process insights
+    initialWindow = int(os.environ['ThreadPoolSize'])
+    maxWindow = aws_clients.getMaxConcurrency()
+    reserveMillis = getTimeReserveMillis()
+    tasks = [args + [parameters] for args in work]
+    if 'ProcessingMode' in os.environ and os.environ['ProcessingMode'] == 'pipeline':
+        batchSize = int(os.environ['PipelineBatchSize']) if 'PipelineBatchSize' in os.environ else 500
+        result = insight_pipeline.run(readInsight, planInsight, applyInsightPlans, insightError, tasks, context, maxWindow, reserveMillis, batchSize)
+    else:
+        result = adaptive_scheduler.run(processInsight, tasks, context, initialWindow, maxWindow, reserveMillis)
+    print('Completed Tasks : ' + str(len(result['results'])) + ', final concurrency window : ' + str(result['window']))
+
+    #collect the ops items resolved by the workers during this run
+    insightsByKey = dict((args[0], args) for args in work)
+    ticketIds = []
+    for outcome in result['results']:
+        if outcome != False:
+            resolvedOpsItemIds.update(outcome['resolvedOpsItems'])
+            if 'cancelTickets' in outcome:
+                ticketIds.extend(outcome['cancelTickets'])
+            if outcome['status'] == 'throttled' or outcome['status'] == 'deferred':
+                result['unfinished'].append(insightsByKey[outcome['parameterKey']])
+
+    cancelTickets(ticketIds)
+
+    #hand any insights that could not be started (or stayed throttled) over to a new invocation rather than dropping them
+    if len(result['unfinished']) > 0:
+        continuations = buildContinuations([args[1] for args in result['unfinished']], resolvedOpsItemIds)
+        print("Re-enqueuing " + str(len(result['unfinished'])) + " unfinished insight(s) in " + str(len(continuations)) + " continuation(s).")
+        for continuation in continuations:
+            if messageGroupId != None:
+                continued = enqueueInsights(continuation, messageGroupId)
+            else:
+                continued = lambda_execute(context.function_name, continuation)
+            if continued == False:
+                #failing the invocation makes lambda retry the async event instead of silently dropping the insights
+                raise Exception ("Failed to re-enqueue " + str(len(result['unfinished'])) + " unfinished insight(s).")
+        return {
+            'statusCode': 202,
+            'body': json.dumps('Partially processed insights, remaining insights re-enqueued.')
         }
-    ]
     
-    opsItemIds = ssm_functions.listAllOpsItemIds(filter, region=insights[0]['regionId'])
-    if len(opsItemIds) != 0:
-        print("Adjusting related ops items for remaining ops items " + str(opsItemIds) + ".")
-        for opsItemId in opsItemIds:
-            relatedOpsItems = []
-            relatedOpsItemIds = opsItemIds.copy()
-            counter = 0
-            for relatedOpsItemId in relatedOpsItemIds:
-                if relatedOpsItemId == opsItemId:
-                    del relatedOpsItemIds[counter]
-                    break
-                else:
-                    counter+=1
-            for relatedOpsItemId in relatedOpsItemIds:
-                relatedOpsItems.append({'OpsItemId': relatedOpsItemId})
-            ssm_functions.setRelatedOpsItem(opsItemId, relatedOpsItems, region=insights[0]['regionId'])
+    #fix any remaining ops items
+    try:
+        opsItemIds = opsitem_index.getStackOpsItemIds(insights[0]['cloudformation:stack-name'], insights[0]['regionId'])
+    except Exception as error:
+        print("Exception caught while listing ops items: " + str(error))
+        opsItemIds = False
+
+    if opsItemIds == False:
+        print("Unable to list the remaining ops items for the stack.")
 
     else:
+        #the listing may still report items resolved moments ago, so the run's own results take precedence
+        opsItemIds = [opsItemId for opsItemId in opsItemIds if opsItemId not in resolvedOpsItemIds]
+        if len(resolvedOpsItemIds) == 0:
+            print("No ops items were resolved, related ops items are unchanged.")
+        else:
+            print("Relating remaining ops items " + str(opsItemIds) + " through the stack's hub.")
+            relation_hub.syncHub(insights[0]['cloudformation:stack-name'], removed=resolvedOpsItemIds, region=insights[0]['regionId'])
+
+    if opsItemIds != False and len(opsItemIds) == 0:
         maintenanceWindowId = ssm_functions.findActiveMaintenanceWindow('mw-' + insights[0]['cloudformation:stack-name'], region=insights[0]['regionId'])
         if maintenanceWindowId != False:
             print("Cancelling maintenance window [" + str(maintenanceWindowId) + "].")
@@ -125,132 +176,358 @@ def dictToTagList(pythonDict):
         print("Exception caught while converting a simple json string [" + str(pythonDict) + "] into a tagList: " + str(error))
         return False
 
+def insightToTags(insight):
+
+    tags = {}
+    for tag in dictToTagList(insight):
+        if len(tag['Value']) > maxTagValueLength:
+            print("Truncating value of tag [" + tag['Key'] + "] to " + str(maxTagValueLength) + " characters.")
+            tag['Value'] = tag['Value'][:maxTagValueLength]
+        tags[tag['Key']] = tag['Value']
+
+    if len(tags) > maxTagsPerResource:
+        raise Exception("Insight has " + str(len(tags)) + " tags, which is more than the " + str(maxTagsPerResource) + " allowed on a parameter.")
+
+    return tags
+
+def diffTags(current, desired):
+
+    add = []
+    for key in desired:
+        if key not in current or current[key] != desired[key]:
+            add.append({'Key': key, 'Value': desired[key]})
+
+    remove = []
+    for key in current:
+        if key not in desired:
+            remove.append(key)
+
+    return {'add': add, 'remove': remove}
+
+def applyTagDiff(parameterKey, current, diff, region):
+
+    if len(diff['add']) == 0 and len(diff['remove']) == 0:
+        return True
+
+    #adding first means the parameter is never left without its tags, unless the interim set would exceed the tag limit
+    newKeys = len([tag for tag in diff['add'] if tag['Key'] not in current])
+    removeFirst = len(current) + newKeys > maxTagsPerResource
+
+    if removeFirst and len(diff['remove']) > 0 and ssm_functions.removeTagsFromResource('Parameter', parameterKey, diff['remove'], region=region) != True:
+        return False
+
+    if len(diff['add']) > 0 and ssm_functions.addTagsToResource('Parameter', parameterKey, diff['add'], region=region) != True:
+        return False
+
+    if not removeFirst and len(diff['remove']) > 0 and ssm_functions.removeTagsFromResource('Parameter', parameterKey, diff['remove'], region=region) != True:
+        return False
+
+    return True
+
+#Insights are processed in three stages: readInsight gathers the current state from parameter store, planInsight
+#decides in memory what has to change and applyInsightPlan performs the writes.  The engines only differ in how
+#the stages of many insights are interleaved.
+def readInsight(args):
+
+    parameterKey = args[0]
+    insight = args[1]
+    parameters = args[2]
+    region = insight['regionId']
+
+    print("Processing insight: " + str(insight))
+
+    state = {'parameterKey': parameterKey, 'insight': insight, 'parameter': False, 'tags': {}, 'changed': None, 'opsItem': None}
+
+    if parameters != False:
+        state['parameter'] = {'Parameter': parameters[parameterKey]} if parameterKey in parameters else False
+    else:
+        state['parameter'] = ssm_functions.getParameter(parameterKey, region=region)
+
+    if state['parameter'] == False:
+        return state
+
+    print("Parameter[" + parameterKey + "] currently exists: " + str(state['parameter']))
+
+    tags = ssm_functions.list_tags('Parameter', parameterKey, region=region)
+    if tags == False:
+        raise Exception("Unable to read the tags of parameter[" + parameterKey + "].")
+    state['tags'] = tags
+    state['changed'] = hasInsightChanged(tags, insight)
+
+    #the ops item is only needed to decide whether a changed recommendation may still replace the scheduled one
+    if state['changed']['hasInsightChanged'] == True and 'opsItemId' in tags:
+        state['opsItem'] = ssm_functions.getOpsItem(tags['opsItemId'], region=region)
+        if state['opsItem'] == False:
+            raise Exception("Unable to read ops item [" + tags['opsItemId'] + "].")
+
+    return state
+
+def isMaintenanceWindowCancellable(opsItem):
+
+    operationalData = opsItem['OpsItem']['OperationalData']
+
+    if 'scheduledMaintenanceWindowDetails' not in operationalData:
+        print("Maintenance window has not yet been scheduled.  Cancelling assoicated ops item and itsm ticket.")
+        return True
+
+    cancellationThreshold = int(os.environ['CancellationThreshold'])
+    windowDate = datetime.datetime.strptime(operationalData['scheduledMaintenanceWindowDetails']['Value'].split("\n")[1].split("=")[1], '%Y-%m-%dT%H:%M:%S')
+    timeDelta = windowDate - datetime.datetime.utcnow()
+
+    if timeDelta.total_seconds() > cancellationThreshold:
+        print("Maintenance window is currently scheduled for " + str(windowDate) + " which is more than " + str(cancellationThreshold) + " seconds away.")
+        return True
+
+    print("Maintenance window is currently scheduled for " + str(windowDate) + " which is less than " + str(cancellationThreshold) + " seconds away.")
+    return False
+
+def planInsight(state):
+
+    parameterKey = state['parameterKey']
+    insight = state['insight']
+    tags = state['tags']
+
+    plan = {'parameterKey': parameterKey, 'insight': insight, 'tags': tags, 'status': 'unchanged', 'opsItemId': '', 'itsmTicketId': '', 'addTags': []}
+
+    if state['parameter'] == False:
+        print("Parameter[" + parameterKey + "] does not exist.")
+        plan['status'] = 'initialized'
+        return plan
+
+    hasChanged = state['changed']
+    print(hasChanged)
+    if hasChanged['hasInsightChanged'] == False and hasChanged['hasTagsChanged'] == False:
+        print("There has been no change to the insight context.  Not doing anything.")
+        return plan
+
+    if 'itsmTicketId' in tags:
+        print("ITSM ticket found: " + str(tags['itsmTicketId']))
+        plan['itsmTicketId'] = tags['itsmTicketId']
+    else:
+        print("Could not find an assoicated ITSM ticket.")
+
+    if 'opsItemId' in tags:
+        print("Ops Item found: " + str(tags['opsItemId']))
+        plan['opsItemId'] = tags['opsItemId']
+    else:
+        print("Could not find an assoicated ops item.")
+
+    initializeInsight = False
+    if hasChanged['hasInsightChanged'] == True:
+        initializeInsight = state['opsItem'] is None or isMaintenanceWindowCancellable(state['opsItem'])
+
+    if initializeInsight == True:
+        plan['status'] = 'initialized'
+    else:
+        plan['status'] = 'synchronized'
+        if hasChanged['hasTagsChanged'] == True:
+            #tags that are not part of the insight (e.g. itsmTicketId) are kept while synchronizing
+            plan['addTags'] = diffTags(tags, insightToTags(insight))['add']
+
+    return plan
+
+#Tickets are cancelled once per run: the collected ids go to the ITSM function in a single request, which
+#reads the ServiceNow credentials from its own cache.
+def cancelTickets(ticketIds):
+
+    if len(ticketIds) == 0:
+        return True
+
+    print("Cancelling ITSM ticket(s) " + str(ticketIds) + ".")
+
+    lambdaEvent = {}
+    lambdaEvent['function'] = 'cancelBatch'
+    lambdaEvent['ticketIds'] = ticketIds
+    lambdaEvent['input'] = {'state': '4', 'work_notes': 'Cancelling ticket due to new recommendation from Densify.'}
+
+    functionName = "CollaborationOrchestrator"
+    if 'ITSMFunctionName' in os.environ:
+        functionName = os.environ['ITSMFunctionName']
+
+    return lambda_execute(functionName, lambdaEvent) != False
+
+def applyInsightPlan(plan):
+
+    parameterKey = plan['parameterKey']
+    insight = plan['insight']
+    tags = plan['tags']
+    region = insight['regionId']
+    result = {'parameterKey': parameterKey, 'status': plan['status'], 'resolvedOpsItems': [], 'cancelTickets': []}
+
+    if plan['status'] == 'synchronized' and len(plan['addTags']) > 0:
+        print("Sychronizing tags")
+        applyTagDiff(parameterKey, tags, {'add': plan['addTags'], 'remove': []}, region)
+
+    elif plan['status'] == 'initialized':
+
+        if plan['opsItemId'] != "":
+            print("Closing Ops Item [" + plan['opsItemId'] + "].")
+            if ssm_functions.updateOpsItems([plan['opsItemId']], 'Resolved', region=region) == True:
+                result['resolvedOpsItems'].append(plan['opsItemId'])
+
+        if plan['itsmTicketId'] != "":
+            result['cancelTickets'].append(plan['itsmTicketId'])
+
+        print("Initializing parameter [" + parameterKey + "].")
+
+        print("Updating Parameter")
+        version = ssm_functions.putParameter(parameterKey, insight['currentType'], description=insight['name'], region=region)
+
+        #only tags that differ are written and stale ones removed, rather than removing and re-adding every tag
+        if version != False and applyTagDiff(parameterKey, tags, diffTags(tags, insightToTags(insight)), region) == True and ssm_functions.labelParameterVersion(parameterKey, version, ['Initialize'], region=region) == True:
+            print("Successfully initialized parameter.")
+
+    return result
+
+#Applies the plans of a whole batch with the writes grouped by kind, each group running concurrently.  Groups
+#keep the per-insight order (resolve, put, tag and label) and an insight whose write raised drops out of the
+#later groups.  The label follows the tags within the same task, so a parameter never carries the new tags of a
+#version that is left without its Initialize label.  Groups are sized to what the API rates allow within half
+#the time reserve, and insights whose group could not be started before the reserve are deferred.
+def applyInsightPlans(plans, concurrency, timings, hasTime):
+
+    outcomes = {}
+    for plan in plans:
+        outcomes[plan['parameterKey']] = {'parameterKey': plan['parameterKey'], 'status': plan['status'], 'resolvedOpsItems': [], 'cancelTickets': []}
+
+    def active(plan):
+        return outcomes[plan['parameterKey']] != False and outcomes[plan['parameterKey']]['status'] not in ('throttled', 'deferred')
+
+    def stage(name, function, group, family, callsPerItem):
+        completed, deferred = insight_pipeline.runGroupedStage(name, function, [plan for plan in group if active(plan)], concurrency, timings, hasTime, getWriteGroupSize(family, callsPerItem))
+        for plan in deferred:
+            outcomes[plan['parameterKey']]['status'] = 'deferred'
+        succeeded = []
+        for plan, result, error in completed:
+            if error is not None:
+                outcomes[plan['parameterKey']] = insightError([plan['parameterKey'], plan['insight']], error)
+            else:
+                succeeded.append((plan, result))
+        return succeeded
+
+    initialize = [plan for plan in plans if plan['status'] == 'initialized']
+
+    for plan, result in stage('resolve', lambda plan: ssm_functions.updateOpsItems([plan['opsItemId']], 'Resolved', region=plan['insight']['regionId']), [plan for plan in initialize if plan['opsItemId'] != ""], 'ssm:opsitems', 1):
+        if result == True:
+            outcomes[plan['parameterKey']]['resolvedOpsItems'].append(plan['opsItemId'])
+
+    versions = {}
+    for plan, result in stage('put', lambda plan: ssm_functions.putParameter(plan['parameterKey'], plan['insight']['currentType'], description=plan['insight']['name'], region=plan['insight']['regionId']), initialize, 'ssm:write', 1):
+        if result != False:
+            versions[plan['parameterKey']] = result
+
+    def tagAndLabel(plan):
+        if plan['status'] == 'synchronized':
+            return applyTagDiff(plan['parameterKey'], plan['tags'], {'add': plan['addTags'], 'remove': []}, plan['insight']['regionId'])
+        if applyTagDiff(plan['parameterKey'], plan['tags'], diffTags(plan['tags'], insightToTags(plan['insight'])), plan['insight']['regionId']) != True:
+            return False
+        return ssm_functions.labelParameterVersion(plan['parameterKey'], versions[plan['parameterKey']], ['Initialize'], region=plan['insight']['regionId'])
+
+    #an add and a remove call per insight in the tag family, the label in the write family
+    stage('tag', tagAndLabel, [plan for plan in plans if (plan['status'] == 'synchronized' and len(plan['addTags']) > 0) or plan['parameterKey'] in versions], 'ssm:tags', 2)
+
+    #tickets are only collected here, the run cancels them in one request; a deferred insight keeps its ticket
+    #tag and cancels it when the continuation initializes it
+    for plan in initialize:
+        if plan['itsmTicketId'] != "" and active(plan):
+            outcomes[plan['parameterKey']]['cancelTickets'].append(plan['itsmTicketId'])
+
+    return [outcomes[plan['parameterKey']] for plan in plans]
+
+#Number of insights a write group may hold so that, at the family's rate, it completes within half the reserve.
+def getWriteGroupSize(family, callsPerItem):
+
+    return max(1, int(aws_clients.getRate(family) * getTimeReserveMillis() / 2000 / callsPerItem))
+
+def getTimeReserveMillis():
+
+    reserveMillis = 60000
+
+    if 'TimeReserveMillis' in os.environ:
+        reserveMillis = int(os.environ['TimeReserveMillis'])
+
+    return reserveMillis
+
+def insightError(args, error):
+
+    #still throttled after the wrapper's retries, the insight is handed to a continuation instead of being dropped
+    if isinstance(error, aws_clients.AWSCallError) and error.retryable:
+        print("Deferring " + args[1]['serviceType'] + " insight [" + args[0] + "]: " + str(error))
+        return {'parameterKey': args[0], 'status': 'throttled', 'resolvedOpsItems': []}
+
+    print("Exception caught while processing " + args[1]['serviceType'] + " insight.\n" + str(error))
+    return False
+
 def processInsight(args):
 
     try:
-        
-        parameterKey = args[0]
-        insight = args[1]
-        
-        print("Processing insight: " + str(insight))
-        
-        region = insight['regionId']
 
-        current_parameter = ssm_functions.getParameter(parameterKey, region=region)
+        return applyInsightPlan(planInsight(readInsight(args)))
 
-        initializeInsight = False
-        itsmTicketId = ""
-        opsItemId = ""
-        opsItem = None
-        tags = {}
-        
-        if current_parameter != False: #parameter already exists
-        
-            print("Parameter[" + parameterKey + "] currently exists: " + str(current_parameter))
-
-            tags = ssm_functions.list_tags('Parameter', parameterKey, region=region)
-            hasChanged = hasInsightChanged(tags, insight)
-            
-            print(hasChanged)
-            if hasChanged['hasInsightChanged'] == False and hasChanged['hasTagsChanged'] == False:
-                print("There has been no change to the insight context.  Not doing anything.")
-                return True
-
-            if 'itsmTicketId' in tags:
-                print("ITSM ticket found: " + str(tags['itsmTicketId']))
-                itsmTicketId = tags['itsmTicketId']
-            else:
-                print("Could not find an assoicated ITSM ticket.")
-                
-            if 'opsItemId' in tags:
-                print("Ops Item found: " + str(tags['opsItemId']))
-                opsItemId = tags['opsItemId']
-            else:
-                print("Could not find an assoicated ops item.")
-
-            if hasChanged['hasInsightChanged'] == True:
-                if opsItemId != "":
-                    opsItem = ssm_functions.getOpsItem(opsItemId, region=region)
-                    if 'scheduledMaintenanceWindowDetails' in opsItem['OpsItem']['OperationalData']:
-                        windowDate = datetime.datetime.strptime(opsItem['OpsItem']['OperationalData']['scheduledMaintenanceWindowDetails'].split("\n")[1].split("=")[1], '%Y-%m-%dT%H:%M:%S')
-                        timeDelta = windowDate - datetime.utcnow()
-                        if timeDelta.total_seconds() > os.environ['CancellationThreshold']:
-                            print("Maintenance window is currently scheduled for " + str(windowDate) + " which is more than " + os.environ['CancellationThreshold'] + " seconds away.")
-                            initializeInsight = True
-                        else:
-                            print("Maintenance window is currently scheduled for " + str(windowDate) + " which is less than " + os.environ['CancellationThreshold'] + " seconds away.")
-                    else:
-                        print("Maintenance window has not yet been scheduled.  Cancelling assoicated ops item and itsm ticket.")
-                        initializeInsight = True
-                else:
-                    initializeInsight = True
-
-            if initializeInsight == False and hasChanged['hasTagsChanged'] == True:
-                print("Sychronizing tags")
-                ssm_functions.addTagsToResource('Parameter', parameterKey, dictToTagList(insight), region=region)
+    except Exception as error:
+        return insightError(args, error)
+
+#Splits the unfinished insights into continuations whose serialized form stays under the queue (and async invoke)
+#payload limit, each carrying the ops items resolved so far.
+def buildContinuations(insights, resolvedOpsItemIds):
+
+    maxPayloadBytes = 240 * 1024
+    if 'MaxPayloadBytes' in os.environ:
+        maxPayloadBytes = int(os.environ['MaxPayloadBytes'])
+
+    resolvedOpsItems = list(resolvedOpsItemIds)
+    emptySize = len(json.dumps({'insights': [], 'resolvedOpsItems': resolvedOpsItems}).encode('utf-8'))
+
+    continuations = []
+    chunk = []
+    chunkSize = emptySize
+    for insight in insights:
+        insightSize = len(json.dumps(insight).encode('utf-8')) + 2
+        if len(chunk) > 0 and chunkSize + insightSize > maxPayloadBytes:
+            continuations.append({'insights': chunk, 'resolvedOpsItems': resolvedOpsItems})
+            chunk = []
+            chunkSize = emptySize
+        chunk.append(insight)
+        chunkSize += insightSize
+
+    if len(chunk) > 0:
+        continuations.append({'insights': chunk, 'resolvedOpsItems': resolvedOpsItems})
+
+    return continuations
+
+#Queues insights behind the rest of the stack's messages in the insight queue.
+def enqueueInsights(lambdaEvent, messageGroupId):
+
+    try:
+
+        #a continuation that made no progress has the same body as the message being processed, so content based
+        #deduplication would silently drop it; every send carries its own deduplication id
+        aws_clients.call('sqs', 'send_message',
+            QueueUrl=os.environ['InsightQueueUrl'],
+            MessageBody=json.dumps(lambdaEvent),
+            MessageGroupId=messageGroupId,
+            MessageDeduplicationId=str(uuid.uuid4())
+        )
 
-        else:
-            
-            print("Parameter[" + parameterKey + "] does not exist.")
-            initializeInsight = True
-            
-        if initializeInsight == True:
-            
-            if current_parameter != False:
-                
-                if opsItemId != "":
-                    print("Closing Ops Item [" + opsItemId + "].")
-                    ssm_functions.updateOpsItems([opsItemId], 'Resolved', region=region)
-                
-                if itsmTicketId != "":
-                    print("Cancelling ITSM ticket [" + itsmTicketId + "].")
-                    
-                    lambdaEvent = {}
-                    lambdaEvent['function'] = 'cancel'
-                    lambdaEvent['work_notes'] = 'Cancelling ticket due to new recommendation from Densify.'
-                    lambdaEvent['serviceNowURL'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/url')['Parameter']['Value']
-                    lambdaEvent['serviceNowUser'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/username')['Parameter']['Value']
-                    lambdaEvent['serviceNowPass'] = ssm_functions.getParameter('/densify/config/serviceNow/connectionSettings/password')['Parameter']['Value']
-                    lambdaEvent['densifyURL'] = ssm_functions.getParameter('/densify/config/connectionSettings/url')['Parameter']['Value']
-                    lambdaEvent['densifyUser'] = ssm_functions.getParameter('/densify/config/connectionSettings/username')['Parameter']['Value']
-                    lambdaEvent['densifyPass'] = ssm_functions.getParameter('/densify/config/connectionSettings/password')['Parameter']['Value']
-                    
-                    lambda_execute("Densify-ITSM", lambdaEvent)
-
-            print("Initializing parameter [" + parameterKey + "].")
-
-            if tags != {}:
-                tagsToRemove = []
-                for tagKey in tags:
-                    tagsToRemove.append(tagKey)
-                ssm_functions.removeTagsFromResource('Parameter', parameterKey, tagsToRemove, region=region)
-            
-            print("Updating Parameter")
-            version = ssm_functions.putParameter(parameterKey, insight['currentType'], description=insight['name'], region=region)
-
-            if version != False and ssm_functions.addTagsToResource('Parameter', parameterKey, dictToTagList(insight), region=region) == True and ssm_functions.labelParameterVersion(parameterKey, version, ['Initialize'], region=region) == True:
-                print("Successfully initialized parameter.")
-            
         return True
-        
+
     except Exception as error:
-        print("Exception caught while processing " + insight['serviceType'] + " insight.\n" + str(error))
+        print("Exception encountered while enqueuing insights: " + str(error))
         return False
 
 def lambda_execute(functionName, lambdaEvent):
     
     try:
         
-        session = boto3.session.Session()
-        client = session.client('lambda')
-                    
-        response = client.invoke(
+        response = aws_clients.call('lambda', 'invoke',
             FunctionName=functionName,
             InvocationType='Event',
             Payload=json.dumps(lambdaEvent).encode('utf-8')
         )
         
         print(response)     
+
+        return True
         
     except Exception as error:
         print("Exception encountered while dispatching job: " + str(error))
@@ -0,0 +1,87 @@
+import json
+import threading
+import opsitem_index
+import ssm_functions
+
+#The ops items of a stack are related through one hub ops item instead of to each other: every item lists the
+#hub and the hub lists the stack's active items, so relating or resolving items costs a single write to the hub
+#rather than a write to every neighbour.  The hub is marked with relationHubFor instead of
+#cloudformation:stack-name so it is never listed, scheduled or resolved as one of the stack's items.
+hubKey = 'relationHubFor'
+
+def findHubs(stackName, region=None):
+
+    return sorted(opsitem_index.getListing(hubKey, stackName, region).keys())
+
+#Returns the id of the stack's active hub, creating it if there is none, or False on failure.  Invocations that
+#race to create the hub share one dedup string, so OpsCenter returns the open hub instead of a second one.
+def getHub(stackName, region=None):
+
+    try:
+
+        hubs = findHubs(stackName, region)
+        if len(hubs) > 0:
+            return hubs[0]
+
+        opsData = {}
+        opsData[hubKey] = {}
+        opsData[hubKey]['Value'] = stackName
+        opsData[hubKey]['Type'] = 'SearchableString'
+        opsData['/aws/dedup'] = {}
+        opsData['/aws/dedup']['Value'] = json.dumps({'dedupString': 'relation-hub:' + stackName})
+        opsData['/aws/dedup']['Type'] = 'SearchableString'
+
+        hubId = ssm_functions.createOpsItem('Related ops items of CloudFormation stack ' + stackName, 'Densify', 'MW Requests [' + stackName + ']', relatedOpsItems=[], opsData=opsData, category='Cost', severity='3', region=region)
+        if hubId == False:
+            raise Exception ("Failed to create the relation hub.")
+
+        print("Created relation hub [" + hubId + "] for stack [" + stackName + "].")
+        return hubId
+
+    except Exception as error:
+        print("Exception caught while finding the relation hub of stack [" + stackName + "]: " + str(error))
+        return False
+
+#Returns a function that gets the stack's hub on its first call and the same id on later ones, so that a group
+#only looks up (or creates) the hub once one of its ops items is actually created.
+def hubResolver(stackName, region=None):
+
+    lock = threading.Lock()
+    hub = []
+
+    def resolve():
+        with lock:
+            if len(hub) == 0:
+                hub.append(getHub(stackName, region))
+            return hub[0]
+
+    return resolve
+
+#Sets the hub's related ops items to the stack's active items, leaving out removed (items resolved moments ago
+#that the listing may still report).  Once no active item is left the hub is resolved.  Without hubId every
+#active hub of the stack is synced, and a stack without a hub is left alone.
+def syncHub(stackName, hubId=None, removed=(), region=None):
+
+    try:
+
+        hubs = [hubId] if hubId is not None else findHubs(stackName, region)
+        if len(hubs) == 0:
+            return True
+
+        opsItemIds = [opsItemId for opsItemId in opsitem_index.getStackOpsItemIds(stackName, region) if opsItemId not in removed]
+
+        if len(opsItemIds) == 0:
+            print("No active ops items are left for stack [" + stackName + "].  Resolving relation hub(s) " + str(hubs) + ".")
+            if ssm_functions.updateOpsItems(hubs, 'Resolved', region=region) == False:
+                raise Exception ("Failed to resolve the relation hub(s).")
+            return True
+
+        for hub in hubs:
+            if ssm_functions.setRelatedOpsItem(hub, [{'OpsItemId': opsItemId} for opsItemId in opsItemIds], region=region) == False:
+                raise Exception ("Failed to update relation hub [" + hub + "].")
+
+        return True
+
+    except Exception as error:
+        print("Exception caught while syncing the relation hub of stack [" + stackName + "]: " + str(error))
+        return False
@@ -10,6 +10,9 @@ import boto3
 import datetime
 import os
 
+#related ops items of each stack, listed once per invocation
+relatedOpsItemsByStack = {}
+
 def lambda_handler(event, context):
     # TODO implement
     
@@ -17,6 +20,8 @@ def lambda_handler(event, context):
         
         print("Incoming event: " + str(event))
 
+        relatedOpsItemsByStack.clear()
+
         if int(event['duration']) < 1 or int(event['duration']) > 24:
             raise Exception ("Duration can only be between 1-24 hours.  Specify as an integer.")
         
@@ -163,6 +168,9 @@ def getRelatedOpsItems(opsItemId):
         
         stackId = opsItem['OpsItem']['OperationalData']['cloudformation:stack-id']['Value']
         stackName = opsItem['OpsItem']['OperationalData']['cloudformation:stack-name']['Value']
+
+        if stackName in relatedOpsItemsByStack:
+            return relatedOpsItemsByStack[stackName]
         
         OpsItemFilters=[
             {
@@ -183,6 +191,8 @@ def getRelatedOpsItems(opsItemId):
         ]
         
         relatedOpsItems = getOpsItems(OpsItemFilters)
+        if relatedOpsItems is not None:
+            relatedOpsItemsByStack[stackName] = relatedOpsItems
         
         return relatedOpsItems
         
@@ -195,13 +205,16 @@ def getOpsItems(filter):
         
         client = boto3.client('ssm')
         
-        response = client.describe_ops_items(
-            OpsItemFilters=filter
-        )
+        request = {'OpsItemFilters': filter}
         
         opItemIds = []
-        for opsItem in response['OpsItemSummaries']:
-            opItemIds.append({'OpsItemId': opsItem['OpsItemId']})
+        while True:
+            response = client.describe_ops_items(**request)
+            for opsItem in response['OpsItemSummaries']:
+                opItemIds.append({'OpsItemId': opsItem['OpsItemId']})
+            if 'NextToken' not in response:
+                break
+            request['NextToken'] = response['NextToken']
         
         return opItemIds
         
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+import ssm_functions
+
+#The connection settings are SecureStrings, so every read costs a KMS decrypt.  They are cached per
+#region for the lifetime of the container.  Once the TTL expires the versions of the settings are read
+#without decryption, and the settings themselves are reloaded only if one of them has been rotated.
+settingsKeys = {
+    'serviceNowURL': '/densify/config/serviceNow/connectionSettings/url',
+    'serviceNowUser': '/densify/config/serviceNow/connectionSettings/username',
+    'serviceNowPass': '/densify/config/serviceNow/connectionSettings/password',
+    'densifyURL': '/densify/config/connectionSettings/url',
+    'densifyUser': '/densify/config/connectionSettings/username',
+    'densifyPass': '/densify/config/connectionSettings/password'
+}
+
+cache = {}
+regionLocks = {}
+regionLocksLock = threading.Lock()
+
+def getTTL():
+
+    ttl = 300
+
+    if 'SettingsCacheTTL' in os.environ:
+        ttl = int(os.environ['SettingsCacheTTL'])
+
+    return ttl
+
+def getRegionLock(region):
+
+    with regionLocksLock:
+        if region not in regionLocks:
+            regionLocks[region] = threading.Lock()
+        return regionLocks[region]
+
+def loadConnectionSettings(region):
+
+    parameters = ssm_functions.getParameters(list(settingsKeys.values()), region=region)
+
+    if parameters == False:
+        raise Exception("Unable to read connection settings in region[" + region + "].")
+
+    settings = {}
+    versions = {}
+    for name in settingsKeys:
+        if settingsKeys[name] in parameters:
+            settings[name] = parameters[settingsKeys[name]]['Value']
+            versions[settingsKeys[name]] = parameters[settingsKeys[name]]['Version']
+
+    return {'settings': settings, 'versions': versions, 'expires': time.time() + getTTL()}
+
+def getConnectionSettings(region=None):
+
+    if region is None:
+        region = os.environ['AWS_REGION']
+
+    #one loader per region, so concurrent callers wait for a single fetch instead of all fetching
+    with getRegionLock(region):
+
+        entry = cache.get(region)
+
+        if entry is not None and time.time() < entry['expires']:
+            return entry['settings']
+
+        if entry is not None and ssm_functions.getParameterVersions(list(settingsKeys.values()), region=region) == entry['versions']:
+            entry['expires'] = time.time() + getTTL()
+            return entry['settings']
+
+        print("Loading connection settings for region[" + region + "].")
+        entry = loadConnectionSettings(region)
+        cache[region] = entry
+
+        return entry['settings']
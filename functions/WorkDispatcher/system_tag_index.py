@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import time
+
+#Local index of Densify entityId -> cloudformation tag projection.  An empty projection records a system
+#that is not managed by cloudformation so that it is not looked up again.  The index is kept in memory for
+#warm invocations and persisted to /tmp, each entry carrying the time it was last refreshed from Densify.  The file
+#is only rewritten when a system was added or its tags changed; refreshes that only move an entry's timestamp
+#stay in memory until the next change is saved.
+indexVersion = 1
+index = None
+metrics = {'hits': 0, 'misses': 0, 'stale': 0}
+
+def getIndexPath():
+
+    if 'SystemTagIndexPath' in os.environ:
+        return os.environ['SystemTagIndexPath']
+
+    return '/tmp/densify_system_tags.json'
+
+def getEntryTTL():
+
+    ttl = 3600
+
+    if 'SystemTagIndexTTL' in os.environ:
+        ttl = int(os.environ['SystemTagIndexTTL'])
+
+    return ttl
+
+def load():
+
+    global index
+
+    if index is not None:
+        return index
+
+    index = {'version': indexVersion, 'updated': 0, 'systems': {}}
+
+    try:
+
+        with open(getIndexPath(), 'r') as indexFile:
+            persisted = json.load(indexFile)
+
+        if persisted['version'] == indexVersion:
+            index = persisted
+        else:
+            print("Discarding system tag index with version [" + str(persisted['version']) + "].")
+
+    except FileNotFoundError:
+        pass
+    except Exception as error:
+        print("Exception caught while loading the system tag index, starting with an empty index. " + str(error))
+
+    return index
+
+def save():
+
+    try:
+
+        #write to a temporary file first so a concurrent reader never sees a partial index
+        directory = os.path.dirname(getIndexPath())
+        fd, tmpPath = tempfile.mkstemp(dir=directory, prefix='.system_tags')
+        try:
+            with os.fdopen(fd, 'w') as indexFile:
+                json.dump(load(), indexFile, separators=(',', ':'))
+            os.replace(tmpPath, getIndexPath())
+        except Exception:
+            os.unlink(tmpPath)
+            raise
+
+        return True
+
+    except Exception as error:
+        print("Exception caught while saving the system tag index. " + str(error))
+        return False
+
+def lookup(entityIds):
+
+    systems = load()['systems']
+    expiry = time.time() - getEntryTTL()
+
+    found = {}
+    for entityId in entityIds:
+        if entityId not in systems:
+            metrics['misses'] += 1
+        elif systems[entityId]['updated'] < expiry:
+            metrics['stale'] += 1
+        else:
+            metrics['hits'] += 1
+            found[entityId] = systems[entityId]['tags']
+
+    return found
+
+def update(tags):
+
+    current = load()
+    now = int(time.time())
+    changed = False
+
+    for entityId in tags:
+        if entityId not in current['systems'] or current['systems'][entityId]['tags'] != tags[entityId]:
+            changed = True
+        current['systems'][entityId] = {'tags': tags[entityId], 'updated': now}
+
+    if not changed:
+        return True
+
+    current['updated'] = now
+
+    return save()
+
+def reportMetrics():
+
+    print("System tag index: hits[" + str(metrics['hits']) + "] misses[" + str(metrics['misses']) + "] stale[" + str(metrics['stale']) + "] size[" + str(len(load()['systems'])) + "].")
+
+    for name in metrics:
+        metrics[name] = 0
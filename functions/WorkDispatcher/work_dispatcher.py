@@ -1,9 +1,25 @@
 import json
-import boto3
+import codecs
+import aws_clients
 import base64
+import hmac
+import hashlib
 import ssm_functions
+import connection_settings
+import system_tag_index
 import requests
 import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+cloudFormationTagKeys = frozenset(['aws:cloudformation:stack-id', 'aws:cloudformation:logical-id', 'aws:cloudformation:stack-name'])
+
+#One pooled session per Densify URL, kept for the lifetime of the container so that warm invocations reuse the
+#open keep-alive connections instead of doing a new TCP and TLS handshake for every webhook.
+sessions = {}
+sessionsLock = threading.Lock()
 
 def lambda_handler(event, context):
     # TODO implement
@@ -14,8 +30,8 @@ def lambda_handler(event, context):
     
     final_list = generateListOfInsights(input, event['headers'])
     print(final_list)
-    for stack_id in final_list:
-        dispatchJob(final_list[stack_id])
+    if final_list != False:
+        print("Dispatch summary: " + str(dispatchJobs(final_list)))
     
     return {
         'statusCode': 200,
@@ -26,10 +42,17 @@ def getResourceTags(attributes, tags_to_extract):
 
     try:
         
+        if not isinstance(tags_to_extract, frozenset):
+            tags_to_extract = frozenset(tags_to_extract)
+
+        #split each resource tag once; the remaining attributes are skipped on their id alone
         tags = {}
         for attribute in attributes:
-            if attribute['id'] == "attr_resource_tags" and attribute['value'].split(" : ")[0] in tags_to_extract:
-                tags[attribute['value'].split(" : ")[0]] = attribute['value'].split(" : ")[1]
+            if attribute['id'] != "attr_resource_tags":
+                continue
+            tag = attribute['value'].split(" : ", 2)
+            if tag[0] in tags_to_extract:
+                tags[tag[0]] = tag[1]
                 
         return tags
     
@@ -37,35 +60,167 @@ def getResourceTags(attributes, tags_to_extract):
         print("Exception caught while getting resource tags. " + str(error))
         return False
 
+def iterJsonArray(chunks):
+
+    #Incrementally decodes a top level JSON array, yielding one element at a time so that only the
+    #element currently being decoded (plus one chunk) is ever held in memory.
+    decoder = json.JSONDecoder()
+    textDecoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ""
+    started = False
+    exhausted = False
+
+    while True:
+
+        buffer = buffer.lstrip(" \t\r\n,")
+
+        if not started and buffer != "":
+            if buffer[0] != '[':
+                raise ValueError("Response is not a JSON array.")
+            buffer = buffer[1:]
+            started = True
+            continue
+
+        if started and buffer.startswith(']'):
+            return
+
+        if started and buffer != "":
+            end = -1
+            try:
+                element, end = decoder.raw_decode(buffer)
+            except ValueError:
+                pass
+            #an element is only complete once its delimiter has arrived (e.g. a number split across chunks)
+            if end != -1 and buffer[end:].lstrip(" \t\r\n")[:1] in (",", "]"):
+                yield element
+                buffer = buffer[end:]
+                continue
+
+        if exhausted:
+            raise ValueError("Unexpected end of JSON array.")
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += textDecoder.decode(b"", final=True)
+        else:
+            buffer += textDecoder.decode(chunk)
+
+def getSession(url):
+
+    session = sessions.get(url)
+
+    if session is None:
+        with sessionsLock:
+            session = sessions.get(url)
+            if session is None:
+                poolSize = int(os.environ['LookupPoolSize']) if 'LookupPoolSize' in os.environ else 10
+                session = requests.Session()
+                session.mount(url, HTTPAdapter(pool_connections=1, pool_maxsize=poolSize))
+                sessions[url] = session
+
+    return session
+
+def getCloudFormationTags(url, username, password):
+
+    headers = {"Content-Type":"application/json","Accept":"application/json"}
+    response = getSession(url).get(url + "/CIRBA/api/v2/systems/?platform=aws", auth=(username, password), headers=headers, stream=True)
+
+    try:
+
+        response.raise_for_status()
+
+        #stream the systems one at a time and only keep the cloudformation tag projection
+        tags = {}
+        for system in iterJsonArray(response.iter_content(chunk_size=65536)):
+            new_tag_list = getCloudFormationTagProjection(system['attributes'])
+            if new_tag_list != {}:
+                tags[system['id']] = new_tag_list
+
+        return tags
+
+    finally:
+        response.close()
+
+def getCloudFormationTagProjection(attributes):
+
+    resource_tags = getResourceTags(attributes, cloudFormationTagKeys)
+
+    new_tag_list = {}
+    for tag in resource_tags:
+        new_tag_list[tag[4:]] = resource_tags[tag]
+
+    return new_tag_list
+
+def lookupCloudFormationTags(url, username, password, entityIds):
+
+    threshold = 100
+    if 'TargetedLookupThreshold' in os.environ:
+        threshold = int(os.environ['TargetedLookupThreshold'])
+
+    if len(entityIds) > threshold:
+        print("Webhook references " + str(len(entityIds)) + " systems, which is more than " + str(threshold) + ".  Scanning all systems.")
+        return getCloudFormationTags(url, username, password)
+
+    try:
+
+        poolSize = 10
+        if 'LookupPoolSize' in os.environ:
+            poolSize = int(os.environ['LookupPoolSize'])
+
+        headers = {"Content-Type":"application/json","Accept":"application/json"}
+        session = getSession(url)
+
+        def getSystemTags(entityId):
+            response = session.get(url + "/CIRBA/api/v2/systems/" + entityId, auth=(username, password), headers=headers)
+            if response.status_code == 404:
+                print("System [" + entityId + "] was not found in Densify.")
+                return {}
+            response.raise_for_status()
+            return getCloudFormationTagProjection(response.json()['attributes'])
+
+        #only fetch the systems named in the webhook, concurrently on a bounded pool
+        tags = {}
+        with ThreadPoolExecutor(max_workers=poolSize) as executor:
+            for entityId, new_tag_list in zip(entityIds, executor.map(getSystemTags, entityIds)):
+                if new_tag_list != {}:
+                    tags[entityId] = new_tag_list
+
+        return tags
+
+    except Exception as error:
+        print("Exception caught during targeted system lookup, scanning all systems instead. " + str(error))
+        return getCloudFormationTags(url, username, password)
+
 def generateListOfInsights(insights, header):
 
     try:
     
         #get densify url and creds
         region = os.environ['AWS_REGION']
-        url = ssm_functions.getParameter("/densify/config/connectionSettings/url", region)['Parameter']['Value']
-        username = ssm_functions.getParameter("/densify/config/connectionSettings/username", region)['Parameter']['Value']
-        password = ssm_functions.getParameter("/densify/config/connectionSettings/password", region)['Parameter']['Value']
+        settings = connection_settings.getConnectionSettings(region)
+        url = settings['densifyURL']
+        username = settings['densifyUser']
+        password = settings['densifyPass']
 
-        #get full list of attributes for all AWS systems
-        headers = {"Content-Type":"application/json","Accept":"application/json"}
-        response = requests.get(url + "/CIRBA/api/v2/systems/?platform=aws", auth=(username, password), headers=headers)
-        response.raise_for_status()
-        systems = response.json()
-        
-        tags = {}
-        for system in systems:
-            resource_tags = getResourceTags(system['attributes'], ['aws:cloudformation:stack-id', 'aws:cloudformation:logical-id', 'aws:cloudformation:stack-name'])
-            if resource_tags != {}:
-                new_tag_list = {}
-                for tag in resource_tags:
-                    new_tag_list[tag[4:]] = resource_tags[tag]
-                tags[system['id']] = new_tag_list
+        #get cloudformation tags for the systems referenced by the insights, from the local index where possible
+        entityIds = list(dict.fromkeys([insight['entityId'] for insight in insights]))
+        tags = system_tag_index.lookup(entityIds)
+        missing = [entityId for entityId in entityIds if entityId not in tags]
+        if len(missing) > 0:
+            fetched = lookupCloudFormationTags(url, username, password, missing)
+            refreshed = {}
+            for entityId in missing:
+                refreshed[entityId] = {}
+            refreshed.update(fetched)
+            system_tag_index.update(refreshed)
+            tags.update(refreshed)
+        system_tag_index.reportMetrics()
         
         #Generate list of insights managed by CF
         insightsManagedByCF = []
         for insight in insights:
-            if insight['entityId'] in tags:
+            if insight['entityId'] in tags and tags[insight['entityId']] != {}:
                 for tag in tags[insight['entityId']]:
                     insight[tag] = tags[insight['entityId']][tag]
                 if 'attributes' in insight:
@@ -81,13 +236,16 @@ def generateListOfInsights(insights, header):
         else:
             authorization = header['Authorization']
             
-        for insight in insightsManagedByCF:
-            if insight['regionId'] not in UnauthorizedRegions:
-                if insight['regionId'] not in authorizedRegions:
-                    if authorizeRequest(authorization, insight['regionId']) == True:
-                        authorizedRegions.append(insight['regionId'])
+        #decode the credentials once and check every region concurrently
+        credentials = decodeAuthorization(authorization)
+        regions = list(dict.fromkeys([insight['regionId'] for insight in insightsManagedByCF]))
+        if len(regions) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(regions), 16)) as executor:
+                for region, authorized in zip(regions, executor.map(authorizeRequest, [credentials] * len(regions), regions)):
+                    if authorized == True:
+                        authorizedRegions.append(region)
                     else:
-                        UnauthorizedRegions.append(insight['regionId'])
+                        UnauthorizedRegions.append(region)
 
         print("Authorized Regions: " + str(authorizedRegions))
         print("Unauthorized Regions: " + str(UnauthorizedRegions))
@@ -109,26 +267,83 @@ def generateListOfInsights(insights, header):
         print("Exception caught while generating new list of insights. " + str(error))
         return False
 
-def dispatchJob(insights):
+def chunkInsights(insights, maxPayloadBytes):
+
+    #split a stack's insights so that every serialized chunk stays under the queue message size limit
+    chunks = []
+    chunk = []
+    chunkSize = 2
+    for insight in insights:
+        insightSize = len(json.dumps(insight).encode('utf-8')) + 2
+        if len(chunk) > 0 and chunkSize + insightSize > maxPayloadBytes:
+            chunks.append(chunk)
+            chunk = []
+            chunkSize = 2
+        chunk.append(insight)
+        chunkSize += insightSize
+
+    if len(chunk) > 0:
+        chunks.append(chunk)
+
+    return chunks
+
+def dispatchJobs(final_list):
+
+    maxPayloadBytes = 240 * 1024
+    if 'MaxPayloadBytes' in os.environ:
+        maxPayloadBytes = int(os.environ['MaxPayloadBytes'])
+
+    poolSize = 10
+    if 'DispatchPoolSize' in os.environ:
+        poolSize = int(os.environ['DispatchPoolSize'])
+
+    jobs = []
+    for stack_id in final_list:
+        for chunk in chunkInsights(final_list[stack_id], maxPayloadBytes):
+            jobs.append([stack_id, chunk])
+
+    summary = {'stacks': len(final_list), 'invocations': len(jobs), 'dispatched': 0, 'insights': 0, 'failed': []}
+    if len(jobs) == 0:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=min(len(jobs), poolSize)) as executor:
+        for job, result in zip(jobs, executor.map(dispatchJob, [job[0] for job in jobs], [job[1] for job in jobs])):
+            if result == True:
+                summary['dispatched'] += 1
+                summary['insights'] += len(job[1])
+            else:
+                summary['failed'].append({'stackId': job[0], 'insights': len(job[1])})
+
+    return summary
+
+#Chunks of a stack are queued in one message group of the FIFO insight queue, which hands them to
+#ProcessNewRecommendations one at a time, so a stack split across chunks is never processed concurrently.
+def getMessageGroupId(stackId):
+
+    return hashlib.sha256(stackId.encode('utf-8')).hexdigest()
+
+def dispatchJob(stackId, insights):
     
     try:
         
-        lambdaEvent = insights
-        
-        client = boto3.client('lambda')
-        response = client.invoke(
-            FunctionName="ProcessNewRecommendations",
-            InvocationType='Event',
-            Payload=json.dumps(lambdaEvent).encode('utf-8')
+        #throttled sends are retried with backoff by the client wrapper; the queue does not deduplicate on content,
+        #so every send carries its own deduplication id
+        response = aws_clients.call('sqs', 'send_message',
+            QueueUrl=os.environ['InsightQueueUrl'],
+            MessageBody=json.dumps(insights),
+            MessageGroupId=getMessageGroupId(stackId),
+            MessageDeduplicationId=str(uuid.uuid4())
         )
         
         print(response)     
+
+        return True
         
     except Exception as error:
         print("Exception encountered while dispatching job: " + str(error))
         return False
 
-def authorizeRequest(authorization, region):
+def decodeAuthorization(authorization):
     
     try:
         
@@ -138,10 +353,24 @@ def authorizeRequest(authorization, region):
             raise Exception ("Only basic authorization is supported at this time.")
         
         encoded_string = authorization.split(" ")[1]
-        username = base64.b64decode(encoded_string).decode("utf-8").split(":")[0]
-        password = base64.b64decode(encoded_string).decode("utf-8").split(":")[1]
+        credentials = base64.b64decode(encoded_string).decode("utf-8").split(":", 1)
+
+        return {'username': credentials[0], 'password': credentials[1]}
+        
+    except Exception as error:
+        print("Exception caught while decoding authorization header.\n" + str(error))
+        return False
+
+def authorizeRequest(credentials, region):
+    
+    try:
+        
+        if credentials == False:
+            raise Exception ("Authorization header could not be decoded.")
 
-        if username != ssm_functions.getParameter('/densify/config/connectionSettings/username', region)['Parameter']['Value'] or password != ssm_functions.getParameter('/densify/config/connectionSettings/password', region)['Parameter']['Value']:
+        #stored credentials are memoized per region by connection_settings for the life of the container
+        settings = connection_settings.getConnectionSettings(region)
+        if not hmac.compare_digest(credentials['username'].encode('utf-8'), settings['densifyUser'].encode('utf-8')) or not hmac.compare_digest(credentials['password'].encode('utf-8'), settings['densifyPass'].encode('utf-8')):
             raise Exception ("Unauthorized.")
         
         return True
@@ -0,0 +1,344 @@
+import collections
+import copy
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import botocore.exceptions
+
+#In-memory stand-in for the SSM, Lambda and CloudFormation APIs the functions call through aws_clients.  It is
+#plugged in by replacing aws_clients.getClient, so the real call() path (rate limiting, retries, error mapping)
+#is exercised.  latency is slept on every call to model the round trip of the real service.
+functionsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+def clientError(operation, code, message, status=400):
+
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+class AWSStub:
+
+    def __init__(self, latency=0.0, pageSize=50):
+        self.latency = latency
+        self.pageSize = pageSize
+        self.parameters = {}
+        self.tags = {}
+        self.opsItems = {}
+        self.windows = {}
+        self.stacks = {}
+        self.invocations = []
+        self.messages = []
+        self.deduplicationIds = set()
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.nextOpsItem = 0
+
+    def client(self, service):
+
+        return StubClient(self, service)
+
+    def invoke(self, service, operation, params):
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[service + ":" + operation] += 1
+            return getattr(self, service + "_" + operation)(**params)
+
+    def callCount(self, prefix=''):
+
+        return sum(count for name, count in self.calls.items() if name.startswith(prefix))
+
+    #Seeding ####################################################
+
+    def putParameter(self, name, value, tags=None, labels=None):
+
+        with self.lock:
+            self.ssm_put_parameter(Name=name, Value=value)
+            if labels is not None:
+                self.parameters[name]['History'][-1]['Labels'] = list(labels)
+            if tags is not None:
+                self.tags.setdefault(('Parameter', name), {}).update(tags)
+
+    def putWindow(self, name, schedule='at(2030-01-01T00:00:00)', duration=2):
+
+        with self.lock:
+            windowId = 'mw-' + str(len(self.windows)).zfill(17)
+            self.windows[windowId] = {'WindowId': windowId, 'Name': name, 'Enabled': True, 'Schedule': schedule, 'Duration': duration}
+            return windowId
+
+    #SSM parameters #############################################
+
+    def ssm_get_parameter(self, Name, WithDecryption=False):
+
+        if Name not in self.parameters:
+            raise clientError('GetParameter', 'ParameterNotFound', 'Parameter ' + Name + ' not found.')
+
+        return {'Parameter': self.describeParameter(Name)}
+
+    def ssm_get_parameters(self, Names, WithDecryption=False):
+
+        return {
+            'Parameters': [self.describeParameter(name) for name in Names if name in self.parameters],
+            'InvalidParameters': [name for name in Names if name not in self.parameters]
+        }
+
+    def ssm_get_parameters_by_path(self, Path, Recursive=True, WithDecryption=False, NextToken=None, MaxResults=10):
+
+        names = sorted(name for name in self.parameters if name.startswith(Path.rstrip('/') + '/'))
+        return self.page('Parameters', [self.describeParameter(name) for name in names], NextToken, MaxResults)
+
+    def ssm_describe_parameters(self, ParameterFilters=None, NextToken=None, MaxResults=50):
+
+        names = sorted(self.parameters)
+        for parameterFilter in ParameterFilters or []:
+            if parameterFilter['Key'] == 'Path':
+                names = [name for name in names if name.startswith(parameterFilter['Values'][0].rstrip('/') + '/')]
+            elif parameterFilter['Key'].startswith('tag:'):
+                key = parameterFilter['Key'][4:]
+                names = [name for name in names if self.tags.get(('Parameter', name), {}).get(key) in parameterFilter['Values']]
+        return self.page('Parameters', [{'Name': name, 'Version': self.parameters[name]['Version']} for name in names], NextToken, MaxResults)
+
+    def ssm_get_parameter_history(self, Name, WithDecryption=False, NextToken=None, MaxResults=50):
+
+        if Name not in self.parameters:
+            raise clientError('GetParameterHistory', 'ParameterNotFound', 'Parameter ' + Name + ' not found.')
+
+        return self.page('Parameters', copy.deepcopy(self.parameters[Name]['History']), NextToken, MaxResults)
+
+    def ssm_put_parameter(self, Name, Value, Description='', Type='String', Overwrite=True, Tier='Standard'):
+
+        parameter = self.parameters.setdefault(Name, {'Name': Name, 'Version': 0, 'History': []})
+        parameter['Version'] += 1
+        parameter['Value'] = Value
+        parameter['History'].append({'Name': Name, 'Version': parameter['Version'], 'Value': Value, 'Labels': []})
+        return {'Version': parameter['Version'], 'Tier': Tier}
+
+    def ssm_label_parameter_version(self, Name, ParameterVersion, Labels):
+
+        for version in self.parameters[Name]['History']:
+            version['Labels'] = [label for label in version['Labels'] if label not in Labels]
+            if version['Version'] == ParameterVersion:
+                version['Labels'].extend(Labels)
+        return {'InvalidLabels': [], 'ParameterVersion': ParameterVersion}
+
+    def ssm_list_tags_for_resource(self, ResourceType, ResourceId):
+
+        return {'TagList': [{'Key': key, 'Value': value} for key, value in self.tags.get((ResourceType, ResourceId), {}).items()]}
+
+    def ssm_add_tags_to_resource(self, ResourceType, ResourceId, Tags):
+
+        resourceTags = self.tags.setdefault((ResourceType, ResourceId), {})
+        for tag in Tags:
+            resourceTags[tag['Key']] = tag['Value']
+        return {}
+
+    def ssm_remove_tags_from_resource(self, ResourceType, ResourceId, TagKeys):
+
+        resourceTags = self.tags.get((ResourceType, ResourceId), {})
+        for key in TagKeys:
+            resourceTags.pop(key, None)
+        return {}
+
+    def describeParameter(self, name):
+
+        parameter = self.parameters[name]
+        return {'Name': name, 'Type': 'String', 'Value': parameter['Value'], 'Version': parameter['Version'], 'ARN': 'arn:aws:ssm:us-east-1:123456789012:parameter' + name}
+
+    #SSM ops items ##############################################
+
+    #An item whose /aws/dedup string matches an open item is not created, the open item's id is returned instead.
+    def ssm_create_ops_item(self, Description, Source, Title, OperationalData=None, RelatedOpsItems=None, Category=None, Severity=None):
+
+        if OperationalData and '/aws/dedup' in OperationalData:
+            for opsItem in self.opsItems.values():
+                if opsItem['Status'] != 'Resolved' and opsItem['OperationalData'].get('/aws/dedup', {}).get('Value') == OperationalData['/aws/dedup']['Value']:
+                    return {'OpsItemId': opsItem['OpsItemId']}
+
+        self.nextOpsItem += 1
+        opsItemId = 'oi-' + str(self.nextOpsItem).zfill(12)
+        self.opsItems[opsItemId] = {
+            'OpsItemId': opsItemId,
+            'Title': Title,
+            'Source': Source,
+            'Description': Description,
+            'Status': 'Open',
+            'Category': Category,
+            'Severity': Severity,
+            'OperationalData': copy.deepcopy(OperationalData or {}),
+            'RelatedOpsItems': [{'OpsItemId': related['OpsItemId']} for related in RelatedOpsItems or []]
+        }
+        return {'OpsItemId': opsItemId}
+
+    def ssm_get_ops_item(self, OpsItemId):
+
+        if OpsItemId not in self.opsItems:
+            raise clientError('GetOpsItem', 'OpsItemNotFoundException', 'Ops item ' + OpsItemId + ' not found.')
+
+        return {'OpsItem': copy.deepcopy(self.opsItems[OpsItemId])}
+
+    def ssm_update_ops_item(self, OpsItemId, Status=None, OperationalData=None, RelatedOpsItems=None, Title=None):
+
+        if OpsItemId not in self.opsItems:
+            raise clientError('UpdateOpsItem', 'OpsItemNotFoundException', 'Ops item ' + OpsItemId + ' not found.')
+
+        opsItem = self.opsItems[OpsItemId]
+        if Status is not None:
+            opsItem['Status'] = Status
+        if OperationalData:
+            opsItem['OperationalData'].update(copy.deepcopy(OperationalData))
+        if RelatedOpsItems is not None:
+            opsItem['RelatedOpsItems'] = [{'OpsItemId': related['OpsItemId']} for related in RelatedOpsItems]
+        if Title is not None:
+            opsItem['Title'] = Title
+        return {}
+
+    def ssm_describe_ops_items(self, OpsItemFilters, NextToken=None, MaxResults=None):
+
+        summaries = []
+        for opsItem in self.opsItems.values():
+            if all(self.matchesFilter(opsItem, opsItemFilter) for opsItemFilter in OpsItemFilters):
+                summary = copy.deepcopy(opsItem)
+                del summary['RelatedOpsItems']
+                summaries.append(summary)
+        return self.page('OpsItemSummaries', summaries, NextToken, MaxResults or self.pageSize)
+
+    def matchesFilter(self, opsItem, opsItemFilter):
+
+        if opsItemFilter['Key'] == 'Status':
+            return opsItem['Status'] in opsItemFilter['Values']
+
+        if opsItemFilter['Key'] == 'OperationalData':
+            for value in opsItemFilter['Values']:
+                data = json.loads(value)
+                if data['key'] in opsItem['OperationalData'] and opsItem['OperationalData'][data['key']]['Value'] == data['value']:
+                    return True
+            return False
+
+        if opsItemFilter['Key'] == 'OpsItemId':
+            return opsItem['OpsItemId'] in opsItemFilter['Values']
+
+        return True
+
+    #SSM maintenance windows ####################################
+
+    def ssm_describe_maintenance_windows(self, Filters=None):
+
+        windows = list(self.windows.values())
+        for windowFilter in Filters or []:
+            if windowFilter['Key'] == 'Name':
+                windows = [window for window in windows if window['Name'] in windowFilter['Values']]
+            elif windowFilter['Key'] == 'Enabled':
+                windows = [window for window in windows if str(window['Enabled']) in windowFilter['Values']]
+        return {'WindowIdentities': copy.deepcopy(windows)}
+
+    def ssm_delete_maintenance_window(self, WindowId):
+
+        self.windows.pop(WindowId, None)
+        return {'WindowId': WindowId}
+
+    #Lambda #####################################################
+
+    def lambda_invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b'{}'):
+
+        self.invocations.append({'FunctionName': FunctionName, 'InvocationType': InvocationType, 'Payload': json.loads(Payload)})
+        if InvocationType == 'Event':
+            return {'StatusCode': 202, 'Payload': io.BytesIO(b'')}
+        return {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps({'statusCode': 200, 'body': 'ok'}).encode('utf-8'))}
+
+    #SQS ########################################################
+
+    #The insight queue is FIFO without content based deduplication: a send without a deduplication id is rejected
+    #and one repeating an earlier id is accepted but dropped, as SQS does within its deduplication interval.
+    def sqs_send_message(self, QueueUrl, MessageBody, MessageGroupId=None, MessageDeduplicationId=None):
+
+        if MessageGroupId is not None and MessageDeduplicationId is None:
+            raise clientError('SendMessage', 'InvalidParameterValue', 'The queue should either have ContentBasedDeduplication enabled or MessageDeduplicationId provided explicitly')
+
+        if MessageDeduplicationId is None or MessageDeduplicationId not in self.deduplicationIds:
+            self.messages.append({'QueueUrl': QueueUrl, 'Body': json.loads(MessageBody), 'MessageGroupId': MessageGroupId, 'MessageDeduplicationId': MessageDeduplicationId})
+        self.deduplicationIds.add(MessageDeduplicationId)
+        return {'MessageId': str(len(self.messages))}
+
+    #CloudFormation #############################################
+
+    def cloudformation_describe_stacks(self, StackName=None, NextToken=None):
+
+        if StackName is not None:
+            if StackName not in self.stacks:
+                raise clientError('DescribeStacks', 'ValidationError', 'Stack with id ' + StackName + ' does not exist')
+            return {'Stacks': [copy.deepcopy(self.stacks[StackName])]}
+
+        return self.page('Stacks', copy.deepcopy(list(self.stacks.values())), NextToken, 100)
+
+    def page(self, key, items, nextToken, pageSize):
+
+        start = int(nextToken) if nextToken else 0
+        response = {key: items[start:start + pageSize]}
+        if start + pageSize < len(items):
+            response['NextToken'] = str(start + pageSize)
+        return response
+
+class StubClient:
+
+    def __init__(self, stub, service):
+        self.stub = stub
+        self.service = service
+
+    def __getattr__(self, operation):
+
+        def method(**params):
+            return self.stub.invoke(self.service, operation, params)
+
+        return method
+
+#Seeds the EC2 insight parameter of resourceId with the tags the functions read from it.
+def seedInsight(stub, stackName, resourceId, **tags):
+
+    insightTags = {
+        'cloudformation:stack-name': stackName,
+        'cloudformation:stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/' + stackName + '/1',
+        'cloudformation:logical-id': resourceId,
+        'serviceType': 'EC2',
+        'resourceId': resourceId,
+        'name': resourceId,
+        'regionId': 'us-east-1',
+        'accountIdRef': '123456789012',
+        'entityId': resourceId,
+        'rptHref': '/systems/' + resourceId + '/analysis-report',
+        'savingsEstimate': '10.0',
+        'recommendedType': 'm5.large'
+    }
+    insightTags.update(tags)
+    parameterKey = '/densify/iaas/ec2/' + resourceId + '/instanceType'
+    stub.putParameter(parameterKey, 'm5.large', tags=insightTags)
+
+    return parameterKey
+
+#Imports a module of one function directory with its own copies of the shared modules, wired to stub.  Modules
+#of the other function directories are dropped from sys.modules first, since the copies share their names.
+def loadFunction(directory, stub, module='lambda_function'):
+
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('ApiRateLimits', json.dumps({'ssm:read': 100000, 'ssm:write': 100000, 'ssm:tags': 100000, 'ssm:opsitems': 100000, 'ssm:default': 100000, 'lambda:default': 100000, 'cloudformation:default': 100000}))
+
+    functionsPath = os.path.realpath(functionsDir)
+    for name, loaded in list(sys.modules.items()):
+        if os.path.realpath(getattr(loaded, '__file__', None) or '').startswith(functionsPath + os.sep):
+            del sys.modules[name]
+
+    path = os.path.join(functionsPath, directory)
+    sys.path.insert(0, path)
+    try:
+        loaded = importlib.import_module(module)
+        aws_clients = importlib.import_module('aws_clients')
+    finally:
+        sys.path.remove(path)
+
+    aws_clients.getClient = lambda service, region=None: stub.client(service)
+
+    return loaded
@@ -0,0 +1,60 @@
+import argparse
+import importlib.util
+import os
+import sys
+import time
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+
+#Cost of obtaining an SSM client per helper call: a fresh boto3 session and client (how every ssm_functions
+#helper used to start) against the per-region cache in aws_clients.getClient.  Clients are only constructed,
+#no request is sent, so no credentials or network are needed.
+#
+#    python tests/benchmarks/bench_clients.py --calls 200 --threads 10
+functionsDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'functions')
+
+def loadAwsClients():
+
+    spec = importlib.util.spec_from_file_location('aws_clients', os.path.join(functionsDir, 'ProcessNewRecommendations', 'aws_clients.py'))
+    aws_clients = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(aws_clients)
+
+    return aws_clients
+
+def freshClient(index):
+
+    return boto3.session.Session().client('ssm', 'us-east-1')
+
+def measure(function, calls, threads):
+
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(function, range(calls)))
+    else:
+        for index in range(calls):
+            function(index)
+
+    return time.perf_counter() - start
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=10)
+    arguments = parser.parse_args()
+
+    os.environ.setdefault('AWS_REGION', 'us-east-1')
+    aws_clients = loadAwsClients()
+    cachedClient = lambda index: aws_clients.getClient('ssm', 'us-east-1')
+
+    for threads in sorted(set([1, arguments.threads])):
+        fresh = measure(freshClient, arguments.calls, threads)
+        first = measure(cachedClient, 1, 1) if threads == 1 else 0.0
+        cached = measure(cachedClient, arguments.calls, threads)
+        print("%2d thread(s)  fresh session+client: %8.3f ms/call   cached getClient: %8.4f ms/call" % (threads, 1000 * fresh / arguments.calls, 1000 * cached / arguments.calls))
+        if threads == 1:
+            print("              first getClient (cache fill): %8.3f ms" % (1000 * first))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import aws_stub
+
+#Throughput of the ProcessNewRecommendations engines (ProcessingMode) against the in-memory SSM stub.  A third of
+#the insights are new, a third change their recommendation and a third are unchanged.
+#
+#    python tests/benchmarks/bench_engines.py --sizes 1000,5000,20000 --latency 0.002
+stackName = 'bench-stack'
+
+class Context:
+
+    function_name = 'ProcessNewRecommendations'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+def makeInsight(index):
+
+    return {
+        'serviceType': 'EC2',
+        'resourceId': 'i-' + str(index).zfill(8),
+        'name': 'server-' + str(index),
+        'entityId': 'e-' + str(index),
+        'regionId': 'us-east-1',
+        'currentType': 'm5.xlarge',
+        'recommendedType': 'm5.large',
+        'savingsEstimate': '12.5',
+        'cloudformation:stack-name': stackName,
+        'cloudformation:stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/' + stackName + '/1',
+        'cloudformation:logical-id': 'Server' + str(index)
+    }
+
+def seed(stub, lambda_function, insights):
+
+    for index, insight in enumerate(insights):
+        parameterKey = '/densify/iaas/ec2/' + insight['resourceId'] + '/instanceType'
+        if index % 3 == 1:
+            previous = dict(insight)
+            previous['recommendedType'] = 'm5.2xlarge'
+            stub.putParameter(parameterKey, 'm5.xlarge', tags=lambda_function.insightToTags(previous), labels=['Initialize'])
+        elif index % 3 == 2:
+            stub.putParameter(parameterKey, 'm5.xlarge', tags=lambda_function.insightToTags(insight), labels=['Initialize'])
+
+def run(mode, size, latency):
+
+    os.environ['ProcessingMode'] = mode
+    stub = aws_stub.AWSStub()
+    lambda_function = aws_stub.loadFunction('ProcessNewRecommendations', stub)
+    insights = [makeInsight(index) for index in range(size)]
+    seed(stub, lambda_function, insights)
+    stub.latency = latency
+
+    start = time.perf_counter()
+    lambda_function.lambda_handler(insights, Context())
+    elapsed = time.perf_counter() - start
+
+    return {'mode': mode, 'size': size, 'calls': stub.callCount('ssm:'), 'seconds': elapsed}
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000,20000')
+    parser.add_argument('--modes', default='threads,pipeline')
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--threads', default='10')
+    arguments = parser.parse_args()
+
+    os.environ['ThreadPoolSize'] = arguments.threads
+    os.environ['CancellationThreshold'] = '300'
+
+    results = []
+    for size in [int(size) for size in arguments.sizes.split(',')]:
+        for mode in arguments.modes.split(','):
+            #the function prints every insight, which would dominate the timings
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                results.append(run(mode, size, arguments.latency))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print("%-9s %6d insights %7d ssm calls %8.2f s %8.1f insights/s" % (results[-1]['mode'], size, results[-1]['calls'], results[-1]['seconds'], size / results[-1]['seconds']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import aws_stub
+
+#Approval throughput of CollaborationOrchestrator against the in-memory OpsCenter stub, relating the stack's ops
+#items through a hub (the current strategy) or as a full mesh (the previous one, where every new item was
+#written into the related list of each of its neighbours).  Approvals arrive one event at a time or in queue
+#batches of 10.
+#
+#    python tests/benchmarks/bench_relations.py --resources 300 --latency 0.002
+stackName = 'bench-stack'
+
+def meshStrategy(lambda_function):
+
+    ssm_functions = lambda_function.ssm_functions
+    opsitem_index = lambda_function.opsitem_index
+
+    def syncHub(stackName, hubId=None, removed=(), region=None):
+        opsItemIds = opsitem_index.getStackOpsItemIds(stackName)
+        relatedOpsItems = [{'OpsItemId': opsItemId} for opsItemId in opsItemIds]
+        def relate(opsItemId):
+            return ssm_functions.setRelatedOpsItem(opsItemId, [relatedOpsItem for relatedOpsItem in relatedOpsItems if relatedOpsItem['OpsItemId'] != opsItemId])
+        if len(opsItemIds) > 1:
+            with ThreadPoolExecutor(max_workers=min(10, len(opsItemIds))) as executor:
+                list(executor.map(relate, opsItemIds))
+        return True
+
+    lambda_function.relation_hub.getHub = lambda stackName, region=None: 'mesh'
+    lambda_function.relation_hub.syncHub = syncHub
+
+def run(strategy, mode, resources, latency):
+
+    stub = aws_stub.AWSStub(latency=latency)
+    parameterKeys = [aws_stub.seedInsight(stub, stackName, 'i-' + str(index).zfill(5)) for index in range(resources)]
+    lambda_function = aws_stub.loadFunction('CollaborationOrchestrator', stub)
+    lambda_function.connection_settings.getConnectionSettings = lambda: {'densifyURL': 'https://densify.example.com'}
+    if strategy == 'mesh':
+        meshStrategy(lambda_function)
+
+    events = [{'detail': {'name': parameterKey, 'label': 'Approved'}} for parameterKey in parameterKeys]
+
+    start = time.perf_counter()
+    if mode == 'single':
+        for event in events:
+            lambda_function.lambda_handler(event, None)
+    else:
+        for index in range(0, len(events), 10):
+            records = [{'messageId': str(index + offset), 'body': json.dumps(event)} for offset, event in enumerate(events[index:index + 10])]
+            lambda_function.lambda_handler({'Records': records}, None)
+    elapsed = time.perf_counter() - start
+
+    created = len([opsItem for opsItem in stub.opsItems.values() if 'parameterKey' in opsItem['OperationalData']])
+    return {'strategy': strategy, 'mode': mode, 'created': created, 'relationWrites': stub.calls['ssm:update_ops_item'], 'calls': stub.callCount('ssm:'), 'seconds': elapsed}
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resources', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--strategies', default='hub,mesh')
+    arguments = parser.parse_args()
+
+    results = []
+    for strategy in arguments.strategies.split(','):
+        for mode in ('single', 'batch'):
+            #the functions print every step, which would dominate the timings
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                results.append(run(strategy, mode, arguments.resources, arguments.latency))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+    print("%-6s %-7s %8s %15s %10s %9s %12s" % ('model', 'mode', 'created', 'relation writes', 'ssm calls', 'seconds', 'approvals/s'))
+    for result in results:
+        print("%-6s %-7s %8d %15d %10d %9.2f %12.1f" % (result['strategy'], result['mode'], result['created'], result['relationWrites'], result['calls'], result['seconds'], result['created'] / result['seconds']))
+
+if __name__ == '__main__':
+    main()
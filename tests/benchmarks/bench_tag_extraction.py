@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import aws_stub
+
+#CPU cost of pulling the CloudFormation tags out of a synthetic Densify systems payload in WorkDispatcher:
+#getResourceTags against the previous extraction (three splits per matching attribute and a list lookup), and
+#the streamed parse plus projection that getCloudFormationTags runs over the response body.
+#
+#    python tests/benchmarks/bench_tag_extraction.py --systems 50000 --attributes 40
+cloudFormationTags = ['aws:cloudformation:stack-id', 'aws:cloudformation:logical-id', 'aws:cloudformation:stack-name']
+
+def previousGetResourceTags(attributes, tags_to_extract):
+
+    tags = {}
+    for attribute in attributes:
+        if attribute['id'] == "attr_resource_tags" and attribute['value'].split(" : ")[0] in tags_to_extract:
+            tags[attribute['value'].split(" : ")[0]] = attribute['value'].split(" : ")[1]
+
+    return tags
+
+def makeSystems(count, attributeCount):
+
+    systems = []
+    for index in range(count):
+        attributes = []
+        if index % 2 == 0:
+            attributes.append({'id': 'attr_resource_tags', 'value': 'aws:cloudformation:stack-id : arn:aws:cloudformation:us-east-1:123456789012:stack/stack-' + str(index % 500) + '/1'})
+            attributes.append({'id': 'attr_resource_tags', 'value': 'aws:cloudformation:logical-id : Server' + str(index)})
+            attributes.append({'id': 'attr_resource_tags', 'value': 'aws:cloudformation:stack-name : stack-' + str(index % 500)})
+        for tag in range(5):
+            attributes.append({'id': 'attr_resource_tags', 'value': 'team-' + str(tag) + ' : value-' + str(index)})
+        while len(attributes) < attributeCount:
+            attributes.append({'id': 'attr_' + str(len(attributes)), 'value': 'value ' + str(index)})
+        systems.append({'id': 'e-' + str(index), 'attributes': attributes})
+
+    return systems
+
+def measure(function):
+
+    start = time.perf_counter()
+    result = function()
+
+    return result, time.perf_counter() - start
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--systems', type=int, default=50000)
+    parser.add_argument('--attributes', type=int, default=40)
+    arguments = parser.parse_args()
+
+    work_dispatcher = aws_stub.loadFunction('WorkDispatcher', aws_stub.AWSStub(), module='work_dispatcher')
+    systems = makeSystems(arguments.systems, arguments.attributes)
+    body = json.dumps(systems).encode('utf-8')
+
+    previous, previousSeconds = measure(lambda: [previousGetResourceTags(system['attributes'], cloudFormationTags) for system in systems])
+    current, currentSeconds = measure(lambda: [work_dispatcher.getResourceTags(system['attributes'], work_dispatcher.cloudFormationTagKeys) for system in systems])
+    assert previous == current
+
+    def streamed():
+        chunks = (body[index:index + 65536] for index in range(0, len(body), 65536))
+        tags = {}
+        for system in work_dispatcher.iterJsonArray(chunks):
+            projection = work_dispatcher.getCloudFormationTagProjection(system['attributes'])
+            if projection != {}:
+                tags[system['id']] = projection
+        return tags
+
+    tags, streamedSeconds = measure(streamed)
+
+    print(str(arguments.systems) + " systems x " + str(arguments.attributes) + " attributes, " + str(round(len(body) / 1048576.0, 1)) + " MB payload")
+    print("previous getResourceTags: %7.3f s" % previousSeconds)
+    print("getResourceTags:          %7.3f s" % currentSeconds)
+    print("streamed parse + project: %7.3f s (%d systems with stack tags)" % (streamedSeconds, len(tags)))
+
+if __name__ == '__main__':
+    main()
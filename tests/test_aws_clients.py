@@ -0,0 +1,116 @@
+import botocore.exceptions
+import aws_stub
+
+def load(stub, monkeypatch, attempts=4):
+
+    monkeypatch.setenv('ApiRetryAttempts', str(attempts))
+    aws_clients = aws_stub.loadFunction('ProcessNewRecommendations', stub, module='aws_clients')
+    #no backoff delay between attempts
+    monkeypatch.setattr(aws_clients.random, 'uniform', lambda low, high: 0)
+
+    return aws_clients
+
+def failing(failures, response=None):
+
+    attempts = []
+
+    def operation(**params):
+        attempts.append(params)
+        if len(failures) > 0:
+            raise failures.pop(0)
+        return response
+
+    return operation, attempts
+
+def test_throttled_calls_are_retried(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch)
+    stub.ssm_get_parameter, attempts = failing([aws_stub.clientError('GetParameter', 'ThrottlingException', 'Rate exceeded'), aws_stub.clientError('GetParameter', 'ServiceUnavailable', 'Unavailable', 503)], {'Parameter': {'Value': 'v'}})
+    throttleCount = aws_clients.getThrottleCount()
+
+    assert aws_clients.call('ssm', 'get_parameter', Name='/a')['Parameter']['Value'] == 'v'
+    assert len(attempts) == 3
+    assert aws_clients.getThrottleCount() == throttleCount + 1
+
+def test_connection_errors_are_retried(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch)
+    stub.ssm_get_parameter, attempts = failing([botocore.exceptions.EndpointConnectionError(endpoint_url='https://ssm.us-east-1.amazonaws.com')], {'Parameter': {'Value': 'v'}})
+
+    assert aws_clients.call('ssm', 'get_parameter', Name='/a')['Parameter']['Value'] == 'v'
+    assert len(attempts) == 2
+
+def test_non_retryable_errors_are_raised_at_once(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch)
+
+    try:
+        aws_clients.call('ssm', 'get_parameter', Name='/missing')
+        assert False
+    except aws_clients.AWSCallError as error:
+        assert (error.code, error.retryable, error.operation) == ('ParameterNotFound', False, 'get_parameter')
+
+    assert stub.calls['ssm:get_parameter'] == 1
+
+def test_retries_are_bounded(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch, attempts=3)
+    stub.ssm_get_parameter, attempts = failing([aws_stub.clientError('GetParameter', 'ThrottlingException', 'Rate exceeded') for attempt in range(5)])
+
+    try:
+        aws_clients.call('ssm', 'get_parameter', Name='/a')
+        assert False
+    except aws_clients.AWSCallError as error:
+        assert (error.code, error.retryable) == ('ThrottlingException', True)
+
+    assert len(attempts) == 3
+
+def test_return_false_on_error_only_hides_non_retryable_errors(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch, attempts=1)
+
+    @aws_clients.returnFalseOnError
+    def getParameter(name):
+        return aws_clients.call('ssm', 'get_parameter', Name=name)
+
+    assert getParameter('/missing') == False
+
+    stub.ssm_get_parameter, attempts = failing([aws_stub.clientError('GetParameter', 'ThrottlingException', 'Rate exceeded')])
+    try:
+        getParameter('/a')
+        assert False
+    except aws_clients.AWSCallError as error:
+        assert error.retryable == True
+
+def test_token_bucket_paces_calls_beyond_its_burst(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    aws_clients = load(stub, monkeypatch)
+    delays = []
+    monkeypatch.setattr(aws_clients.time, 'sleep', lambda seconds: delays.append(seconds))
+    bucket = aws_clients.TokenBucket(10)
+
+    for index in range(15):
+        bucket.acquire()
+
+    #the first 10 calls use the burst, every further call waits a tenth of a second longer than the one before
+    assert len(delays) == 5
+    for index, delay in enumerate(delays):
+        assert abs(delay - 0.1 * (index + 1)) < 0.02
+
+def test_families_share_a_rate_per_region(monkeypatch):
+
+    monkeypatch.setenv('ApiRateLimits', '{"ssm:tags": 5}')
+    aws_clients = load(aws_stub.AWSStub(), monkeypatch)
+
+    assert aws_clients.getFamily('ssm', 'add_tags_to_resource') == 'ssm:tags'
+    assert aws_clients.getFamily('ssm', 'delete_maintenance_window') == 'ssm:default'
+    assert aws_clients.getRate('ssm:tags') == 5
+    assert aws_clients.getRate('ssm:write') == 10
+    assert aws_clients.getBucket('ssm:tags', 'us-east-1') is aws_clients.getBucket('ssm:tags', 'us-east-1')
+    assert aws_clients.getBucket('ssm:tags', 'us-east-1') is not aws_clients.getBucket('ssm:tags', 'eu-west-1')
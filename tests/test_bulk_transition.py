@@ -0,0 +1,50 @@
+import json
+import aws_stub
+
+stackName = 'web-stack'
+
+def seedInsights(stub, count):
+
+    for index in range(count):
+        parameterKey = aws_stub.seedInsight(stub, stackName, 'i-' + str(index))
+        stub.parameters[parameterKey]['History'][-1]['Labels'] = ['Initialize']
+
+def approveStack(lambda_function, nextToken=None):
+
+    body = {'region': 'us-east-1', 'stackName': stackName}
+    if nextToken != None:
+        body['nextToken'] = nextToken
+
+    response = lambda_function.lambda_handler({'resource': '/approve-bulk', 'body': json.dumps(body)}, None)
+
+    return response['statusCode'], json.loads(response['body'])
+
+def test_bulk_requests_are_paged_by_the_item_limit(monkeypatch):
+
+    monkeypatch.setenv('MaxBulkItems', '2')
+    stub = aws_stub.AWSStub()
+    seedInsights(stub, 5)
+    lambda_function = aws_stub.loadFunction('APIManageInsight', stub)
+
+    pages = []
+    nextToken = None
+    while True:
+        statusCode, body = approveStack(lambda_function, nextToken)
+        assert statusCode == 200
+        pages.append([result['parameterKey'] for result in body['results']])
+        if 'nextToken' not in body:
+            break
+        nextToken = body['nextToken']
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    insightKeys = sorted(name for name in stub.parameters if name.startswith('/densify/iaas/'))
+    assert sorted(sum(pages, [])) == insightKeys
+    assert all(stub.parameters[name]['History'][-1]['Labels'] == ['Approved'] for name in insightKeys)
+
+def test_default_item_limit_fits_the_write_rate_in_the_api_timeout(monkeypatch):
+
+    monkeypatch.delenv('MaxBulkItems', raising=False)
+    monkeypatch.setenv('ApiRateLimits', '{"ssm:write": 10}')
+    lambda_function = aws_stub.loadFunction('APIManageInsight', aws_stub.AWSStub())
+
+    assert lambda_function.getMaxBulkItems() == 100
@@ -0,0 +1,97 @@
+import json
+import aws_stub
+
+stackName = 'web-stack'
+
+def parameterKey(resourceId):
+
+    return '/densify/iaas/ec2/' + resourceId + '/instanceType'
+
+def seedInsight(stub, resourceId, **tags):
+
+    return aws_stub.seedInsight(stub, stackName, resourceId, **tags)
+
+def record(messageId, resourceId, label):
+
+    return {'messageId': messageId, 'body': json.dumps({'detail': {'name': parameterKey(resourceId), 'label': label}})}
+
+def load(stub, responses=None):
+
+    lambda_function = aws_stub.loadFunction('CollaborationOrchestrator', stub)
+    requests = []
+
+    def executeFunction(function, **kwargs):
+        requests.append((function, kwargs))
+        return (responses or {}).get(function, {'failed': []})
+
+    lambda_function.itsm_adapter.executeFunction = executeFunction
+    lambda_function.connection_settings.getConnectionSettings = lambda: {'densifyURL': 'https://densify.example.com'}
+
+    return lambda_function, requests
+
+def failures(response):
+
+    return sorted(failure['itemIdentifier'] for failure in response['batchItemFailures'])
+
+def test_scheduled_record_without_ticket_fails_only_itself():
+
+    stub = aws_stub.AWSStub()
+    seedInsight(stub, 'i-1', itsmTicketId='T1')
+    seedInsight(stub, 'i-2')
+    stub.putWindow('mw-' + stackName)
+    lambda_function, requests = load(stub)
+
+    response = lambda_function.lambda_handler({'Records': [record('m1', 'i-1', 'Scheduled'), record('m2', 'i-2', 'Scheduled')]}, None)
+
+    assert failures(response) == ['m2']
+    assert [(function, kwargs['ticketIds']) for function, kwargs in requests] == [('scheduleBatch', ['T1'])]
+
+def test_unreadable_message_fails_only_itself():
+
+    stub = aws_stub.AWSStub()
+    seedInsight(stub, 'i-1', itsmTicketId='T1')
+    stub.putWindow('mw-' + stackName)
+    lambda_function, requests = load(stub)
+
+    response = lambda_function.lambda_handler({'Records': [record('m1', 'i-1', 'Scheduled'), {'messageId': 'm2', 'body': '{not json'}]}, None)
+
+    assert failures(response) == ['m2']
+
+def test_scheduled_events_of_a_stack_share_one_ticket_update():
+
+    stub = aws_stub.AWSStub()
+    for index in range(5):
+        seedInsight(stub, 'i-' + str(index), itsmTicketId='T' + str(index))
+    stub.putWindow('mw-' + stackName)
+    lambda_function, requests = load(stub, {'scheduleBatch': {'failed': ['T3']}})
+
+    response = lambda_function.lambda_handler({'Records': [record('m' + str(index), 'i-' + str(index), 'Scheduled') for index in range(5)]}, None)
+
+    assert failures(response) == ['m3']
+    assert len(requests) == 1
+    assert sorted(requests[0][1]['ticketIds']) == ['T0', 'T1', 'T2', 'T3', 'T4']
+
+def test_failed_report_attachment_fails_its_record():
+
+    stub = aws_stub.AWSStub()
+    seedInsight(stub, 'i-1')
+    lambda_function, requests = load(stub, {'open': {'ticketId': 'T1'}, 'attach': False})
+
+    response = lambda_function.lambda_handler({'Records': [record('m1', 'i-1', 'Initialize')]}, None)
+
+    assert failures(response) == ['m1']
+    assert stub.tags[('Parameter', parameterKey('i-1'))]['itsmTicketId'] == 'T1'
+
+def test_closed_without_window_resolves_ops_items():
+
+    stub = aws_stub.AWSStub()
+    opsItemId = stub.ssm_create_ops_item('request', 'Densify', 'title', OperationalData={'cloudformation:stack-name': {'Value': stackName, 'Type': 'SearchableString'}})['OpsItemId']
+    seedInsight(stub, 'i-1', opsItemId=opsItemId)
+    seedInsight(stub, 'i-2')
+    lambda_function, requests = load(stub)
+
+    response = lambda_function.lambda_handler({'Records': [record('m1', 'i-1', 'Closed'), record('m2', 'i-2', 'Closed')]}, None)
+
+    assert failures(response) == ['m2']
+    assert stub.opsItems[opsItemId]['Status'] == 'Resolved'
+    assert 'opsItemId' not in stub.tags[('Parameter', parameterKey('i-1'))]
@@ -0,0 +1,53 @@
+import aws_stub
+
+passwordKey = '/densify/config/connectionSettings/password'
+
+def seedSettings(stub):
+
+    stub.putParameter('/densify/config/connectionSettings/url', 'https://densify.example.com')
+    stub.putParameter('/densify/config/connectionSettings/username', 'densify')
+    stub.putParameter(passwordKey, 'old-password')
+    stub.putParameter('/densify/config/lastUpdatedTimestamp', '2026-01-01T00:00:00')
+
+def test_settings_are_served_from_the_cache_within_the_ttl(monkeypatch):
+
+    monkeypatch.setenv('SettingsCacheTTL', '300')
+    stub = aws_stub.AWSStub()
+    seedSettings(stub)
+    connection_settings = aws_stub.loadFunction('WorkDispatcher', stub, module='connection_settings')
+
+    assert connection_settings.getConnectionSettings()['densifyPass'] == 'old-password'
+    stub.putParameter(passwordKey, 'new-password')
+
+    assert connection_settings.getConnectionSettings()['densifyPass'] == 'old-password'
+    assert stub.callCount('ssm:') == 1
+
+def test_rotated_settings_are_reloaded_after_the_ttl(monkeypatch):
+
+    monkeypatch.setenv('SettingsCacheTTL', '0')
+    stub = aws_stub.AWSStub()
+    seedSettings(stub)
+    connection_settings = aws_stub.loadFunction('CollaborationOrchestrator', stub, module='connection_settings')
+
+    assert connection_settings.getConnectionSettings()['densifyPass'] == 'old-password'
+
+    #the insight push timestamp is unrelated to the settings and must not keep a rotated password out
+    stub.putParameter(passwordKey, 'new-password')
+
+    assert connection_settings.getConnectionSettings()['densifyPass'] == 'new-password'
+
+def test_unchanged_settings_are_not_decrypted_again(monkeypatch):
+
+    monkeypatch.setenv('SettingsCacheTTL', '0')
+    stub = aws_stub.AWSStub()
+    seedSettings(stub)
+    connection_settings = aws_stub.loadFunction('WorkDispatcher', stub, module='connection_settings')
+    connection_settings.getConnectionSettings()
+
+    stub.putParameter('/densify/config/lastUpdatedTimestamp', '2026-01-02T00:00:00')
+    decrypted = []
+    getParameters = stub.ssm_get_parameters
+    stub.ssm_get_parameters = lambda Names, WithDecryption=False: decrypted.append(WithDecryption) or getParameters(Names, WithDecryption)
+
+    assert connection_settings.getConnectionSettings()['densifyPass'] == 'old-password'
+    assert decrypted == [False]
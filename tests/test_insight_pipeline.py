@@ -0,0 +1,185 @@
+import aws_stub
+
+stackName = 'web-stack'
+
+class Context:
+
+    function_name = 'ProcessNewRecommendations'
+
+    def __init__(self, remainingMillis):
+        self.remainingMillis = list(remainingMillis)
+
+    #each call consumes the next value, the last one is repeated
+    def get_remaining_time_in_millis(self):
+        if len(self.remainingMillis) > 1:
+            return self.remainingMillis.pop(0)
+        return self.remainingMillis[0]
+
+def makeInsight(resourceId, recommendedType='m5.large'):
+
+    return {
+        'serviceType': 'EC2',
+        'resourceId': resourceId,
+        'name': resourceId,
+        'entityId': resourceId,
+        'regionId': 'us-east-1',
+        'currentType': 'm5.xlarge',
+        'recommendedType': recommendedType,
+        'savingsEstimate': '12.5',
+        'cloudformation:stack-name': stackName,
+        'cloudformation:stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/' + stackName + '/1',
+        'cloudformation:logical-id': resourceId
+    }
+
+def parameterKey(resourceId):
+
+    return '/densify/iaas/ec2/' + resourceId + '/instanceType'
+
+def seed(stub, lambda_function, insight, **tags):
+
+    insightTags = lambda_function.insightToTags(insight)
+    insightTags.update(tags)
+    stub.putParameter(parameterKey(insight['resourceId']), insight['currentType'], tags=insightTags, labels=['Initialize'])
+
+def load(stub, monkeypatch):
+
+    monkeypatch.setenv('ThreadPoolSize', '2')
+    monkeypatch.setenv('CancellationThreshold', '300')
+    monkeypatch.setenv('TimeReserveMillis', '60000')
+    monkeypatch.setenv('ProcessingMode', 'pipeline')
+
+    return aws_stub.loadFunction('ProcessNewRecommendations', stub)
+
+def read(stub, lambda_function, insight):
+
+    parameters = lambda_function.ssm_functions.getParameters([parameterKey(insight['resourceId'])], region='us-east-1')
+
+    return lambda_function.readInsight([parameterKey(insight['resourceId']), insight, parameters])
+
+def labels(stub, resourceId):
+
+    return stub.parameters[parameterKey(resourceId)]['History'][-1]['Labels']
+
+def test_read_stage_reads_the_ops_item_of_a_changed_recommendation(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    opsItemId = stub.ssm_create_ops_item('request', 'Densify', 'title')['OpsItemId']
+    seed(stub, lambda_function, makeInsight('i-1'), opsItemId=opsItemId)
+
+    state = read(stub, lambda_function, makeInsight('i-1', 'm5.2xlarge'))
+
+    assert state['changed']['hasInsightChanged'] == True
+    assert state['opsItem']['OpsItem']['OpsItemId'] == opsItemId
+    assert read(stub, lambda_function, makeInsight('i-2'))['parameter'] == False
+
+def test_unchanged_insight_is_not_written(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    seed(stub, lambda_function, makeInsight('i-1'), itsmTicketId='T1')
+    stub.calls.clear()
+
+    lambda_function.lambda_handler([makeInsight('i-1')], Context([900000]))
+
+    assert stub.calls['ssm:put_parameter'] + stub.calls['ssm:add_tags_to_resource'] + stub.calls['ssm:remove_tags_from_resource'] + stub.calls['ssm:label_parameter_version'] == 0
+
+def test_plan_stage_keeps_ticket_tags_while_synchronizing(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    seed(stub, lambda_function, makeInsight('i-1'), itsmTicketId='T1')
+    insight = makeInsight('i-1')
+    insight['savingsEstimate'] = '20.0'
+
+    plan = lambda_function.planInsight(read(stub, lambda_function, insight))
+
+    assert plan['status'] == 'synchronized'
+    assert plan['itsmTicketId'] == 'T1'
+    assert dict((tag['Key'], tag['Value']) for tag in plan['addTags'])['savingsEstimate'] == '20.0'
+    assert stub.callCount('ssm:add_tags') == 0
+
+def test_plan_stage_initializes_a_changed_recommendation(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    opsItemId = stub.ssm_create_ops_item('request', 'Densify', 'title')['OpsItemId']
+    seed(stub, lambda_function, makeInsight('i-1'), opsItemId=opsItemId, itsmTicketId='T1')
+
+    plan = lambda_function.planInsight(read(stub, lambda_function, makeInsight('i-1', 'm5.2xlarge')))
+
+    assert (plan['status'], plan['opsItemId'], plan['itsmTicketId']) == ('initialized', opsItemId, 'T1')
+
+def test_write_stage_resolves_puts_tags_and_labels(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    opsItemId = stub.ssm_create_ops_item('request', 'Densify', 'title')['OpsItemId']
+    seed(stub, lambda_function, makeInsight('i-1'), opsItemId=opsItemId, itsmTicketId='T1')
+    plan = lambda_function.planInsight(read(stub, lambda_function, makeInsight('i-1', 'm5.2xlarge')))
+
+    outcomes = lambda_function.applyInsightPlans([plan], 2, {}, lambda: True)
+
+    assert outcomes == [{'parameterKey': parameterKey('i-1'), 'status': 'initialized', 'resolvedOpsItems': [opsItemId], 'cancelTickets': ['T1']}]
+    assert stub.opsItems[opsItemId]['Status'] == 'Resolved'
+    assert stub.tags[('Parameter', parameterKey('i-1'))]['recommendedType'] == 'm5.2xlarge'
+    assert 'itsmTicketId' not in stub.tags[('Parameter', parameterKey('i-1'))]
+    assert labels(stub, 'i-1') == ['Initialize']
+
+def test_write_stage_defers_tags_and_label_together(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    seed(stub, lambda_function, makeInsight('i-1'), itsmTicketId='T1')
+    plan = lambda_function.planInsight(read(stub, lambda_function, makeInsight('i-1', 'm5.2xlarge')))
+    remaining = [True, False]
+
+    outcomes = lambda_function.applyInsightPlans([plan], 2, {}, lambda: remaining.pop(0))
+
+    assert outcomes[0]['status'] == 'deferred' and outcomes[0]['cancelTickets'] == []
+    assert stub.tags[('Parameter', parameterKey('i-1'))]['recommendedType'] == 'm5.large'
+    assert labels(stub, 'i-1') == []
+
+def test_write_groups_fit_the_rate_within_the_reserve(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    monkeypatch.setenv('ApiRateLimits', '{"ssm:write": 10, "ssm:tags": 10}')
+
+    assert lambda_function.getWriteGroupSize('ssm:write', 1) == 300
+    assert lambda_function.getWriteGroupSize('ssm:tags', 2) == 150
+
+def test_batch_read_into_the_reserve_is_handed_back_whole(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    tasks = [[parameterKey('i-' + str(index)), makeInsight('i-' + str(index)), {}] for index in range(4)]
+    applied = []
+
+    result = lambda_function.insight_pipeline.run(lambda_function.readInsight, lambda_function.planInsight, lambda plans, concurrency, timings, hasTime: applied.extend(plans) or [], lambda_function.insightError, tasks, Context([120000, 1000]), 2, 60000, 10)
+
+    assert applied == [] and result['results'] == []
+    assert result['unfinished'] == tasks
+    assert 'read' in result['timings']
+
+def test_deferred_insights_are_labelled_by_the_continuation(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    for index in range(3):
+        seed(stub, lambda_function, makeInsight('i-' + str(index)), itsmTicketId='T' + str(index))
+    insights = [makeInsight('i-' + str(index), 'm5.2xlarge') for index in range(3)]
+
+    #enough time to read, plan and put, but not to start the tag group
+    lambda_function.lambda_handler(insights, Context([120000, 120000, 120000, 1000]))
+
+    assert [labels(stub, 'i-' + str(index)) for index in range(3)] == [[], [], []]
+    assert len(stub.invocations) == 1
+    continuation = stub.invocations[0]['Payload']
+    assert [insight['resourceId'] for insight in continuation['insights']] == ['i-0', 'i-1', 'i-2']
+
+    stub.invocations.clear()
+    lambda_function.lambda_handler(continuation, Context([900000]))
+
+    assert [labels(stub, 'i-' + str(index)) for index in range(3)] == [['Initialize']] * 3
+    assert sorted(stub.invocations[0]['Payload']['ticketIds']) == ['T0', 'T1', 'T2']
@@ -0,0 +1,104 @@
+import json
+import aws_stub
+
+queueUrl = 'https://sqs.us-east-1.amazonaws.com/123456789012/ProcessNewRecommendations.fifo'
+
+class Context:
+
+    function_name = 'ProcessNewRecommendations'
+
+    def __init__(self, remainingMillis):
+        self.remainingMillis = remainingMillis
+
+    def get_remaining_time_in_millis(self):
+        return self.remainingMillis
+
+def insight(stackName, resourceId):
+
+    return {
+        'serviceType': 'EC2',
+        'resourceId': resourceId,
+        'name': resourceId,
+        'entityId': resourceId,
+        'regionId': 'us-east-1',
+        'recommendedType': 'm5.large',
+        'cloudformation:stack-name': stackName,
+        'cloudformation:stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/' + stackName + '/1',
+        'cloudformation:logical-id': resourceId
+    }
+
+def test_chunks_of_a_stack_share_one_message_group(monkeypatch):
+
+    monkeypatch.setenv('InsightQueueUrl', queueUrl)
+    monkeypatch.setenv('MaxPayloadBytes', '2048')
+    stub = aws_stub.AWSStub()
+    work_dispatcher = aws_stub.loadFunction('WorkDispatcher', stub, module='work_dispatcher')
+    stacks = {}
+    for stackName in ('web', 'db'):
+        stacks[stackName] = [insight(stackName, stackName + '-' + str(index)) for index in range(12)]
+    final_list = dict((insights[0]['cloudformation:stack-id'], insights) for insights in stacks.values())
+
+    summary = work_dispatcher.dispatchJobs(final_list)
+
+    assert summary['failed'] == [] and summary['insights'] == 24
+    groups = {}
+    for message in stub.messages:
+        stackNames = set(queued['cloudformation:stack-name'] for queued in message['Body'])
+        assert len(stackNames) == 1
+        groups.setdefault(message['MessageGroupId'], set()).update(stackNames)
+    assert sorted(groups.values(), key=sorted) == [{'db'}, {'web'}]
+    assert len(stub.messages) > len(groups)
+
+def test_unfinished_insights_stay_in_the_stack_message_group(monkeypatch):
+
+    monkeypatch.setenv('InsightQueueUrl', queueUrl)
+    monkeypatch.setenv('ThreadPoolSize', '2')
+    monkeypatch.setenv('TimeReserveMillis', '60000')
+    stub = aws_stub.AWSStub()
+    lambda_function = aws_stub.loadFunction('ProcessNewRecommendations', stub)
+    insights = [insight('web', 'web-' + str(index)) for index in range(3)]
+    record = {'messageId': 'm1', 'body': json.dumps(insights), 'attributes': {'MessageGroupId': 'group-web'}}
+
+    lambda_function.lambda_handler({'Records': [record]}, Context(1000))
+
+    assert stub.invocations == []
+    assert len(stub.messages) == 1
+    assert stub.messages[0]['MessageGroupId'] == 'group-web'
+    assert [queued['resourceId'] for queued in stub.messages[0]['Body']['insights']] == ['web-0', 'web-1', 'web-2']
+
+def test_continuation_without_progress_is_not_deduplicated(monkeypatch):
+
+    monkeypatch.setenv('InsightQueueUrl', queueUrl)
+    monkeypatch.setenv('ThreadPoolSize', '2')
+    monkeypatch.setenv('TimeReserveMillis', '60000')
+    stub = aws_stub.AWSStub()
+    lambda_function = aws_stub.loadFunction('ProcessNewRecommendations', stub)
+    continuation = {'insights': [insight('web', 'web-' + str(index)) for index in range(3)], 'resolvedOpsItems': ['oi-1']}
+
+    for messageId in ('m1', 'm2'):
+        record = {'messageId': messageId, 'body': json.dumps(continuation), 'attributes': {'MessageGroupId': 'group-web'}}
+        lambda_function.lambda_handler({'Records': [record]}, Context(1000))
+
+    assert len(stub.messages) == 2
+    assert stub.messages[0]['Body'] == continuation and stub.messages[1]['Body'] == continuation
+    assert stub.messages[0]['MessageDeduplicationId'] != stub.messages[1]['MessageDeduplicationId']
+
+def test_continuations_stay_under_the_payload_limit(monkeypatch):
+
+    monkeypatch.setenv('InsightQueueUrl', queueUrl)
+    monkeypatch.setenv('ThreadPoolSize', '2')
+    monkeypatch.setenv('TimeReserveMillis', '60000')
+    monkeypatch.setenv('MaxPayloadBytes', '2048')
+    stub = aws_stub.AWSStub()
+    lambda_function = aws_stub.loadFunction('ProcessNewRecommendations', stub)
+    insights = [insight('web', 'web-' + str(index)) for index in range(20)]
+    continuation = {'insights': insights, 'resolvedOpsItems': ['oi-' + str(index) for index in range(10)]}
+    record = {'messageId': 'm1', 'body': json.dumps(continuation), 'attributes': {'MessageGroupId': 'group-web'}}
+
+    lambda_function.lambda_handler({'Records': [record]}, Context(1000))
+
+    assert len(stub.messages) > 1
+    for message in stub.messages:
+        assert len(json.dumps(message['Body']).encode('utf-8')) <= 2048
+        assert sorted(message['Body']['resolvedOpsItems']) == sorted(continuation['resolvedOpsItems'])
+    assert [queued['resourceId'] for message in stub.messages for queued in message['Body']['insights']] == [queued['resourceId'] for queued in insights]
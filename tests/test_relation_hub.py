@@ -0,0 +1,100 @@
+import aws_stub
+
+stackName = 'web-stack'
+
+def approve(lambda_function, parameterKey):
+
+    lambda_function.lambda_handler({'detail': {'name': parameterKey, 'label': 'Approved'}}, None)
+
+def close(lambda_function, parameterKey):
+
+    lambda_function.lambda_handler({'detail': {'name': parameterKey, 'label': 'Closed'}}, None)
+
+def load(stub):
+
+    lambda_function = aws_stub.loadFunction('CollaborationOrchestrator', stub)
+    lambda_function.connection_settings.getConnectionSettings = lambda: {'densifyURL': 'https://densify.example.com'}
+
+    return lambda_function
+
+def hubs(stub, status='Open'):
+
+    return [opsItem for opsItem in stub.opsItems.values() if 'relationHubFor' in opsItem['OperationalData'] and opsItem['Status'] == status]
+
+def test_single_approvals_relate_through_one_hub():
+
+    stub = aws_stub.AWSStub()
+    parameterKeys = [aws_stub.seedInsight(stub, stackName, 'i-' + str(index)) for index in range(4)]
+    lambda_function = load(stub)
+
+    for parameterKey in parameterKeys:
+        approve(lambda_function, parameterKey)
+
+    hub = hubs(stub)
+    assert len(hub) == 1
+    opsItemIds = [stub.tags[('Parameter', parameterKey)]['opsItemId'] for parameterKey in parameterKeys]
+    assert sorted(related['OpsItemId'] for related in hub[0]['RelatedOpsItems']) == sorted(opsItemIds)
+    for opsItemId in opsItemIds:
+        assert stub.opsItems[opsItemId]['RelatedOpsItems'] == [{'OpsItemId': hub[0]['OpsItemId']}]
+
+    #one hub write per approval instead of a write to every neighbour
+    assert stub.calls['ssm:update_ops_item'] == len(parameterKeys)
+
+def test_hub_is_not_listed_with_the_stack():
+
+    stub = aws_stub.AWSStub()
+    parameterKey = aws_stub.seedInsight(stub, stackName, 'i-1')
+    lambda_function = load(stub)
+
+    approve(lambda_function, parameterKey)
+
+    lambda_function.opsitem_index.reset()
+    assert lambda_function.opsitem_index.getStackOpsItemIds(stackName) == [stub.tags[('Parameter', parameterKey)]['opsItemId']]
+
+def test_closing_the_last_item_resolves_the_hub():
+
+    stub = aws_stub.AWSStub()
+    parameterKeys = [aws_stub.seedInsight(stub, stackName, 'i-' + str(index)) for index in range(2)]
+    lambda_function = load(stub)
+    for parameterKey in parameterKeys:
+        approve(lambda_function, parameterKey)
+    hubId = hubs(stub)[0]['OpsItemId']
+    opsItemIds = [stub.tags[('Parameter', parameterKey)]['opsItemId'] for parameterKey in parameterKeys]
+
+    close(lambda_function, parameterKeys[0])
+
+    assert stub.opsItems[hubId]['RelatedOpsItems'] == [{'OpsItemId': opsItemIds[1]}]
+
+    close(lambda_function, parameterKeys[1])
+
+    assert stub.opsItems[hubId]['Status'] == 'Resolved'
+
+def test_concurrent_invocations_share_one_hub():
+
+    stub = aws_stub.AWSStub()
+    parameterKeys = [aws_stub.seedInsight(stub, stackName, 'i-' + str(index)) for index in range(2)]
+    first = load(stub)
+    second = load(stub)
+    #the second invocation listed the stack before the first one created its hub
+    second.relation_hub.findHubs = lambda stackName, region=None: []
+
+    approve(first, parameterKeys[0])
+    approve(second, parameterKeys[1])
+
+    hub = hubs(stub)
+    assert len(hub) == 1
+    assert sorted(related['OpsItemId'] for related in hub[0]['RelatedOpsItems']) == sorted(stub.tags[('Parameter', parameterKey)]['opsItemId'] for parameterKey in parameterKeys)
+
+def test_group_without_new_ops_items_creates_no_hub():
+
+    stub = aws_stub.AWSStub()
+    parameterKey = aws_stub.seedInsight(stub, stackName, 'i-1')
+    stub.ssm_create_ops_item('request', 'Densify', 'title', OperationalData={
+        'cloudformation:stack-name': {'Value': stackName, 'Type': 'SearchableString'},
+        'parameterKey': {'Value': parameterKey, 'Type': 'SearchableString'}
+    })
+    lambda_function = load(stub)
+
+    approve(lambda_function, parameterKey)
+
+    assert hubs(stub) == []
@@ -0,0 +1,34 @@
+import os
+import aws_stub
+
+tags = {'stack-name': 'web-stack', 'logical-id': 'Server', 'stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/web-stack/1'}
+
+def load(monkeypatch, tmp_path):
+
+    monkeypatch.setenv('SystemTagIndexPath', str(tmp_path / 'system_tags.json'))
+
+    return aws_stub.loadFunction('WorkDispatcher', aws_stub.AWSStub(), module='system_tag_index')
+
+def test_index_is_only_written_when_a_system_changes(monkeypatch, tmp_path):
+
+    system_tag_index = load(monkeypatch, tmp_path)
+    saves = []
+    save = system_tag_index.save
+    monkeypatch.setattr(system_tag_index, 'save', lambda: saves.append(1) or save())
+
+    system_tag_index.update({'e-1': tags, 'e-2': {}})
+    system_tag_index.update({'e-1': dict(tags), 'e-2': {}})
+    assert len(saves) == 1
+
+    system_tag_index.update({'e-2': tags})
+    assert len(saves) == 2
+
+def test_index_survives_a_cold_start_without_temporary_files(monkeypatch, tmp_path):
+
+    system_tag_index = load(monkeypatch, tmp_path)
+    system_tag_index.update({'e-1': tags})
+
+    system_tag_index = load(monkeypatch, tmp_path)
+
+    assert system_tag_index.lookup(['e-1', 'e-2']) == {'e-1': tags}
+    assert os.listdir(str(tmp_path)) == ['system_tags.json']
@@ -0,0 +1,142 @@
+import aws_stub
+
+parameterKey = '/densify/iaas/ec2/i-1/instanceType'
+
+class Context:
+
+    function_name = 'ProcessNewRecommendations'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+def makeInsight(**values):
+
+    insight = {
+        'serviceType': 'EC2',
+        'resourceId': 'i-1',
+        'name': 'server-1',
+        'entityId': 'e-1',
+        'regionId': 'us-east-1',
+        'currentType': 'm5.xlarge',
+        'recommendedType': 'm5.large',
+        'cloudformation:stack-name': 'web-stack',
+        'cloudformation:stack-id': 'arn:aws:cloudformation:us-east-1:123456789012:stack/web-stack/1',
+        'cloudformation:logical-id': 'Server1'
+    }
+    insight.update(values)
+
+    return insight
+
+def recordTagWrites(stub):
+
+    writes = []
+    addTags = stub.ssm_add_tags_to_resource
+    removeTags = stub.ssm_remove_tags_from_resource
+    stub.ssm_add_tags_to_resource = lambda ResourceType, ResourceId, Tags: writes.append(('add', sorted(tag['Key'] for tag in Tags))) or addTags(ResourceType, ResourceId, Tags)
+    stub.ssm_remove_tags_from_resource = lambda ResourceType, ResourceId, TagKeys: writes.append(('remove', sorted(TagKeys))) or removeTags(ResourceType, ResourceId, TagKeys)
+
+    return writes
+
+def load(stub, monkeypatch):
+
+    monkeypatch.setenv('ThreadPoolSize', '2')
+    monkeypatch.setenv('CancellationThreshold', '300')
+
+    return aws_stub.loadFunction('ProcessNewRecommendations', stub)
+
+def test_diff_adds_changed_and_new_keys_and_removes_stale_ones(monkeypatch):
+
+    lambda_function = load(aws_stub.AWSStub(), monkeypatch)
+
+    diff = lambda_function.diffTags({'a': '1', 'b': '2', 'stale': 'x'}, {'a': '1', 'b': '3', 'c': '4'})
+
+    assert sorted((tag['Key'], tag['Value']) for tag in diff['add']) == [('b', '3'), ('c', '4')]
+    assert diff['remove'] == ['stale']
+
+def test_empty_diff_writes_nothing(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    writes = recordTagWrites(stub)
+
+    assert lambda_function.applyTagDiff(parameterKey, {'a': '1'}, {'add': [], 'remove': []}, 'us-east-1') == True
+    assert writes == []
+
+def test_diff_adds_before_removing_below_the_tag_limit(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    current = {'a': '1', 'stale': 'x'}
+    stub.putParameter(parameterKey, 'm5.xlarge', tags=current)
+    writes = recordTagWrites(stub)
+
+    assert lambda_function.applyTagDiff(parameterKey, current, lambda_function.diffTags(current, {'a': '2', 'b': '3'}), 'us-east-1') == True
+
+    assert writes == [('add', ['a', 'b']), ('remove', ['stale'])]
+    assert stub.tags[('Parameter', parameterKey)] == {'a': '2', 'b': '3'}
+
+def test_diff_removes_first_when_adding_would_exceed_the_tag_limit(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    current = dict(('key' + str(index), 'value') for index in range(49))
+    desired = dict(('key' + str(index), 'value') for index in range(3, 49))
+    desired.update({'new0': 'value', 'new1': 'value', 'new2': 'value'})
+    stub.putParameter(parameterKey, 'm5.xlarge', tags=current)
+    writes = recordTagWrites(stub)
+
+    assert lambda_function.applyTagDiff(parameterKey, current, lambda_function.diffTags(current, desired), 'us-east-1') == True
+
+    assert writes == [('remove', ['key0', 'key1', 'key2']), ('add', ['new0', 'new1', 'new2'])]
+    assert stub.tags[('Parameter', parameterKey)] == desired
+
+def test_tag_values_are_truncated_to_the_parameter_store_limit(monkeypatch):
+
+    lambda_function = load(aws_stub.AWSStub(), monkeypatch)
+
+    tags = lambda_function.insightToTags(makeInsight(name='x' * 300))
+
+    assert tags['name'] == 'x' * lambda_function.maxTagValueLength
+
+def test_insight_with_too_many_tags_is_rejected(monkeypatch):
+
+    lambda_function = load(aws_stub.AWSStub(), monkeypatch)
+    insight = makeInsight()
+    for index in range(lambda_function.maxTagsPerResource):
+        insight['extra' + str(index)] = 'value'
+
+    try:
+        lambda_function.insightToTags(insight)
+        assert False
+    except Exception as error:
+        assert 'more than the ' + str(lambda_function.maxTagsPerResource) in str(error)
+
+def test_synchronizing_keeps_the_ticket_tags(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    tags = lambda_function.insightToTags(makeInsight())
+    tags.update({'itsmTicketId': 'T1', 'opsItemId': 'oi-1', 'approvalType': 'Approved'})
+    stub.putParameter(parameterKey, 'm5.xlarge', tags=tags, labels=['Approved'])
+    writes = recordTagWrites(stub)
+
+    lambda_function.lambda_handler([makeInsight(name='server-one')], Context())
+
+    assert writes == [('add', ['name'])]
+    assert stub.tags[('Parameter', parameterKey)]['itsmTicketId'] == 'T1'
+    assert stub.tags[('Parameter', parameterKey)]['opsItemId'] == 'oi-1'
+    assert stub.parameters[parameterKey]['Version'] == 1
+
+def test_initializing_writes_one_add_and_one_remove(monkeypatch):
+
+    stub = aws_stub.AWSStub()
+    lambda_function = load(stub, monkeypatch)
+    tags = lambda_function.insightToTags(makeInsight())
+    tags.update({'itsmTicketId': 'T1'})
+    stub.putParameter(parameterKey, 'm5.xlarge', tags=tags, labels=['Initialize'])
+    writes = recordTagWrites(stub)
+
+    lambda_function.lambda_handler([makeInsight(recommendedType='m5.2xlarge', name='server-one')], Context())
+
+    assert writes == [('add', ['name', 'recommendedType']), ('remove', ['itsmTicketId'])]
+    assert stub.parameters[parameterKey]['History'][-1]['Labels'] == ['Initialize']